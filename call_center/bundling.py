@@ -0,0 +1,101 @@
+
+import ast
+import os
+import py_compile
+import shutil
+import sys
+
+# Minimal per-function Lambda artifacts: only the modules reachable from the handler
+# module (plus the data directory the modules memory-map), each with precompiled
+# bytecode, so the function does not unzip or compile code it never runs. The Lambda
+# file system is read-only, so without shipped bytecode every cold start compiles
+# every imported module again.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_DIR = os.path.join(ROOT_DIR, ".build")
+
+# function id -> (source directory, handler modules)
+BUNDLES = {
+    "getName": ("lambdas", ["getName"]),
+    "getInfo": ("lambdas/info", ["handler"]),
+    "verifyAddresses": ("lambdas/info", ["verify_addresses"])
+}
+
+# layer id -> (source directory, modules); layer modules are importable by every
+# function the layer is attached to, and are left out of the function bundles
+LAYERS = {
+    "commonLayer": ("lambdas/common", ["aws_clients", "deadline", "helpers", "idempotency", "lex_event", "metrics", "rate_limit", "resilience", "retry_engine", "session_store", "speech_timeouts"])
+}
+
+DATA_DIRS = ["data"]
+
+# bytecode is only used by the runtime if compiled by the same Python version
+RUNTIME_VERSION = (3, 12)
+
+
+def local_imports(path, source_dir):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+
+    # includes imports inside functions, e.g. the deferred handler import in helpers
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.add(node.module.split(".")[0])
+    return sorted(name for name in names if os.path.isfile(os.path.join(source_dir, name + ".py")))
+
+
+def module_closure(source_dir, entry_modules):
+    modules = set()
+    pending = list(entry_modules)
+    while pending:
+        module = pending.pop()
+        if module not in modules:
+            modules.add(module)
+            pending.extend(local_imports(os.path.join(source_dir, module + ".py"), source_dir))
+    return sorted(modules)
+
+
+def build(source_dir, entry_modules, output_dir, bundle_id):
+    source_dir = os.path.join(ROOT_DIR, source_dir)
+    os.makedirs(output_dir)
+
+    modules = module_closure(source_dir, entry_modules)
+    for module in modules:
+        shutil.copy2(os.path.join(source_dir, module + ".py"), output_dir)
+
+    for data_dir in DATA_DIRS:
+        if os.path.isdir(os.path.join(source_dir, data_dir)):
+            shutil.copytree(os.path.join(source_dir, data_dir), os.path.join(output_dir, data_dir))
+
+    # modules are shipped as sourceless bytecode: smaller, and nothing is compiled or
+    # stat'ed at import; tracebacks keep file names and line numbers
+    if sys.version_info[:2] == RUNTIME_VERSION:
+        for module in modules:
+            source = os.path.join(output_dir, module + ".py")
+            py_compile.compile(
+                source, cfile=source + "c", dfile=module + ".py", doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+            )
+            os.remove(source)
+    else:
+        print("bundling: Python {}.{} differs from the Lambda runtime {}.{}, shipping {} without bytecode".format(
+            *sys.version_info[:2], *RUNTIME_VERSION, bundle_id), file=sys.stderr)
+
+
+def bundle(function_id, build_dir=BUILD_DIR):
+    source_dir, entry_modules = BUNDLES[function_id]
+    output_dir = os.path.join(build_dir, function_id)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    build(source_dir, entry_modules, output_dir, function_id)
+    return output_dir
+
+
+def bundle_layer(layer_id, build_dir=BUILD_DIR):
+    # the Python runtime adds the python/ directory of each layer to sys.path
+    source_dir, modules = LAYERS[layer_id]
+    output_dir = os.path.join(build_dir, layer_id)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    build(source_dir, modules, os.path.join(output_dir, "python"), layer_id)
+    return output_dir
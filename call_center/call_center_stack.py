@@ -1,18 +1,53 @@
 from constructs import Construct
 from aws_cdk import (
+    CfnOutput,
     Duration,
     Stack,
     aws_dynamodb as dynamodb,
     aws_sns as sns,
+    aws_sqs as sqs,
     aws_lambda as _lambda,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_sns_subscriptions as subscriptions,
+    aws_secretsmanager as secretsmanager,
+    aws_ssm as ssm,
     aws_location_alpha as location,
-    aws_iam as iam
+    aws_iam as iam,
+    aws_applicationautoscaling as appscaling
 )
 import boto3
+import json
+
+from call_center import bundling
 
 #ssm = boto3.client('ssm')
 
+# Lambda tuning, overridable with the "lambda" CDK context value (all functions) and
+# "lambda:<function id>" (one function), e.g. cdk deploy -c lambda:getInfo='{"memorySize": 1024}'
+LAMBDA_DEFAULTS = {
+    "architecture": "arm64",            # arm64 | x86_64
+    "memorySize": 512,
+    "timeoutSeconds": 10,
+    "reservedConcurrency": None,
+    "provisionedConcurrency": 0,        # > 0 creates a "live" alias with provisioned concurrency
+    "businessHours": None               # {"minCapacity", "maxCapacity", "startCron", "endCron",
+                                        #  "offHoursCapacity"}; cron fields in UTC
+}
+
+# per function defaults over LAMBDA_DEFAULTS, still overridden by the "lambda:<id>" context
+FUNCTION_DEFAULTS = {
+    "verifyAddresses": {"timeoutSeconds": 60}   # a batch of searches paced by the rate limiter
+}
+
+# API calls per second, overridable with the "rateLimits" CDK context value: per Lambda
+# container ("location", "sns") and account wide through the shared counter table
+# ("locationShared", "snsShared"); keep the shared limits under the account quotas
+RATE_LIMIT_DEFAULTS = {
+    "location": 10,
+    "locationShared": 40,
+    "sns": 10,
+    "snsShared": 80
+}
 
 
 class CallCenterStack(Stack):
@@ -50,14 +85,87 @@ class CallCenterStack(Stack):
 
         addresstable = dynamodb.Table(self, "addressTable", partition_key=dynamodb.Attribute(name="address", type=dynamodb.AttributeType.STRING))
 
+        # HMAC key of the caller numbers that key the profiles; generated, and only readable by getInfo
+        callerHashKey = secretsmanager.Secret(self, "callerHashKey",
+            generate_secret_string=secretsmanager.SecretStringGenerator(password_length=64, exclude_punctuation=True)
+        )
+
+        # last confirmed address and email address of returning callers, keyed by a hash of the caller number
+        profiletable = dynamodb.Table(self, "callerProfileTable",
+            partition_key=dynamodb.Attribute(name="callerKey", type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute="expiresAt"
+        )
+
+        # responses of the confirmed turns, so that a repeated code hook invocation does not write or subscribe twice
+        idempotencytable = dynamodb.Table(self, "idempotencyTable",
+            partition_key=dynamodb.Attribute(name="idempotencyKey", type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute="expiresAt",
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # optional server side session attributes (CDK context "serverSideSessions": true); Lex then
+        # only carries a pointer to the session item version and the attributes the Connect flow reads
+        sessiontable = None
+        if self.node.try_get_context("serverSideSessions"):
+            sessiontable = dynamodb.Table(self, "sessionTable",
+                partition_key=dynamodb.Attribute(name="sessionId", type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name="version", type=dynamodb.AttributeType.NUMBER),
+                time_to_live_attribute="expiresAt",
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+            )
+
+        # per second call counters shared by all containers for the API rate limits
+        ratelimittable = dynamodb.Table(self, "rateLimitTable",
+            partition_key=dynamodb.Attribute(name="limitKey", type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute="expiresAt",
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+        rateLimits = dict(RATE_LIMIT_DEFAULTS, **(self.node.try_get_context("rateLimits") or {}))
+
+        # end-of-speech timeout policy table read by getInfo ("{}": the defaults in speech_timeouts);
+        # tools/tune_speech_timeouts.py writes the tuned table to it
+        speechTimeoutPolicy = ssm.StringParameter(self, "speechTimeoutPolicy",
+            string_value=json.dumps(self.node.try_get_context("speechTimeoutPolicy") or {})
+        )
+        CfnOutput(self, "speechTimeoutPolicyName", value=speechTimeoutPolicy.parameter_name)
+
+#---------------------------------------
+        #SQS
+#---------------------------------------
+
+        # addresses accepted without a Location match, verified later by the verifyAddresses worker
+        verificationDeadLetterQueue = sqs.Queue(self, "addressVerificationDeadLetterQueue",
+            retention_period=Duration.days(14)
+        )
+        # a message stays invisible for 6 worker timeouts, as recommended for SQS event sources
+        verificationQueue = sqs.Queue(self, "addressVerificationQueue",
+            visibility_timeout=Duration.seconds(6 * int(self.lambda_settings("verifyAddresses")["timeoutSeconds"])),
+            retention_period=Duration.days(4),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=verificationDeadLetterQueue)
+        )
+
+#---------------------------------------
+        #LAYERS
+#---------------------------------------
+        # dialog helpers, Lex event view, retry engine and AWS client factory shared by the bot Lambdas;
+        # a new layer version is published whenever the bundled modules change
+        commonLayer = _lambda.LayerVersion(self, "commonLayer",
+            code=_lambda.Code.from_asset(bundling.bundle_layer("commonLayer")),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            compatible_architectures=[_lambda.Architecture.ARM_64, _lambda.Architecture.X86_64],
+            description="Shared dialog helpers and AWS client factory"
+        )
+        CfnOutput(self, "commonLayerArn", value=commonLayer.layer_version_arn)
+
 #---------------------------------------
         #LAMBDAS
 #---------------------------------------
         #GETNAME LAMBDA
-        getName=_lambda.Function(
-            self, 'getName',
+        getName = self.tuned_function(
+            'getName',
             runtime=_lambda.Runtime.PYTHON_3_12,
-            code = _lambda.Code.from_asset("lambdas"),
+            code = _lambda.Code.from_asset(bundling.bundle("getName")),
+            layers=[commonLayer],
             environment={ 
                 "NAME_TABLE": nametable.table_name
             },
@@ -68,14 +176,27 @@ class CallCenterStack(Stack):
 
     
         #GETADDRESS LAMBDA
-        getInfo =_lambda.Function(
-            self, 'getInfo',
+        getInfo = self.tuned_function(
+            'getInfo',
             runtime=_lambda.Runtime.PYTHON_3_12,
-            code = _lambda.Code.from_asset("lambdas/info"),
+            code = _lambda.Code.from_asset(bundling.bundle("getInfo")),
+            layers=[commonLayer],
             environment={ 
                 "INDEX_NAME": place_index.place_index_name,
                 "ADDRESS_TABLE": addresstable.table_name,
-                "TOPIC_ARN": emailSubscriptionArn
+                "TOPIC_ARN": emailSubscriptionArn,
+                "PROFILE_TABLE": profiletable.table_name,
+                "CALLER_HASH_KEY_SECRET": callerHashKey.secret_arn,
+                "VERIFICATION_QUEUE_URL": verificationQueue.queue_url,
+                "LEX_RESPONSE_MODE": self.node.try_get_context("lexResponseMode") or "full",
+                "FULFILLMENT_UPDATES": "1" if self.node.try_get_context("fulfillmentUpdates") else "0",
+                "IDEMPOTENCY_TABLE": idempotencytable.table_name,
+                "RATE_LIMIT_TABLE": ratelimittable.table_name,
+                "LOCATION_RATE_LIMIT": str(rateLimits["location"]),
+                "LOCATION_SHARED_RATE_LIMIT": str(rateLimits["locationShared"]),
+                "SNS_RATE_LIMIT": str(rateLimits["sns"]),
+                "SNS_SHARED_RATE_LIMIT": str(rateLimits["snsShared"]),
+                "SPEECH_TIMEOUT_PARAMETER": speechTimeoutPolicy.parameter_name
             },
             handler='handler.handler'
         )
@@ -85,6 +206,15 @@ class CallCenterStack(Stack):
         place_index.grant(getInfo, "geo:CreatePlaceIndex")
         place_index.grant(getInfo, "geo:SearchPlaceIndexForText")
         addresstable.grant_write_data(getInfo)
+        profiletable.grant_read_write_data(getInfo)
+        callerHashKey.grant_read(getInfo)
+        verificationQueue.grant_send_messages(getInfo)
+        ratelimittable.grant_read_write_data(getInfo)
+        idempotencytable.grant_read_write_data(getInfo)
+        speechTimeoutPolicy.grant_read(getInfo)
+        if sessiontable is not None:
+            getInfo.add_environment("SESSION_TABLE", sessiontable.table_name)
+            sessiontable.grant_read_write_data(getInfo)
         getInfoRole = getInfo.role
 
         getInfoRole.add_to_policy(iam.PolicyStatement(
@@ -92,3 +222,84 @@ class CallCenterStack(Stack):
             actions=["sns:Subscribe"],
             resources=[emailSubscriptionArn],
         ))
+
+        #VERIFYADDRESSES LAMBDA
+        verifyAddresses = self.tuned_function(
+            'verifyAddresses',
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            code = _lambda.Code.from_asset(bundling.bundle("verifyAddresses")),
+            layers=[commonLayer],
+            environment={
+                "INDEX_NAME": place_index.place_index_name,
+                "ADDRESS_TABLE": addresstable.table_name,
+                "RATE_LIMIT_TABLE": ratelimittable.table_name,
+                "LOCATION_RATE_LIMIT": str(rateLimits["location"]),
+                "LOCATION_SHARED_RATE_LIMIT": str(rateLimits["locationShared"])
+            },
+            handler='verify_addresses.handler'
+        )
+
+        verifyAddresses.add_event_source(lambda_event_sources.SqsEventSource(verificationQueue,
+            batch_size=10,
+            max_batching_window=Duration.seconds(30),
+            report_batch_item_failures=True
+        ))
+        place_index.grant(verifyAddresses, "geo:SearchPlaceIndexForText")
+        addresstable.grant_write_data(verifyAddresses)
+        ratelimittable.grant_read_write_data(verifyAddresses)
+
+    def lambda_settings(self, function_id):
+        settings = dict(LAMBDA_DEFAULTS, **FUNCTION_DEFAULTS.get(function_id, {}))
+        for key in ("lambda", "lambda:" + function_id):
+            context = self.node.try_get_context(key)
+            if isinstance(context, str):
+                context = json.loads(context)
+            settings.update(context or {})
+        return settings
+
+    def tuned_function(self, function_id, **kwargs):
+        settings = self.lambda_settings(function_id)
+        architecture = _lambda.Architecture.ARM_64 if settings["architecture"] == "arm64" else _lambda.Architecture.X86_64
+
+        function = _lambda.Function(
+            self, function_id,
+            architecture=architecture,
+            memory_size=int(settings["memorySize"]),
+            timeout=Duration.seconds(int(settings["timeoutSeconds"])),
+            reserved_concurrent_executions=settings["reservedConcurrency"],
+            **kwargs
+        )
+
+        # callers (Lex, Connect) should invoke the alias so that provisioned concurrency is used
+        provisioned = int(settings["provisionedConcurrency"] or 0)
+        business_hours = settings["businessHours"]
+        if provisioned <= 0 and not business_hours:
+            CfnOutput(self, function_id + "Arn", value=function.function_arn)
+            return function
+
+        alias = _lambda.Alias(
+            self, function_id + "LiveAlias",
+            alias_name="live",
+            version=function.current_version,
+            provisioned_concurrent_executions=provisioned if provisioned > 0 else None
+        )
+        CfnOutput(self, function_id + "Arn", value=alias.function_arn)
+
+        if business_hours:
+            scaling = alias.add_auto_scaling(
+                min_capacity=int(business_hours.get("offHoursCapacity", 0)),
+                max_capacity=int(business_hours["maxCapacity"])
+            )
+            scaling.scale_on_utilization(utilization_target=0.7)
+            scaling.scale_on_schedule(
+                "ScaleUpForBusinessHours",
+                schedule=appscaling.Schedule.expression(business_hours.get("startCron", "cron(0 13 ? * MON-FRI *)")),
+                min_capacity=int(business_hours["minCapacity"])
+            )
+            scaling.scale_on_schedule(
+                "ScaleDownAfterBusinessHours",
+                schedule=appscaling.Schedule.expression(business_hours.get("endCron", "cron(0 1 ? * TUE-SAT *)")),
+                min_capacity=int(business_hours.get("offHoursCapacity", 0))
+            )
+
+        return function
@@ -0,0 +1,55 @@
+
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+# Shared boto3 clients and resources, created once per container (normally at module
+# import, during the Lambda init phase) and reused by every warm invocation. All of
+# them use one botocore configuration tuned for the synchronous voice path: short
+# connect/read timeouts, few retries and kept-alive connections.
+CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '1'))
+
+CLIENT_CONFIG = Config(
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=float(os.environ.get('AWS_READ_TIMEOUT', '3')),
+    retries={'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '2')), 'mode': 'standard'},
+    tcp_keepalive=True
+)
+
+session = boto3.session.Session()
+
+_clients = {}
+_resources = {}
+
+# boto3 sessions are not thread safe; clients and resources are created under the lock
+_lock = threading.Lock()
+
+
+def config(read_timeout=None):
+    if read_timeout is None:
+        return CLIENT_CONFIG
+    # clients bounded by a deadline do not retry: the caller decides what to do with the time left
+    return CLIENT_CONFIG.merge(Config(
+        connect_timeout=min(CONNECT_TIMEOUT, read_timeout),
+        read_timeout=read_timeout,
+        retries={'max_attempts': 1, 'mode': 'standard'}
+    ))
+
+
+def client(service_name, read_timeout=None):
+    key = (service_name, read_timeout)
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                _clients[key] = session.client(service_name, config=config(read_timeout))
+    return _clients[key]
+
+
+def resource(service_name, read_timeout=None):
+    key = (service_name, read_timeout)
+    if key not in _resources:
+        with _lock:
+            if key not in _resources:
+                _resources[key] = session.resource(service_name, config=config(read_timeout))
+    return _resources[key]
@@ -0,0 +1,74 @@
+
+import logging
+import os
+import time
+import aws_clients
+from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Deadline budget of the current invocation. handler.handler starts it from the Lambda
+# remaining time (capped by the Lex code hook timeout), keeping RESERVE_MS to build the
+# response. AWS calls on the voice path take their client from client()/resource(),
+# whose botocore read timeout is the largest TIMEOUT_BUCKETS value that still fits in
+# the budget; when none fits, DeadlineExceeded is raised without calling and the
+# handler answers with a reprompt instead.
+CODE_HOOK_TIMEOUT_MS = int(os.environ.get('CODE_HOOK_TIMEOUT_MS', '10000'))
+RESERVE_MS = int(os.environ.get('DEADLINE_RESERVE_MS', '300'))
+TIMEOUT_BUCKETS = sorted(float(bucket) for bucket in os.environ.get('DEADLINE_TIMEOUT_BUCKETS', '0.25,0.5,1,2,3').split(','))
+
+_deadline = None    # time.monotonic() value, or None outside of an invocation
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def start(context):
+    global _deadline
+    budget_ms = CODE_HOOK_TIMEOUT_MS
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        budget_ms = min(budget_ms, context.get_remaining_time_in_millis())
+    _deadline = time.monotonic() + (budget_ms - RESERVE_MS) / 1000.0
+    logger.debug('<<deadline>> budget {} ms'.format(budget_ms - RESERVE_MS))
+
+
+def remaining():
+    # seconds left in the budget; unbounded outside of an invocation
+    if _deadline is None:
+        return float('inf')
+    return _deadline - time.monotonic()
+
+
+def read_timeout(max_timeout=None):
+    # a call may take the connect timeout plus the read timeout
+    left = remaining()
+    fitting = [
+        bucket for bucket in TIMEOUT_BUCKETS
+        if bucket + min(aws_clients.CONNECT_TIMEOUT, bucket) <= left and (max_timeout is None or bucket <= max_timeout)
+    ]
+    if not fitting:
+        raise DeadlineExceeded('{:.0f} ms left'.format(left * 1000))
+    return fitting[-1]
+
+
+def client(service_name, max_timeout=None):
+    return aws_clients.client(service_name, read_timeout(max_timeout))
+
+
+def resource(service_name, max_timeout=None):
+    return aws_clients.resource(service_name, read_timeout(max_timeout))
+
+
+def prewarm_client(service_name):
+    # creates the client used with a full budget during the init phase
+    return aws_clients.client(service_name, TIMEOUT_BUCKETS[-1])
+
+
+def prewarm_resource(service_name):
+    return aws_clients.resource(service_name, TIMEOUT_BUCKETS[-1])
+
+
+def is_timeout(error):
+    return isinstance(error, (DeadlineExceeded, ReadTimeoutError, ConnectTimeoutError, TimeoutError))
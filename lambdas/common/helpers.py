@@ -22,11 +22,17 @@ import base64
 import gzip
 import io
 import re
-import handler
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# "full" echoes the intent, active contexts and request attributes of the event in every
+# response; "minimal" only sends what Lex V2 reads back: slot values reduced to their
+# interpretedValue, no intent on ElicitIntent, and no empty contexts or echoed request
+# attributes. The intent and the session attributes replace Lex's copy, so both are
+# still sent whole.
+RESPONSE_MODE = os.environ.get('LEX_RESPONSE_MODE', 'full')
+
 IDENTIFICATION_SLOTS = {
     'accountId': {
         'intent_name': 'GetAccountIDHelper',
@@ -72,6 +78,12 @@ SLOT_PROMPTS = {
     }
 }
 
+INTENT_PROMPTS = [
+    'I didn\'t get that. Please say how you would like to receive information from us. Or, you can press one to request a physical brochure, or press two to subscribe to our email list.',
+    'Let\'s try that one more time. You can press one or say brochure if you\'d like a brochure mailed to your address, or you can press two or say email to subscribe to our email list',
+    'Sorry, I was not able to understand how you want us to send you further information. Please visit our website to put in your request.'
+]
+
 
 def callback_original_intent_handler(event, session_attributes, context):
     logger.debug('<<helpers>> in callback_original_intent_handler')
@@ -94,35 +106,70 @@ def callback_original_intent_handler(event, session_attributes, context):
     intent_name = intent['name']
 
     callback_event['invocationSource'] = 'FulfillmentCodeHook'
+    import handler  # imported here, as handler imports the intent modules that import helpers
     return handler.HANDLERS[intent_name]['handler'](callback_event, context)
 
 
-def elicit_slot(intent, activeContexts, sessionAttributes, slot, requestAttributes, slotElicitationStyle, messages=None):
-    response = \
-    {
-        'sessionState': {
-            'activeContexts': activeContexts,
-            'sessionAttributes': sessionAttributes,
-            'dialogAction': {
-                'slotToElicit': slot,
-                'type': 'ElicitSlot'
-            },
-            'intent': intent,
-            'state': 'InProgress'
-        },
-        'requestAttributes': requestAttributes,
-    }
-    
+def build_response(dialogActionType, intent, activeContexts, sessionAttributes, requestAttributes, messages=None, slotToElicit=None, slotElicitationStyle=None):
+    dialogAction = {'type': dialogActionType}
+    if slotToElicit is not None:
+        dialogAction['slotToElicit'] = slotToElicit
     if slotElicitationStyle is not None:
-        response['sessionState']['dialogAction']['slotElicitationStyle'] = slotElicitationStyle
+        dialogAction['slotElicitationStyle'] = slotElicitationStyle
+
+    if RESPONSE_MODE == 'minimal':
+        response = minimal_response(dialogAction, intent, activeContexts, sessionAttributes)
+    else:
+        response = \
+        {
+            'requestAttributes': requestAttributes,
+            'sessionState': {
+                'activeContexts': activeContexts,
+                'intent': intent,
+                'sessionAttributes': sessionAttributes,
+                'dialogAction': dialogAction
+            }
+        }
 
     if messages:
-        response['messages'] = messages    
-        
-    logger.debug('<<helpers>> elicit_slot response = %s', json.dumps(response))
+        response['messages'] = messages
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('<<helpers>> {} response = {}'.format(dialogActionType, json.dumps(response)))
     return response
 
 
+def minimal_slot(slot):
+    # a slot value without originalValue and resolvedValues; list slots keep their shape
+    if not slot:
+        return slot
+    compact = {}
+    value = slot.get('value', None)
+    if value is not None:
+        interpreted = value.get('interpretedValue', None)
+        compact['value'] = {'interpretedValue': interpreted} if interpreted is not None else value
+    if 'shape' in slot:
+        compact['shape'] = slot['shape']
+    if 'values' in slot:
+        compact['values'] = [minimal_slot(item) for item in slot['values']]
+    return compact
+
+
+def minimal_response(dialogAction, intent, activeContexts, sessionAttributes):
+    sessionState = {'dialogAction': dialogAction, 'sessionAttributes': sessionAttributes}
+    if activeContexts:
+        sessionState['activeContexts'] = activeContexts
+    if dialogAction['type'] != 'ElicitIntent' and intent:
+        compact = {field: intent[field] for field in ('name', 'state', 'confirmationState') if intent.get(field, None) is not None}
+        compact['slots'] = {name: minimal_slot(slot) for name, slot in (intent.get('slots', None) or {}).items()}
+        sessionState['intent'] = compact
+    return {'sessionState': sessionState}
+
+
+def elicit_slot(intent, activeContexts, sessionAttributes, slot, requestAttributes, slotElicitationStyle, messages=None):
+    return build_response('ElicitSlot', intent, activeContexts, sessionAttributes, requestAttributes, messages, slot, slotElicitationStyle)
+
+
 def elicit_slot_with_retries(intent, activeContexts, sessionAttributes, slotToElicit, requestAttributes):
     slotElicitationStyle = 'Default'
     required_slot = slotToElicit.split(':')[0]
@@ -142,126 +189,55 @@ def elicit_slot_with_retries(intent, activeContexts, sessionAttributes, slotToEl
 
     num_tries = int(tries)
     num_prompts = len(prompts)
+    prompt_messages = SLOT_PROMPT_MESSAGES[slotToElicit]
 
     # give up with final message
     if (num_tries+1) >= num_prompts:
-        message = prompts[num_prompts-1]
-        response_message = format_message_array(message, 'PlainText')
-        del sessionAttributes[slotToElicit+'_retries']
+        sessionAttributes.pop(slotToElicit+'_retries', None)
         intent['state'] = 'Failed'
-        return close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
+        return close(intent, activeContexts, sessionAttributes, prompt_messages[num_prompts-1], requestAttributes)
     else:
         sessionAttributes[slotToElicit+'_retries'] = str(num_tries+1)
-        message = prompts[num_tries]
+        response_message = prompt_messages[num_tries]
         
         welcome_message = sessionAttributes.get('welcomeMessage', None)
         if welcome_message is not None:
-            message = welcome_message + message
+            response_message = format_message_array(welcome_message + prompts[num_tries], 'PlainText')
             del sessionAttributes['welcomeMessage']
             
-        response_message = format_message_array(message, 'PlainText')
         return elicit_slot(intent, activeContexts, sessionAttributes, required_slot, requestAttributes, slotElicitationStyle, response_message)
 
 def elicit_intent_with_retries(intent, activeContexts, sessionAttributes, requestAttributes):
-    prompts = [
-            'I didn\'t get that. Please say how you would like to receive information from us. Or, you can press one to request a physical brochure, or press two to subscribe to our email list.',
-            'Let\'s try that one more time. You can press one or say brochure if you\'d like a brochure mailed to your address, or you can press two or say email to subscribe to our email list',
-            'Sorry, I was not able to understand how you want us to send you further information. Please visit our website to put in your request.'
-        ]
-
     tries = sessionAttributes.get('IntentElicit_retries', None)
     if not tries:
         tries = "0"
 
     num_tries = int(tries)
-    num_prompts = len(prompts)
+    num_prompts = len(INTENT_PROMPTS)
 
     # give up with final message
     if (num_tries+1) >= num_prompts:
-        print("END CLOSE")
-        message = prompts[num_prompts-1]
-        response_message = format_message_array(message, 'PlainText')
-        del sessionAttributes['IntentElicit_retries']
+        sessionAttributes.pop('IntentElicit_retries', None)
         intent['state'] = 'Failed'
-        return close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
+        return close(intent, activeContexts, sessionAttributes, INTENT_PROMPT_MESSAGES[num_prompts-1], requestAttributes)
     else:
         sessionAttributes['IntentElicit_retries'] = str(num_tries+1)
-        message = prompts[num_tries]
-            
-        response_message = format_message_array(message, 'PlainText')
-        return elicit_intent(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
+        return elicit_intent(intent, activeContexts, sessionAttributes, INTENT_PROMPT_MESSAGES[num_tries], requestAttributes)
 
 def elicit_intent(intent, activeContexts, sessionAttributes, message, requestAttributes):
-    response = \
-    {
-        'messages': message,
-        'requestAttributes': requestAttributes,
-        'sessionState': {
-            'activeContexts': activeContexts,
-            'intent': intent,
-            'sessionAttributes': sessionAttributes,
-            'dialogAction': {
-                'type': 'ElicitIntent'
-            }
-        }
-    }
-    logger.debug('<<helpers>> elicit_intent response = ' + json.dumps(response))
-    return response
+    return build_response('ElicitIntent', intent, activeContexts, sessionAttributes, requestAttributes, message)
 
 
 def close(intent, activeContexts, sessionAttributes, message, requestAttributes):
-    response = \
-    {
-        'messages': message,
-        'requestAttributes': requestAttributes,
-        'sessionState': {
-            'activeContexts': activeContexts,
-            'intent': intent,
-            'sessionAttributes': sessionAttributes,
-            'dialogAction': {
-                'type': 'Close'
-            }
-        }
-    }
-    
-    logger.debug('<<helpers>> close response = ' + json.dumps(response))
-    return response
+    return build_response('Close', intent, activeContexts, sessionAttributes, requestAttributes, message)
 
 
 def delegate(intent, activeContexts, sessionAttributes, messages, requestAttributes):
-    response = \
-    {
-        'messages': messages,
-        'requestAttributes': requestAttributes,
-        'sessionState': {
-            'activeContexts': activeContexts,
-            'intent': intent,
-            'sessionAttributes': sessionAttributes,
-            'dialogAction': {
-                'type': 'Delegate'
-            }
-        }
-    }
-    logger.debug('<<helpers>> delegate response = ' + json.dumps(response))
-    return response
+    return build_response('Delegate', intent, activeContexts, sessionAttributes, requestAttributes, messages)
 
 
 def confirm(intent, activeContexts, sessionAttributes, messages, requestAttributes):
-    response = \
-    {
-        'messages': messages,
-        'requestAttributes': requestAttributes,
-        'sessionState': {
-            'activeContexts': activeContexts,
-            'intent': intent,
-            'sessionAttributes': sessionAttributes,
-            'dialogAction': {
-                'type': 'ConfirmIntent'
-             }
-        }
-    }
-    logger.debug('<<helpers>> confirm response = ' + json.dumps(response))
-    return response
+    return build_response('ConfirmIntent', intent, activeContexts, sessionAttributes, requestAttributes, messages)
 
 
 def format_message_array(message, contentType, response_card=None):
@@ -271,6 +247,26 @@ def format_message_array(message, contentType, response_card=None):
         return [{'contentType': contentType, 'content': message}]
 
 
+_constant_messages = {}
+
+def constant_message(message, contentType='PlainText'):
+    # prebuilt message array for a static prompt, shared by every response that uses
+    # it; callers must not modify the result
+    key = (message, contentType)
+    messages = _constant_messages.get(key)
+    if messages is None:
+        messages = _constant_messages[key] = format_message_array(message, contentType)
+    return messages
+
+
+SLOT_PROMPT_MESSAGES = {
+    slot: [constant_message(prompt) for prompt in rule['prompts']]
+    for slot, rule in SLOT_PROMPTS.items()
+}
+
+INTENT_PROMPT_MESSAGES = [constant_message(prompt) for prompt in INTENT_PROMPTS]
+
+
 def get_attribute_safely(attribute_path, data_dict):
     return_value = None
     sub_dict = data_dict
@@ -356,3 +352,35 @@ def validate_alphanumeric(value, length):
         return False
 
     return True
+
+
+def edit_distance(first, second, max_distance=None):
+    # optimal string alignment distance (Levenshtein plus adjacent transpositions);
+    # gives up early once every path exceeds max_distance
+    if first == second:
+        return 0
+    if len(first) < len(second):
+        first, second = second, first
+    if max_distance is not None and len(first) - len(second) > max_distance:
+        return max_distance + 1
+
+    before_previous_row = None
+    previous_row = list(range(len(second) + 1))
+    for row, first_char in enumerate(first, 1):
+        current_row = [row]
+        for column, second_char in enumerate(second, 1):
+            distance = min(
+                previous_row[column] + 1,
+                current_row[column - 1] + 1,
+                previous_row[column - 1] + (first_char != second_char)
+            )
+            if (row > 1 and column > 1 and first_char == second[column - 2]
+                    and first[row - 2] == second_char):
+                distance = min(distance, before_previous_row[column - 2] + 1)
+            current_row.append(distance)
+        if max_distance is not None and min(current_row) > max_distance:
+            return max_distance + 1
+        before_previous_row = previous_row
+        previous_row = current_row
+
+    return previous_row[-1]
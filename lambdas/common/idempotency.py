@@ -0,0 +1,153 @@
+
+import logging
+import hashlib
+import os
+import time
+from collections import OrderedDict
+import deadline
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Lex may invoke the code hook again for a turn it already sent (a slow response, a
+# retried request). Steps with side effects run through once(): the first invocation of
+# a step claims the fingerprint of the turn (session id, step, intent, confirmation state
+# and the values the step acts on) in IDEMPOTENCY_TABLE, and marks it completed once the
+# side effect succeeded; duplicates skip the side effect and get the success response
+# built from their own turn, so they answer with the session attributes Lex sent them.
+# A failed step releases the claim and is not recorded. Completed keys are also kept in
+# the container for the fast path. Without the table only the container cache is used.
+IDEMPOTENCY_TABLE = os.environ.get('IDEMPOTENCY_TABLE', None)
+TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '3600'))
+LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '15'))
+CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '1024'))
+IDEMPOTENCY_TIMEOUT = float(os.environ.get('IDEMPOTENCY_TIMEOUT', '0.5'))
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+_completed = OrderedDict()      # key -> expires at
+
+
+def fingerprint(turn, step, values):
+    parts = [turn.session_id, step, turn.intent_name, turn.confirmation_state] + [str(value) for value in values]
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _cached(key):
+    expires_at = _completed.get(key, None)
+    if expires_at is None or expires_at < time.time():
+        return False
+    _completed.move_to_end(key)
+    return True
+
+
+def _remember(key, expires_at):
+    _completed[key] = expires_at
+    _completed.move_to_end(key)
+    while len(_completed) > CACHE_SIZE:
+        _completed.popitem(last=False)
+
+
+def _error_code(error):
+    response = getattr(error, 'response', None)
+    return response.get('Error', {}).get('Code', None) if isinstance(response, dict) else None
+
+
+def _claim(key):
+    # COMPLETED and its expiry time, IN_PROGRESS if another invocation holds the
+    # claim, or None when this invocation claimed the key (or the table is unavailable)
+    now = int(time.time())
+    dynamodb = deadline.client('dynamodb', IDEMPOTENCY_TIMEOUT)
+    try:
+        dynamodb.put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item={
+                'idempotencyKey': {'S': key},
+                'status': {'S': IN_PROGRESS},
+                'lockedUntil': {'N': str(now + LOCK_SECONDS)},
+                'expiresAt': {'N': str(now + TTL_SECONDS)}
+            },
+            ConditionExpression='attribute_not_exists(idempotencyKey) OR (#status = :inProgress AND lockedUntil < :now)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':inProgress': {'S': IN_PROGRESS}, ':now': {'N': str(now)}}
+        )
+        return None, None
+    except Exception as error:
+        if _error_code(error) != 'ConditionalCheckFailedException':
+            logger.warning('<<idempotency>> claim failed, running without it: {}'.format(error))
+            return None, None
+
+    try:
+        item = dynamodb.get_item(TableName=IDEMPOTENCY_TABLE, Key={'idempotencyKey': {'S': key}}, ConsistentRead=True).get('Item', {})
+    except Exception as error:
+        # claimed by another invocation that may still be running
+        logger.warning('<<idempotency>> lookup failed: {}'.format(error))
+        return IN_PROGRESS, None
+    if item.get('status', {}).get('S', None) == COMPLETED:
+        return COMPLETED, int(item['expiresAt']['N'])
+    return IN_PROGRESS, None
+
+
+def _complete(key):
+    expires_at = int(time.time()) + TTL_SECONDS
+    _remember(key, expires_at)
+    if not IDEMPOTENCY_TABLE:
+        return
+    try:
+        deadline.client('dynamodb', IDEMPOTENCY_TIMEOUT).put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item={
+                'idempotencyKey': {'S': key},
+                'status': {'S': COMPLETED},
+                'expiresAt': {'N': str(expires_at)}
+            }
+        )
+    except Exception as error:
+        logger.warning('<<idempotency>> marking the step completed failed: {}'.format(error))
+
+
+def _release(key):
+    # the step failed (e.g. it ran out of time): a later turn runs it again
+    try:
+        deadline.client('dynamodb', IDEMPOTENCY_TIMEOUT).delete_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Key={'idempotencyKey': {'S': key}},
+            ConditionExpression='#status = :inProgress',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':inProgress': {'S': IN_PROGRESS}}
+        )
+    except Exception as error:
+        logger.warning('<<idempotency>> release failed: {}'.format(error))
+
+
+def once(turn, step, values, action, respond, busy):
+    # runs action(turn), the side effect of the step, unless the same step of the turn
+    # already completed, and returns respond(turn); busy(turn) while another invocation
+    # runs it. An exception of action releases the claim and is raised to the caller.
+    key = fingerprint(turn, step, values)
+    if _cached(key):
+        logger.info('<<idempotency>> {} already completed in this container'.format(step))
+        return respond(turn)
+
+    if IDEMPOTENCY_TABLE:
+        try:
+            status, expires_at = _claim(key)
+        except deadline.DeadlineExceeded:
+            status, expires_at = None, None
+        if status == COMPLETED:
+            logger.info('<<idempotency>> {} already completed'.format(step))
+            _remember(key, expires_at)
+            return respond(turn)
+        if status == IN_PROGRESS:
+            logger.info('<<idempotency>> {} in progress in another invocation'.format(step))
+            return busy(turn)
+
+    try:
+        action(turn)
+    except Exception:
+        if IDEMPOTENCY_TABLE:
+            _release(key)
+        raise
+    _complete(key)
+    return respond(turn)
@@ -0,0 +1,89 @@
+
+# Lightweight view of a Lex V2 code hook event, parsed once per invocation and shared
+# by the intent handlers and helpers. The attributes reference the dicts inside the
+# event, so changes made through the view are part of the event (and the response).
+
+DEFAULT_LOCALE = 'en_US'
+
+
+class LexTurn:
+    __slots__ = ('event', 'session_state', 'intent', 'slots', 'session_attributes', 'active_contexts', 'request_attributes')
+
+    def __init__(self, event):
+        self.event = event
+
+        session_state = event.get('sessionState', None)
+        if session_state is None:
+            session_state = event['sessionState'] = {}
+        self.session_state = session_state
+
+        intent = session_state.get('intent', None)
+        if intent is None:
+            intent = session_state['intent'] = {}
+        self.intent = intent
+
+        slots = intent.get('slots', None)
+        if slots is None:
+            slots = intent['slots'] = {}
+        self.slots = slots
+
+        session_attributes = session_state.get('sessionAttributes', None)
+        if session_attributes is None:
+            session_attributes = session_state['sessionAttributes'] = {}
+        self.session_attributes = session_attributes
+
+        self.active_contexts = session_state.get('activeContexts', None) or []
+        self.request_attributes = event.get('requestAttributes', None) or {}
+
+    @property
+    def intent_name(self):
+        return self.intent.get('name', None)
+
+    @property
+    def confirmation_state(self):
+        return self.intent.get('confirmationState', 'None')
+
+    @property
+    def input_mode(self):
+        return self.event.get('inputMode', None)
+
+    @property
+    def input_transcript(self):
+        return self.event.get('inputTranscript', '') or ''
+
+    @property
+    def invocation_source(self):
+        return self.event.get('invocationSource', None)
+
+    @property
+    def session_id(self):
+        return self.event.get('sessionId', None)
+
+    @property
+    def locale(self):
+        return self.event.get('bot', {}).get('localeId', DEFAULT_LOCALE)
+
+    def slot_value(self, name, field='interpretedValue'):
+        slot = self.slots.get(name, None)
+        if slot is None:
+            return None
+        value = slot.get('value', None)
+        if value is None:
+            return None
+        return value.get(field, None)
+
+    def clear_slot(self, name):
+        self.slots[name] = None
+
+    def switch_intent(self, name, slot_names=()):
+        # continues the turn as another intent, e.g. one resolved without Lex classification
+        self.intent.clear()
+        self.intent.update({'name': name, 'slots': dict.fromkeys(slot_names), 'state': 'InProgress', 'confirmationState': 'None'})
+        self.slots = self.intent['slots']
+
+
+def as_turn(event):
+    # accepts an already parsed LexTurn, or the raw event
+    if isinstance(event, LexTurn):
+        return event
+    return LexTurn(event)
@@ -0,0 +1,29 @@
+
+import json
+import os
+import time
+
+# CloudWatch metrics written as Embedded Metric Format log lines: CloudWatch Logs
+# extracts them asynchronously, so emitting costs no API call on the voice path.
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CallCenter')
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+
+def emit(dimensions, values, units=None, namespace=NAMESPACE):
+    # dimensions and values are dicts of name -> value; units maps metric name -> unit
+    if not ENABLED:
+        return
+    units = units or {}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in values]
+            }]
+        }
+    }
+    record.update(dimensions)
+    record.update(values)
+    print(json.dumps(record))
@@ -0,0 +1,216 @@
+
+import logging
+import os
+import threading
+import time
+import aws_clients
+import deadline
+import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Client side rate limits for AWS APIs with per account TPS quotas. Each container has a
+# token bucket per API (<NAME>_RATE_LIMIT per second, <NAME>_BURST); with RATE_LIMIT_TABLE
+# and <NAME>_SHARED_RATE_LIMIT set, tokens are also leased in blocks of LEASE_SIZE from
+# a per second counter shared by all containers and the batch worker, so the account
+# wide rate stays under the quota. In-turn (interactive) calls wait up to
+# INTERACTIVE_MAX_WAIT for a token; batch calls only get tokens above the share kept
+# for interactive calls (BATCH_RESERVE), and may wait longer.
+RATE_LIMIT_TABLE = os.environ.get('RATE_LIMIT_TABLE', None)
+LEASE_SIZE = int(os.environ.get('RATE_LIMIT_LEASE', '5'))
+SHARED_TIMEOUT = float(os.environ.get('RATE_LIMIT_SHARED_TIMEOUT', '0.25'))
+BATCH_RESERVE = float(os.environ.get('RATE_LIMIT_BATCH_RESERVE', '0.5'))
+INTERACTIVE_MAX_WAIT = float(os.environ.get('RATE_LIMIT_INTERACTIVE_MAX_WAIT_MS', '200')) / 1000.0
+BATCH_MAX_WAIT = float(os.environ.get('RATE_LIMIT_BATCH_MAX_WAIT_MS', '10000')) / 1000.0
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+THROTTLING_ERRORS = {
+    'ThrottlingException', 'Throttling', 'ThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'ProvisionedThroughputExceededException'
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    pass
+
+
+def is_throttled(error):
+    # True for a refused token and for the throttling errors of the AWS APIs
+    if isinstance(error, RateLimited):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(response, dict) and response.get('Error', {}).get('Code', None) in THROTTLING_ERRORS
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, floor=0):
+        # 0 if a token was taken, else the seconds until one is available above floor
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens - 1 >= floor:
+            self.tokens -= 1
+            return 0
+        return (floor + 1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class SharedWindow:
+    # tokens leased from the "<name>#<epoch second>" item of the rate limit table
+    def __init__(self, name, rate):
+        self.name = name
+        self.rate = rate
+        self.second = None
+        self.leased = 0
+        self.exhausted = set()      # priorities refused in the current second
+        self.lock = threading.Lock()
+
+    def take(self, priority):
+        # 0 if a token was taken, else the seconds until the next window; the counter
+        # is updated without holding the lock, so other threads are not held up by it
+        now = time.time()
+        second = int(now)
+        with self.lock:
+            if second != self.second:
+                self.second = second
+                self.leased = 0
+                self.exhausted = set()
+            if self.leased > 0:
+                self.leased -= 1
+                return 0
+            if priority in self.exhausted:
+                return second + 1 - now
+
+        limit = self.rate if priority == INTERACTIVE else int(self.rate * (1 - BATCH_RESERVE))
+        if limit < 1:
+            # no share of the rate for this priority (e.g. batch calls with a shared rate of 1)
+            with self.lock:
+                if self.second == second:
+                    self.exhausted.add(priority)
+            return second + 1 - now
+        for lease in sorted({max(1, min(LEASE_SIZE, limit)), 1}, reverse=True):
+            try:
+                aws_clients.client('dynamodb', SHARED_TIMEOUT).update_item(
+                    TableName=RATE_LIMIT_TABLE,
+                    Key={'limitKey': {'S': '{}#{}'.format(self.name, second)}},
+                    UpdateExpression='ADD #used :lease SET #expiresAt = :expiresAt',
+                    ConditionExpression='attribute_not_exists(#used) OR #used <= :remaining',
+                    ExpressionAttributeNames={'#used': 'used', '#expiresAt': 'expiresAt'},
+                    ExpressionAttributeValues={
+                        ':lease': {'N': str(lease)},
+                        ':remaining': {'N': str(limit - lease)},
+                        ':expiresAt': {'N': str(second + 3600)}
+                    }
+                )
+            except Exception as error:
+                if getattr(error, 'response', {}).get('Error', {}).get('Code', None) == 'ConditionalCheckFailedException':
+                    continue
+                # the shared counter only smooths the account rate: go on with the local bucket
+                logger.warning('<<rate_limit>> shared counter {} failed: {}'.format(self.name, error))
+                return 0
+            with self.lock:
+                # the rest of a lease of a second already over is dropped
+                if self.second == second:
+                    self.leased += max(0, lease - 1)
+            return 0
+
+        with self.lock:
+            if self.second == second:
+                self.exhausted.add(priority)
+        return second + 1 - time.time()
+
+
+class RateLimiter:
+    def __init__(self, name, rate, burst=None, shared_rate=0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst or max(1, rate)) if rate > 0 else None
+        self.shared = SharedWindow(name, shared_rate) if shared_rate > 0 and RATE_LIMIT_TABLE else None
+        self.lock = threading.Lock()
+        self.counts = {'Acquired': 0, 'Queued': 0, 'Throttled': 0}
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        # takes a token, waiting up to max_wait seconds (and never past the deadline of
+        # an interactive call); raises RateLimited if none is available in time
+        if max_wait is None:
+            max_wait = INTERACTIVE_MAX_WAIT if priority == INTERACTIVE else BATCH_MAX_WAIT
+        if priority == INTERACTIVE:
+            max_wait = min(max_wait, deadline.remaining())
+        give_up_at = time.monotonic() + max_wait
+
+        queued = False
+        while True:
+            wait = self._take(priority)
+            with self.lock:
+                if wait == 0:
+                    self.counts['Acquired'] += 1
+                    self.counts['Queued'] += queued
+                    return
+                if time.monotonic() + wait > give_up_at:
+                    self.counts['Throttled'] += 1
+                    raise RateLimited('{} rate limit ({})'.format(self.name, priority))
+            queued = True
+            time.sleep(wait)
+
+    def try_acquire(self, priority=INTERACTIVE):
+        # takes a token only if one is available now, for optional calls: a refusal is
+        # not counted as throttled, the caller reports the work it skipped
+        if self._take(priority) != 0:
+            return False
+        with self.lock:
+            self.counts['Acquired'] += 1
+        return True
+
+    def _take(self, priority):
+        # the local bucket under the lock, then the shared counter outside of it
+        wait = 0
+        if self.bucket is not None:
+            with self.lock:
+                wait = self.bucket.take(self.bucket.burst * BATCH_RESERVE if priority == BATCH else 0)
+        if wait == 0 and self.shared is not None:
+            wait = self.shared.take(priority)
+            if wait and self.bucket is not None:
+                with self.lock:
+                    self.bucket.give_back()
+        return wait
+
+    def take_counts(self):
+        with self.lock:
+            counts = self.counts
+            self.counts = dict.fromkeys(counts, 0)
+        return counts
+
+
+def limiter(name):
+    # the container's limiter of an API, configured by the <NAME>_* environment variables
+    with _limiters_lock:
+        if name not in _limiters:
+            prefix = name.upper() + '_'
+            _limiters[name] = RateLimiter(
+                name,
+                float(os.environ.get(prefix + 'RATE_LIMIT', '0')),
+                float(os.environ.get(prefix + 'BURST', '0')) or None,
+                int(os.environ.get(prefix + 'SHARED_RATE_LIMIT', '0'))
+            )
+        return _limiters[name]
+
+
+def emit_metrics():
+    # acquired, queued and throttled calls of each limiter since the last call
+    for name, rate_limiter in list(_limiters.items()):
+        counts = rate_limiter.take_counts()
+        if any(counts.values()):
+            metrics.emit({'RateLimiter': name}, counts)
@@ -0,0 +1,119 @@
+
+import logging
+import threading
+import time
+from collections import deque
+from botocore.exceptions import ConnectionError as BotocoreConnectionError, ConnectTimeoutError, ReadTimeoutError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Per-container resilience state for a downstream service: recent latencies (for the
+# hedging delay) and a circuit breaker over the outcomes of the recent calls. The
+# state lives as long as the warm container, and is shared by its threads.
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def is_failure(error):
+    # whether an error counts against the service: timeouts, connection errors and 5xx
+    # responses; throttling and rejected requests say nothing about its health
+    if isinstance(error, (ReadTimeoutError, ConnectTimeoutError, BotocoreConnectionError, ConnectionError, TimeoutError)):
+        return True
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500 or \
+        response.get('Error', {}).get('Code', None) in ('InternalServerException', 'ServiceUnavailableException')
+
+
+class LatencyTracker:
+    def __init__(self, size=100, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction, default=None):
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return default
+            samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class CircuitBreaker:
+    # closed: calls pass, and the last window_size outcomes are kept. When at least
+    # min_calls of them are known and failure_rate of them failed, the breaker opens
+    # for cooldown seconds and calls are refused; then a single probe call is let
+    # through (half open), whose outcome closes or reopens the breaker.
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, window_size=20, min_calls=10, failure_rate=0.5, cooldown=30.0):
+        self.name = name
+        self.outcomes = deque(maxlen=window_size)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # True if a call may be made now; a half open breaker allows one probe at a time
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self.probing = False
+                logger.info('<<resilience>> {} circuit half open'.format(self.name))
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(self.name)
+
+    def record(self, success):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                if success:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                    logger.info('<<resilience>> {} circuit closed'.format(self.name))
+                else:
+                    self._open()
+                return
+
+            self.outcomes.append(success)
+            if self.state == self.CLOSED and len(self.outcomes) >= self.min_calls:
+                failures = self.outcomes.count(False)
+                if failures >= self.failure_rate * len(self.outcomes):
+                    self._open()
+
+    def release(self):
+        # a call that ended without an outcome: a half open breaker lets the next probe through
+        with self.lock:
+            self.probing = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        logger.warning('<<resilience>> {} circuit open for {:.0f} s'.format(self.name, self.cooldown))
+
+    @property
+    def is_open(self):
+        return self.state != self.CLOSED
@@ -0,0 +1,103 @@
+
+import logging
+import json
+import helpers
+import lex_event
+import speech_timeouts
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Shared retry state machine for the RETRY_ACTIONS of each intent. Every retry action
+# gets a bit; the actions already tried are kept as an integer bitmask in the
+# "retry_stages_<intent>" session attribute, and the next action of each prompt type
+# is a table lookup by that mask. Retry methods are called as
+# method(attribute, messages, style, turn) with the prebuilt prompt message array and
+# the lex_event.LexTurn of the invocation; a method returning None skips its step, and
+# the next step of the same ladder answers instead.
+STAGES_ATTRIBUTE = 'retry_stages_'
+LEGACY_ATTRIBUTE = 'elicitation_retries'
+
+
+def compile_policy(retry_actions):
+    # accepts either a list of actions with a prompt per prompt type (address_helpers),
+    # or a dict of prompt type -> list of actions with a single prompt (email_helpers)
+    if isinstance(retry_actions, dict):
+        ladders = {
+            prompt_type: [(attribute, settings, settings.get('prompt', None)) for action in actions for attribute, settings in action.items()]
+            for prompt_type, actions in retry_actions.items()
+        }
+    else:
+        ladders = {}
+        for action in retry_actions:
+            for attribute, settings in action.items():
+                for prompt_type, prompt in settings.items():
+                    if prompt_type not in ('method', 'style'):
+                        ladders.setdefault(prompt_type, []).append((attribute, settings, prompt))
+
+    bits = {}
+    for steps in ladders.values():
+        for attribute, settings, prompt in steps:
+            if attribute not in bits:
+                bits[attribute] = 1 << len(bits)
+
+    policy = {'bits': bits, 'ladders': {}}
+    for prompt_type, steps in ladders.items():
+        steps = [
+            (bits[attribute], attribute, settings['method'], helpers.constant_message(prompt), settings.get('style', None))
+            for attribute, settings, prompt in steps
+            if settings.get('method', None) is not None and prompt is not None
+        ]
+        # next_step[mask] is the first step whose bit is not set in mask, or None
+        next_step = []
+        for mask in range(1 << len(bits)):
+            next_step.append(next((step for step in steps if not mask & step[0]), None))
+        policy['ladders'][prompt_type] = next_step
+
+    return policy
+
+
+def get_stages(sessionAttributes, intent_name, policy):
+    stages = sessionAttributes.get(STAGES_ATTRIBUTE + intent_name, None)
+    if stages is not None:
+        return int(stages)
+
+    # sessions started before the bitmask was introduced only have the pipe-delimited list
+    mask = 0
+    for attribute in sessionAttributes.get(LEGACY_ATTRIBUTE, '').split('|'):
+        mask |= policy['bits'].get(attribute, 0)
+    return mask
+
+
+def next_retry(event, prompt_type, policy):
+    logger.debug('<<next_retry>> starting, prompt_type = {}'.format(prompt_type))
+    turn = lex_event.as_turn(event)
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name or ''
+
+    ladder = policy['ladders'].get(prompt_type, None)
+    if ladder is not None:
+        stages = get_stages(sessionAttributes, intent_name, policy)
+        step = ladder[stages]
+        while step is not None:
+            bit, attribute, method, messages, style = step
+            stages |= bit
+            sessionAttributes[STAGES_ATTRIBUTE + intent_name] = str(stages)
+            response = method(attribute, messages, style, turn)
+            if response is None:
+                logger.debug('<<next_retry>> attribute {} skipped'.format(attribute))
+                step = ladder[stages]
+                continue
+            # the end-of-speech timeout of the slot the retry action elicits, for this stage
+            speech_timeouts.apply_to_response(turn, response, attribute)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('<<next_retry>> attribute {}, method {} returns response {}'.format(attribute, method.__name__, json.dumps(response)))
+            return response
+
+    logger.debug('<<next_retry>> no actions left for prompt_type = {}'.format(prompt_type))
+    response_message = helpers.constant_message('next action error')
+    intent['state'] = 'Fulfilled'
+    response = helpers.close(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.error('<<next_retry>> close response = ' + json.dumps(response))
+    return response
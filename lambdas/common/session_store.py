@@ -0,0 +1,138 @@
+
+import logging
+import json
+import os
+import time
+from collections import OrderedDict
+import deadline
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Optional server side session state. With SESSION_TABLE set, the session attributes
+# of a response are split: the hot ones (read by the Connect flow, set by Connect, or
+# Lex runtime hints) stay in Lex, the rest is written to the table as one item per
+# session and version, and Lex only carries the version in the "sessionRef" attribute.
+# The next turn merges the stored attributes back before the handler runs, from the
+# container's write-through cache when it holds that version, else with one consistent
+# get_item. Versions are never overwritten (a new one is put on condition it does not
+# exist yet), so a repeated invocation of a turn still loads the version it was sent
+# with. If the version cannot be loaded the turn fails (SessionUnavailable) instead of
+# running without its state; if the new version cannot be written, all attributes are
+# sent to Lex as before.
+SESSION_TABLE = os.environ.get('SESSION_TABLE', None)
+HOT_ATTRIBUTES = set(os.environ.get('SESSION_HOT_ATTRIBUTES', 'sendToAgent,addressConfirmed,emailAddressConfirmed,addressVerified,userPhone,CallerNumber').split(','))
+HOT_PREFIXES = ('x-amz-lex:',)
+TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', '86400'))
+CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '1024'))
+SESSION_TIMEOUT = float(os.environ.get('SESSION_TIMEOUT', '0.5'))
+
+POINTER_ATTRIBUTE = 'sessionRef'
+
+enabled = bool(SESSION_TABLE)
+
+_cache = OrderedDict()      # session id -> (version, stored attributes)
+_loaded = (None, None)      # session id and version loaded for the current turn
+
+if enabled:
+    deadline.prewarm_client('dynamodb')
+
+
+class SessionUnavailable(Exception):
+    pass
+
+
+def is_hot(name):
+    return name in HOT_ATTRIBUTES or name.startswith(HOT_PREFIXES)
+
+
+def _remember(session_id, version, attributes):
+    _cache[session_id] = (version, attributes)
+    _cache.move_to_end(session_id)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _stored_attributes(session_id, version):
+    cached = _cache.get(session_id, None)
+    if cached is not None and cached[0] == version:
+        _cache.move_to_end(session_id)
+        return cached[1]
+
+    response = deadline.client('dynamodb', SESSION_TIMEOUT).get_item(
+        TableName=SESSION_TABLE,
+        Key={'sessionId': {'S': session_id}, 'version': {'N': version}},
+        ConsistentRead=True
+    )
+    item = response.get('Item', None)
+    if item is None:
+        raise SessionUnavailable('session {} version {} not found'.format(session_id, version))
+    attributes = json.loads(item['attributes']['S'])
+    _remember(session_id, version, attributes)
+    return attributes
+
+
+def load(event):
+    # merges the stored session attributes into the event, before the turn is built
+    global _loaded
+    sessionState = event.get('sessionState', {})
+    sessionAttributes = sessionState.get('sessionAttributes', None) or {}
+    version = sessionAttributes.pop(POINTER_ATTRIBUTE, None)
+    _loaded = (event.get('sessionId', None), version)
+    if not enabled or version is None:
+        return event
+
+    try:
+        stored = _stored_attributes(event['sessionId'], version)
+    except Exception as error:
+        # without the stored attributes the turn would act on a partial state
+        logger.error('<<session_store>> loading session {} version {} failed: {}'.format(event['sessionId'], version, error))
+        if isinstance(error, SessionUnavailable):
+            raise
+        raise SessionUnavailable(str(error)) from error
+
+    # attributes sent by Lex (hot ones, or set by the caller's client) win over stored ones
+    sessionState['sessionAttributes'] = dict(stored, **sessionAttributes)
+    return event
+
+
+def save(event, response):
+    # the response to send to Lex: cold attributes are written to the table and replaced
+    # by the pointer; the response passed in (possibly cached by idempotency) is not changed
+    if not enabled or not response or 'sessionState' not in response:
+        return response
+    sessionAttributes = response['sessionState'].get('sessionAttributes', None) or {}
+    hot = {name: value for name, value in sessionAttributes.items() if is_hot(name)}
+    cold = {name: value for name, value in sessionAttributes.items() if not is_hot(name)}
+
+    if not cold:
+        return response
+
+    session_id = event['sessionId']
+    loaded_version = _loaded[1] if _loaded[0] == session_id else None
+    cached = _cache.get(session_id, None)
+    if loaded_version is not None and cached is not None and cached[0] == loaded_version and cached[1] == cold:
+        # unchanged this turn: no write
+        version = loaded_version
+    else:
+        version = str(int(loaded_version or 0) + 1)
+        try:
+            deadline.client('dynamodb', SESSION_TIMEOUT).put_item(
+                TableName=SESSION_TABLE,
+                Item={
+                    'sessionId': {'S': session_id},
+                    'version': {'N': version},
+                    'attributes': {'S': json.dumps(cold, separators=(',', ':'))},
+                    'expiresAt': {'N': str(int(time.time()) + TTL_SECONDS)}
+                },
+                # another invocation of this turn may have written the version already
+                ConditionExpression='attribute_not_exists(sessionId)'
+            )
+        except Exception as error:
+            logger.warning('<<session_store>> saving session {} version {} failed, sending all attributes: {}'.format(session_id, version, error))
+            _cache.pop(session_id, None)
+            return response
+        _remember(session_id, version, cold)
+
+    hot[POINTER_ATTRIBUTE] = version
+    return dict(response, sessionState=dict(response['sessionState'], sessionAttributes=hot))
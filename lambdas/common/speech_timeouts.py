@@ -0,0 +1,152 @@
+
+import logging
+import json
+import os
+import random
+import time
+import deadline
+import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# End-of-speech timeouts (x-amz-lex:audio:end-timeout-ms:<intent>:<slot>) per slot and
+# retry stage, from a small policy table. The table is kept in the container and
+# refreshed from the SPEECH_TIMEOUT_PARAMETER SSM parameter (a JSON document) at most
+# every SPEECH_TIMEOUT_REFRESH_SECONDS; when it cannot be read, the last table is kept.
+# Each elicitation records the timeout it used, and the next speech turn emits whether
+# the slot came back filled and whether the transcript looked cut off, by intent, slot,
+# stage and timeout: tools/tune_speech_timeouts.py turns those metrics into a new table.
+#
+# Table: {"timeouts": {"<slot>" or "<intent>:<slot>": {"<stage>" or "*": ms}},
+#         "truncatedExtraMs": ms added for a caller whose speech was cut off before,
+#         "minMs": ms, "maxMs": ms,
+#         "exploreRate": share of elicitations trying a neighbouring timeout,
+#         "exploreStepMs": ms}
+# Slots without an entry keep the bot's timeout.
+SPEECH_TIMEOUT_PARAMETER = os.environ.get('SPEECH_TIMEOUT_PARAMETER', None)
+REFRESH_SECONDS = float(os.environ.get('SPEECH_TIMEOUT_REFRESH_SECONDS', '300'))
+SPEECH_TIMEOUT_TIMEOUT = float(os.environ.get('SPEECH_TIMEOUT_TIMEOUT', '0.25'))
+
+DEFAULT_POLICY = {
+    'timeouts': {
+        'StreetAddress': {'*': 2000},
+        'EmailAddress': {'*': 2000}
+    },
+    'truncatedExtraMs': 0,
+    'minMs': 500,
+    'maxMs': 5000,
+    'exploreRate': 0,
+    'exploreStepMs': 250
+}
+
+INITIAL_STAGE = 'initial'
+PENDING_ATTRIBUTE = 'speech_timeout'             # "<slot>|<stage>|<ms>" of the last elicitation
+TRUNCATIONS_ATTRIBUTE = 'speech_truncations'
+TIMEOUT_ATTRIBUTE = 'x-amz-lex:audio:end-timeout-ms:'
+
+# a transcript ending on one of these words was likely cut off, as was one made of
+# numbers only for a slot whose answer is more than a number (a house number without
+# its street); StreetAddressNumber and the like are complete as digits
+DANGLING_WORDS = {'at', 'dot', 'and', 'underscore', 'dash', 'hyphen', 'the', 'of', 'on', 'apartment', 'suite', 'unit'}
+MORE_THAN_NUMBER_SLOTS = {'StreetAddress', 'EmailAddress'}
+
+_policy = DEFAULT_POLICY
+_refresh_at = 0
+
+
+def parse_policy(document):
+    # the table entries of the document over the defaults
+    table = json.loads(document)
+    return dict(DEFAULT_POLICY, **dict(table, timeouts=dict(DEFAULT_POLICY['timeouts'], **table.get('timeouts', {}))))
+
+
+def _refresh():
+    global _policy, _refresh_at
+    if not SPEECH_TIMEOUT_PARAMETER or time.monotonic() < _refresh_at:
+        return
+    # a failed read is retried at the next refresh, not on every turn
+    _refresh_at = time.monotonic() + REFRESH_SECONDS
+    try:
+        response = deadline.client('ssm', SPEECH_TIMEOUT_TIMEOUT).get_parameter(Name=SPEECH_TIMEOUT_PARAMETER)
+        _policy = parse_policy(response['Parameter']['Value'])
+    except Exception as error:
+        logger.warning('<<speech_timeouts>> loading {} failed, keeping the current policy: {}'.format(SPEECH_TIMEOUT_PARAMETER, error))
+
+
+def policy():
+    _refresh()
+    return _policy
+
+
+def configured_ms(table, intent_name, slot, stage):
+    # the most specific entry: the stage before "*", the intent's slot before the slot
+    timeouts = table['timeouts']
+    entries = [timeouts.get('{}:{}'.format(intent_name, slot), None) or {}, timeouts.get(slot, None) or {}]
+    for key in (stage, '*'):
+        for stages in entries:
+            if stages.get(key, None) is not None:
+                return stages[key]
+    return None
+
+
+def timeout_ms(intent_name, slot, stage, truncations=0):
+    # the end timeout for the slot at the retry stage, or None to keep the bot's
+    table = policy()
+    value = configured_ms(table, intent_name, slot, stage)
+    if value is None:
+        return None
+    if truncations:
+        value += table['truncatedExtraMs']
+    if table['exploreRate'] and random.random() < table['exploreRate']:
+        value += random.choice((-1, 1)) * table['exploreStepMs']
+    return int(min(table['maxMs'], max(table['minMs'], value)))
+
+
+def apply(turn, slot, stage):
+    # sets the end timeout of the slot about to be elicited
+    sessionAttributes = turn.session_attributes
+    value = timeout_ms(turn.intent_name, slot, stage, int(sessionAttributes.get(TRUNCATIONS_ATTRIBUTE, '0')))
+    if value is None:
+        return None
+    sessionAttributes[TIMEOUT_ATTRIBUTE + turn.intent_name + ':' + slot] = str(value)
+    sessionAttributes[PENDING_ATTRIBUTE] = '{}|{}|{}'.format(slot, stage, value)
+    return value
+
+
+def apply_to_response(turn, response, stage):
+    # apply() for the slot an ElicitSlot response asks for
+    dialogAction = (response or {}).get('sessionState', {}).get('dialogAction', {})
+    if dialogAction.get('type', None) == 'ElicitSlot' and dialogAction.get('slotToElicit', None):
+        apply(turn, dialogAction['slotToElicit'], stage)
+    return response
+
+
+def is_truncated(transcript, slot):
+    words = transcript.lower().replace('.', ' ').split()
+    if not words:
+        return False
+    if words[-1] in DANGLING_WORDS:
+        return True
+    return slot in MORE_THAN_NUMBER_SLOTS and all(word.isdigit() for word in words)
+
+
+def observe(turn):
+    # emits the outcome of the last elicitation, when this turn answers it by voice
+    sessionAttributes = turn.session_attributes
+    pending = sessionAttributes.pop(PENDING_ATTRIBUTE, None)
+    if pending is None or turn.input_mode != 'Speech':
+        return
+    try:
+        slot, stage, value = pending.split('|')
+    except ValueError:
+        return
+    transcript = turn.input_transcript
+    no_match = int(turn.slot_value(slot) is None)
+    truncated = int(is_truncated(transcript, slot))
+    if truncated:
+        sessionAttributes[TRUNCATIONS_ATTRIBUTE] = str(int(sessionAttributes.get(TRUNCATIONS_ATTRIBUTE, '0')) + 1)
+    metrics.emit(
+        {'Intent': turn.intent_name or '', 'Slot': slot, 'Stage': stage, 'TimeoutMs': value},
+        {'SpeechTurns': 1, 'SpeechNoMatch': no_match, 'SpeechTruncated': truncated}
+    )
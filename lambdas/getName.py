@@ -1,28 +1,53 @@
-import boto3
+import aws_clients
+import datetime
 import os
-import random
+import zlib
+import name_snapshot
 
-dynamodb = boto3.client("dynamodb", region_name = "us-east-1")
+# Amazon Connect invokes this function synchronously from the contact flow. Names in
+# the deployed name snapshot are answered from it; any other name is a single low-level
+# get_item: eventually consistent, and projected to the pseudonym list only.
+dynamodb = aws_clients.client('dynamodb')
+NAME_TABLE = os.environ["NAME_TABLE"]
+
+# map the name snapshot, if deployed, during the init phase
+name_snapshot.is_available()
 
 def handler(event, context):
-    name = event["Details"]["Parameters"]["nameInput"]
-    dynamodb = boto3.resource('dynamodb', region_name="us-east-1")
-    table = dynamodb.Table(os.environ["NAME_TABLE"])
+    details = event["Details"]
+    name = details["Parameters"]["nameInput"]
 
-    response = table.get_item(
-        Key={
-            'name': name
-        }
-    )
+    pseudonymList = name_snapshot.lookup(name)
+    if pseudonymList is None:
+        response = dynamodb.get_item(
+            TableName=NAME_TABLE,
+            Key={
+                'name': {'S': name}
+            },
+            ProjectionExpression='#p',
+            ExpressionAttributeNames={'#p': 'pseudonym'},
+            ConsistentRead=False
+        )
+        pseudonymList = pseudonymValues(response['Item']['pseudonym'])
 
-    pseudonym = choosePseudonym(response['Item']['pseudonym'])
+    contactId = details.get("ContactData", {}).get("ContactId") or name
+    pseudonym = choosePseudonym(pseudonymList, contactId)
 
+    # Connect only needs the flat string map
     return {
         "name": pseudonym
     }
 
-def choosePseudonym(pseudonymList):
+def pseudonymValues(attribute):
+    # stored as a list of strings, or as a string set
+    if 'L' in attribute:
+        return [value['S'] for value in attribute['L']]
+    return sorted(attribute['SS'])
+
+def choosePseudonym(pseudonymList, contactId):
+    # the same contact always gets the same pseudonym (e.g. when the flow retries),
+    # and the choice rotates between contacts and from day to day
     if len(pseudonymList) == 1:
         return pseudonymList[0]
-    else:
-        return random.choice(pseudonymList)
\ No newline at end of file
+    seed = '{}:{}'.format(contactId, datetime.date.today().isoformat())
+    return pseudonymList[zlib.crc32(seed.encode('utf-8')) % len(pseudonymList)]
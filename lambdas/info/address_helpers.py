@@ -1,131 +1,134 @@
 import logging
 import json
 import helpers
+import retry_engine
+import deferred_verification
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # see RETRY_ACTIONS dict at the bottom for configuring the sequence in next_retry()
-def next_retry(event, prompt_type):
-    logger.debug('<<next_retry>> starting')
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
-
-    for action in RETRY_ACTIONS:
-       for attribute in action.keys():
-           logger.debug("<<next_retry>> checking for attribute = {}, method = {}".format(attribute, action[attribute]['method']))
-           session_attribute = sessionAttributes.get(attribute, None)
-           if session_attribute is None:
-               retries = sessionAttributes.get('elicitation_retries', '')
-               if attribute not in retries:  # only try each action once
-                   method = action[attribute].get('method', None)
-                   prompt = action[attribute].get(prompt_type, None)
-                   style = action[attribute].get('style', None)
-                   if method is not None and prompt is not None:
-                       sessionAttributes['elicitation_retries'] = retries + attribute + '|'
-                       response = method(attribute, prompt, style, event)
-                       logger.debug('<<next_retry>> attribute {} not found, method {} returns response {}'.format(attribute, action[attribute]['method'], json.dumps(response)))
-                       return response
-    
-    response_string = 'next action error'
-    response_message = helpers.format_message_array(response_string, 'PlainText')
-    intent['state'] = 'Fulfilled'
-    response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-    logger.error('<<next_retry>> close response = ' + json.dumps(response))
-    return response
+def next_retry(turn, prompt_type):
+    return retry_engine.next_retry(turn, prompt_type, RETRY_POLICY)
 
 
-def elicit_spelled_street(attribute, prompt, style, event):
+def elicit_spelled_street(attribute, messages, style, turn):
     logger.debug('<<elicit_spelled_street>> starting, attribute={}'.format(attribute))
     
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+    sessionAttributes = turn.session_attributes
 
-    intent = sessionState.get("intent", {})
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
 
-    requestAttributes = event.get("requestAttributes", {})
+    requestAttributes = turn.request_attributes
 
-    response_message = helpers.format_message_array(prompt, 'PlainText')
     slotElicitationStyle = style
-    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "SpelledStreetName", requestAttributes, slotElicitationStyle, response_message)
+    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "SpelledStreetName", requestAttributes, slotElicitationStyle, messages)
     logger.info('<<{}>> elicit_spelled_street - elicitSlot response = {}'.format(intent_name, json.dumps(response)))
 
     return response
 
 
-def elicit_street_address_number(attribute, prompt, style, event):
+def elicit_street_address_number(attribute, messages, style, turn):
     logger.debug('<<elicit_street_address_number>> starting, attribute={}'.format(attribute))
     
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+    sessionAttributes = turn.session_attributes
 
-    intent = sessionState.get("intent", {})
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
 
-    requestAttributes = event.get("requestAttributes", {})
+    requestAttributes = turn.request_attributes
 
-    response_message = helpers.format_message_array(prompt, 'PlainText')
     slotElicitationStyle = style
-    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "StreetAddressNumber", requestAttributes, slotElicitationStyle, response_message)
+    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "StreetAddressNumber", requestAttributes, slotElicitationStyle, messages)
     logger.info('<<{}>> elicit_street_address_number - elicitSlot response = {}'.format(intent_name, json.dumps(response)))
 
     return response
 
 
-def elicit_street_name(attribute, prompt, style, event):
+def elicit_street_name(attribute, messages, style, turn):
     logger.debug('<<elicit_street_name>> starting, attribute={}'.format(attribute))
     
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+    sessionAttributes = turn.session_attributes
 
-    intent = sessionState.get("intent", {})
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
 
-    requestAttributes = event.get("requestAttributes", {})
+    requestAttributes = turn.request_attributes
     
-    response_message = helpers.format_message_array(prompt, 'PlainText')
     slotElicitationStyle = style
-    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "StreetName", requestAttributes, slotElicitationStyle, response_message)
+    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "StreetName", requestAttributes, slotElicitationStyle, messages)
     logger.info('<<{}>> elicit_street_name - elicitSlot response = {}'.format(intent_name, json.dumps(response)))
 
     return response
 
 
-def route_to_agent(attribute, prompt, style, event):
+def route_to_agent(attribute, messages, style, turn):
     logger.debug('<<route_to_agent>> starting, attribute={}'.format(attribute))
     
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+    sessionAttributes = turn.session_attributes
 
-    intent = sessionState.get("intent", {})
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
 
-    requestAttributes = event.get("requestAttributes", {})
-    response_message = helpers.format_message_array(prompt, 'PlainText')
+    requestAttributes = turn.request_attributes
     
     intent['state'] = 'Fulfilled'
     sessionAttributes['sendToAgent'] = 1
     sessionAttributes['addressConfirmed'] = 0
 
-    response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
+    response = helpers.close(intent, activeContexts, sessionAttributes, messages, requestAttributes)
     logger.info('<<{}>> route_to_agent - close response = {}'.format(intent_name, json.dumps(response)))
 
     return response
 
 
+def defer_verification(attribute, messages, style, turn):
+    logger.debug('<<defer_verification>> starting, attribute={}'.format(attribute))
+
+    if not deferred_verification.enqueue(turn, turn.slot_value('ZipCode'), attribute):
+        # not queued: the next retry action of the same ladder answers instead
+        return None
+    return close_deferred(turn, messages)
+
+
+def close_deferred(turn, messages):
+    # ends the dialog with the address accepted as said, pending verification
+    sessionAttributes = turn.session_attributes
+
+    intent = turn.intent
+    intent.pop('state', None)
+
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
+
+    requestAttributes = turn.request_attributes
+
+    intent['state'] = 'Fulfilled'
+    sessionAttributes['addressConfirmed'] = 1
+    sessionAttributes['addressVerified'] = '0'
+
+    if sessionAttributes.get('StreetAddress_retries'):
+        del sessionAttributes['StreetAddress_retries']
+
+    response = helpers.close(intent, activeContexts, sessionAttributes, messages, requestAttributes)
+    logger.info('<<{}>> close_deferred - close response = {}'.format(intent_name, json.dumps(response)))
+
+    return response
+
+
 def fix_spelled_street_name(street_name):
     letters = list(street_name)
 
@@ -142,7 +145,21 @@ def fix_spelled_street_name(street_name):
                 letters[index] = 'o'
 
     return ''.join(letters)
-    
+
+
+def query_variants(street_address, parsed_street_address, raw_street_address, spelled_street_name, street_name):
+    variants = [street_address, parsed_street_address, raw_street_address]
+    if spelled_street_name is not None and street_name is not None:
+        variants.append(street_name + ' ' + parsed_street_address)
+
+    # keep the first occurrence of each distinct query, in order of preference
+    queries = []
+    for variant in variants:
+        variant = ' '.join(variant.split())
+        if variant and variant not in queries:
+            queries.append(variant)
+    return queries
+
 
 RETRY_ACTIONS = [
     { "street_name": {
@@ -181,3 +198,19 @@ RETRY_ACTIONS = [
        }
     }
 ]
+
+DEFERRED_PROMPT = "Thank you. We will check your address and mail the brochure to it. Goodbye."
+
+# with a pending verification queue, the address is accepted as said after
+# DEFER_AFTER_RETRIES retry prompts instead of going on to an agent
+if deferred_verification.enabled:
+    RETRY_ACTIONS.insert(min(deferred_verification.DEFER_AFTER_RETRIES, len(RETRY_ACTIONS) - 1),
+        { "deferred_verification": {
+              "method": defer_verification,
+              "style": None,
+              "no-match": DEFERRED_PROMPT,
+              "incorrect": DEFERRED_PROMPT
+           }
+        })
+
+RETRY_POLICY = retry_engine.compile_policy(RETRY_ACTIONS)
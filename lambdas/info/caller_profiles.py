@@ -0,0 +1,178 @@
+
+import logging
+import os
+import time
+import hmac
+import hashlib
+from collections import OrderedDict
+import deadline
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Profiles of returning callers: the address and email address they confirmed last,
+# keyed by a hash of the caller number that Amazon Connect passes in the session
+# attributes. A small LRU in the container answers repeated lookups (including
+# "no profile") without DynamoDB; PROFILE_CACHE_SECONDS bounds how stale it can be.
+# The HMAC key is read once per container from the CALLER_HASH_KEY_SECRET secret: a
+# keyless hash of a phone number is reversed by trying every number, so profiles are
+# disabled without a secret, and skipped while it cannot be read.
+PROFILE_TABLE = os.environ.get('PROFILE_TABLE', None)
+CALLER_NUMBER_ATTRIBUTES = os.environ.get('CALLER_NUMBER_ATTRIBUTES', 'userPhone,CallerNumber').split(',')
+CALLER_HASH_KEY_SECRET = os.environ.get('CALLER_HASH_KEY_SECRET', None)
+HASH_KEY_RETRY_SECONDS = float(os.environ.get('CALLER_HASH_KEY_RETRY_SECONDS', '60'))
+CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '1024'))
+CACHE_SECONDS = float(os.environ.get('PROFILE_CACHE_SECONDS', '300'))
+PROFILE_TTL_DAYS = int(os.environ.get('PROFILE_TTL_DAYS', '365'))
+# a profile is a shortcut: it never gets more than this of the turn's budget
+PROFILE_TIMEOUT = float(os.environ.get('PROFILE_TIMEOUT', '0.5'))
+
+PROFILE_FIELDS = ['resolvedAddress', 'city', 'state', 'postalCode', 'emailAddress']
+
+# the offer of a stored value is tracked per field in the "profileOffer_<field>"
+# session attribute: offered -> accepted | declined
+OFFER_ATTRIBUTE = 'profileOffer_'
+
+enabled = bool(PROFILE_TABLE) and bool(CALLER_HASH_KEY_SECRET)
+
+_cache = OrderedDict()      # caller key -> (expires at, profile or None)
+_hash_key = None
+_hash_key_retry_at = 0
+
+
+def hash_key():
+    # the HMAC key of caller numbers, or None while the secret cannot be read
+    global _hash_key, _hash_key_retry_at
+    if _hash_key is None and time.monotonic() >= _hash_key_retry_at:
+        _hash_key_retry_at = time.monotonic() + HASH_KEY_RETRY_SECONDS
+        try:
+            secret = deadline.client('secretsmanager', PROFILE_TIMEOUT).get_secret_value(SecretId=CALLER_HASH_KEY_SECRET)
+            _hash_key = (secret.get('SecretString', None) or '').encode('utf-8') or None
+        except Exception as error:
+            logger.warning('<<caller_profiles>> reading the caller hash key failed: {}'.format(error))
+    return _hash_key
+
+
+def caller_key(sessionAttributes):
+    key = hash_key()
+    if key is None:
+        return None
+    for attribute in CALLER_NUMBER_ATTRIBUTES:
+        number = sessionAttributes.get(attribute, None)
+        if number:
+            digits = ''.join(character for character in number if character.isdigit())
+            if len(digits) >= 7:
+                return hmac.new(key, digits.encode('ascii'), hashlib.sha256).hexdigest()
+    return None
+
+
+if enabled:
+    # during the init phase, not on the first caller's turn
+    hash_key()
+
+
+def _cached(key):
+    entry = _cache.get(key, None)
+    if entry is None or entry[0] < time.monotonic():
+        return False, None
+    _cache.move_to_end(key)
+    return True, entry[1]
+
+
+def _remember(key, profile):
+    _cache[key] = (time.monotonic() + CACHE_SECONDS, profile)
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def get(turn):
+    # returns the stored profile of the caller as a dict, or None
+    if not enabled:
+        return None
+    key = caller_key(turn.session_attributes)
+    if key is None:
+        return None
+
+    found, profile = _cached(key)
+    if found:
+        return profile
+
+    try:
+        response = deadline.client('dynamodb', PROFILE_TIMEOUT).get_item(
+            TableName=PROFILE_TABLE,
+            Key={'callerKey': {'S': key}},
+            ProjectionExpression=', '.join(PROFILE_FIELDS),
+            ConsistentRead=False
+        )
+    except Exception as error:
+        # a missing profile only costs the caller the usual questions
+        logger.warning('<<caller_profiles>> profile lookup failed: {}'.format(error))
+        return None
+
+    item = response.get('Item', None)
+    profile = {field: value['S'] for field, value in item.items() if 'S' in value} if item else None
+    _remember(key, profile)
+    return profile
+
+
+def save(turn, values):
+    # stores the confirmed values (None values are skipped) in the caller's profile
+    if not enabled:
+        return
+    key = caller_key(turn.session_attributes)
+    values = {field: value for field, value in values.items() if value is not None}
+    if key is None or not values:
+        return
+
+    names = {'#expiresAt': 'expiresAt'}
+    attribute_values = {':expiresAt': {'N': str(int(time.time()) + PROFILE_TTL_DAYS * 86400)}}
+    assignments = ['#expiresAt = :expiresAt']
+    for number, (field, value) in enumerate(sorted(values.items())):
+        names['#f{}'.format(number)] = field
+        attribute_values[':v{}'.format(number)] = {'S': str(value)}
+        assignments.append('#f{0} = :v{0}'.format(number))
+
+    try:
+        deadline.client('dynamodb', PROFILE_TIMEOUT).update_item(
+            TableName=PROFILE_TABLE,
+            Key={'callerKey': {'S': key}},
+            UpdateExpression='SET ' + ', '.join(assignments),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as error:
+        logger.warning('<<caller_profiles>> profile update failed: {}'.format(error))
+        return
+
+    found, profile = _cached(key)
+    profile = dict(profile or {}, **{field: str(value) for field, value in values.items()})
+    _remember(key, profile)
+
+
+def offer(turn, field):
+    # returns the caller's profile if it has a value of field to offer, once per session
+    sessionAttributes = turn.session_attributes
+    if OFFER_ATTRIBUTE + field in sessionAttributes:
+        return None
+    profile = get(turn)
+    if not profile or profile.get(field, None) is None:
+        return None
+    sessionAttributes[OFFER_ATTRIBUTE + field] = 'offered'
+    return profile
+
+
+def answered_offer(turn, field):
+    # True if this turn is the caller's answer to the offer of field; records the answer
+    sessionAttributes = turn.session_attributes
+    if sessionAttributes.get(OFFER_ATTRIBUTE + field, None) != 'offered' or turn.confirmation_state == 'None':
+        return False
+    sessionAttributes[OFFER_ATTRIBUTE + field] = 'accepted' if turn.confirmation_state == 'Confirmed' else 'declined'
+    return True
+
+
+def reoffer(turn, field):
+    # an accepted offer is asked again, e.g. when saving it ran out of time
+    sessionAttributes = turn.session_attributes
+    if sessionAttributes.get(OFFER_ATTRIBUTE + field, None) == 'accepted':
+        sessionAttributes[OFFER_ATTRIBUTE + field] = 'offered'
@@ -0,0 +1,58 @@
+
+import logging
+import json
+import os
+import time
+import helpers
+import deadline
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Addresses accepted without a Location match (after DEFER_AFTER_RETRIES failed turns,
+# or while the Location circuit breaker is open) are sent to the pending verification
+# queue and verified later by verify_addresses.handler, which merges the result into
+# the address table (replacing the unverified item written for it, if any). Disabled
+# unless VERIFICATION_QUEUE_URL is set.
+VERIFICATION_QUEUE_URL = os.environ.get('VERIFICATION_QUEUE_URL', None)
+DEFER_AFTER_RETRIES = int(os.environ.get('DEFER_AFTER_RETRIES', '2'))
+ENQUEUE_TIMEOUT = float(os.environ.get('VERIFICATION_ENQUEUE_TIMEOUT', '1'))
+
+enabled = bool(VERIFICATION_QUEUE_URL)
+
+if enabled:
+    deadline.prewarm_client('sqs')
+
+
+def pending_address(sessionAttributes, zip_code, reason, unverified_address=None):
+    # the message body: the parsed transcript, the street names collected by the retry
+    # prompts, the zip code with its city and state, and the key of the unverified item
+    return {
+        'streetAddress': sessionAttributes.get('inputAddress', None),
+        'spelledStreetName': helpers.get_latest_value('spelled_street_name', sessionAttributes),
+        'streetName': helpers.get_latest_value('street_name', sessionAttributes),
+        'streetAddressNumber': helpers.get_latest_value('street_address_number', sessionAttributes),
+        'zipCode': zip_code,
+        'city': sessionAttributes.get('city_municipality', None),
+        'state': sessionAttributes.get('state_province', None),
+        'reason': reason,
+        'unverifiedAddress': unverified_address,
+        'acceptedAt': int(time.time())
+    }
+
+
+def enqueue(turn, zip_code, reason, unverified_address=None):
+    # True if the address of the turn was queued for verification
+    if not enabled or zip_code is None or not turn.session_attributes.get('inputAddress', None):
+        return False
+    body = pending_address(turn.session_attributes, zip_code, reason, unverified_address)
+    try:
+        deadline.client('sqs', ENQUEUE_TIMEOUT).send_message(
+            QueueUrl=VERIFICATION_QUEUE_URL,
+            MessageBody=json.dumps(body)
+        )
+    except Exception as error:
+        logger.warning('<<deferred_verification>> enqueue failed: {}'.format(error))
+        return False
+    logger.info('<<deferred_verification>> queued {} for verification ({})'.format(body['streetAddress'], reason))
+    return True
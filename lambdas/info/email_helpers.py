@@ -18,96 +18,183 @@
 import logging
 import json
 import helpers
+import retry_engine
 import re
+from functools import lru_cache
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 # see RETRY_ACTIONS dict at the bottom for configuring the sequence in next_retry()
-def next_retry(event, prompt_type):
-    logger.debug('<<next_retry>> starting, prompt_type = {}'.format(prompt_type))
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
-
-    retry_actions = RETRY_ACTIONS.get(prompt_type, None)
-    if retry_actions is not None:
-        for action in retry_actions:
-            for attribute in action.keys():
-                logger.debug("<<next_retry>> checking for attribute = {}, prompt_type = {}".format(attribute, prompt_type))
-                session_attribute = sessionAttributes.get(attribute, None)
-                if session_attribute is None:
-                    retries = sessionAttributes.get('elicitation_retries', '')
-                    if attribute not in retries:  # only try each action once
-                        method = action[attribute].get('method', None)
-                        prompt = action[attribute].get('prompt', None)
-                        style = action[attribute].get('style', None)
-                        if method is not None and prompt is not None:
-                            sessionAttributes['elicitation_retries'] = retries + attribute + '|'
-                            response = method(attribute, prompt, style, event)
-                            logger.debug('<<next_retry>> attribute {} not found, method {} returns response {}'.format(attribute, action[attribute]['method'], json.dumps(response)))
-                            return response
-        
-    logger.debug('<<next_retry>> no actions for prompt_type = {}'.format(prompt_type))
-    intent = sessionState.get("intent", {})
-    activeContexts = sessionState.get("activeContexts", [])
-    requestAttributes = event.get("requestAttributes", {})
-
-    response_string = 'next action error'
-    response_message = helpers.format_message_array(response_string, 'PlainText')
-    intent['state'] = 'Fulfilled'
-    response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-    logger.error('<<next_retry>> close response = ' + json.dumps(response))
-    return response
+def next_retry(turn, prompt_type):
+    return retry_engine.next_retry(turn, prompt_type, RETRY_POLICY)
 
 
-def elicit_email_address(attribute, prompt, style, event):
+def elicit_email_address(attribute, messages, style, turn):
     logger.debug('<<elicit_email_address>> starting, attribute={}, style={}'.format(attribute, style))
     
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+    sessionAttributes = turn.session_attributes
 
-    intent = sessionState.get("intent", {})
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
 
-    requestAttributes = event.get("requestAttributes", {})
+    requestAttributes = turn.request_attributes
 
-    response_message = helpers.format_message_array(prompt, 'PlainText')
     slotElicitationStyle = style
-    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "EmailAddress", requestAttributes, slotElicitationStyle, response_message)
+    response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, "EmailAddress", requestAttributes, slotElicitationStyle, messages)
     logger.info('<<{}>> elicit_email_address - elicitSlot response = {}'.format(intent_name, json.dumps(response)))
 
     return response
 
 
-def route_to_agent(attribute, prompt, style, event):
+def route_to_agent(attribute, messages, style, turn):
     logger.debug('<<route_to_agent>> starting, attribute={}'.format(attribute))
     
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+    sessionAttributes = turn.session_attributes
 
-    intent = sessionState.get("intent", {})
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
 
-    requestAttributes = event.get("requestAttributes", {})
-    response_message = helpers.format_message_array(prompt, 'PlainText')
+    requestAttributes = turn.request_attributes
     
     intent['state'] = 'Fulfilled'
     sessionAttributes['sendToAgent'] = 1
     sessionAttributes['addressConfirmed'] = 0
 
-    response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
+    response = helpers.close(intent, activeContexts, sessionAttributes, messages, requestAttributes)
 
     return response
 
 
+# dot-atom local part and hostname domain (RFC 5321/5322), as accepted by SNS email endpoints
+EMAIL_ADDRESS = re.compile(
+    r"^(?=.{1,254}$)(?=[^@]{1,64}@)"
+    r"[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$",
+    re.IGNORECASE
+)
+
+# spoken forms of the characters in an email address
+spoken_symbols = {
+    'at': '@', 'dot': '.', 'period': '.', 'point': '.',
+    'underscore': '_', 'dash': '-', 'hyphen': '-', 'minus': '-', 'plus': '+'
+}
+
+# common misrecognitions of popular domains, applied to the spoken domain (after the last "at")
+spoken_domain_fixes = [
+    (re.compile(r'\bg ?male\b|\bg mail\b|\bgee mail\b'), 'gmail'),
+    (re.compile(r'\bhot ?male\b|\bhot mail\b'), 'hotmail'),
+    (re.compile(r'\bout look\b'), 'outlook'),
+    (re.compile(r'\bi cloud\b|\beye cloud\b'), 'icloud'),
+    (re.compile(r'\ba o l\b|\ba ol\b'), 'aol'),
+    (re.compile(r'\byahoo\b|\byah who\b|\bya who\b'), 'yahoo'),
+    (re.compile(r'\bcom cast\b'), 'comcast'),
+    (re.compile(r'\bproton mail\b'), 'protonmail'),
+]
+
+spoken_symbol_fixes = [
+    (re.compile(r'\bunder score\b'), 'underscore'),
+]
+
+POPULAR_DOMAINS = [
+    'gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com', 'icloud.com',
+    'msn.com', 'live.com', 'comcast.net', 'att.net', 'verizon.net', 'sbcglobal.net',
+    'me.com', 'mac.com', 'protonmail.com', 'ymail.com', 'charter.net', 'cox.net'
+]
+
+# real providers close to a popular domain, never suggested a correction
+KNOWN_DOMAINS = {
+    'mail.com', 'email.com', 'gmx.com', 'gmx.net', 'gmx.us', 'proton.me', 'pm.me', 'zoho.com',
+    'yandex.com', 'fastmail.com', 'hey.com', 'tutanota.com', 'mail.ru', 'inbox.com', 'post.com',
+    'usa.com', 'rocketmail.com', 'aim.com', 'juno.com', 'netzero.net', 'earthlink.net', 'q.com'
+}
+
+# popular domains bucketed by length, so a suggestion only compares similar lengths
+_domains_by_length = {}
+for _domain in POPULAR_DOMAINS:
+    _domains_by_length.setdefault(len(_domain), []).append(_domain)
+
+
 def validate_email_address(email_address):
-    return '@' in email_address
+    return EMAIL_ADDRESS.match(email_address) is not None
+
+
+def normalize_spoken_email(text):
+    # turn "john underscore doe at g mail dot com" into "john_doe@gmail.com"
+    text = text.strip().lower()
+    for pattern, replacement in spoken_symbol_fixes:
+        text = pattern.sub(replacement, text)
+
+    # domain fixes only apply after the last "at", so the local part is kept as said
+    words = text.split()
+    if '@' in text:
+        local_part, _, domain = text.rpartition('@')
+        separator = '@'
+    elif 'at' in words:
+        last_at = len(words) - 1 - words[::-1].index('at')
+        local_part, domain = ' '.join(words[:last_at]), ' '.join(words[last_at + 1:])
+        separator = ' at '
+    else:
+        local_part, domain, separator = '', text, ''
+    for pattern, replacement in spoken_domain_fixes:
+        domain = pattern.sub(replacement, domain)
+    text = local_part + separator + domain
+
+    words = text.split()
+    # only the last "at" separates the local part from the domain
+    at_position = None
+    if '@' not in text:
+        for position, word in enumerate(words):
+            if word == 'at':
+                at_position = position
+
+    normalized = ''
+    for position, word in enumerate(words):
+        if word == 'at' and position != at_position:
+            normalized += word
+        else:
+            normalized += spoken_symbols.get(word, word)
+    return normalized
+
+
+def suggest_domain(domain):
+    # closest popular domain within a small edit distance, or None for a popular or
+    # known provider; only offered to the caller as a question, never applied silently
+    if domain in POPULAR_DOMAINS or domain in KNOWN_DOMAINS:
+        return None
+
+    max_distance = 1 if len(domain) < 10 else 2
+    best = None
+    best_distance = max_distance + 1
+    for length in range(len(domain) - max_distance, len(domain) + max_distance + 1):
+        for candidate in _domains_by_length.get(length, []):
+            distance = helpers.edit_distance(domain, candidate, max_distance)
+            if distance < best_distance:
+                best = candidate
+                best_distance = distance
+    return best
+
+
+def normalize_email_address(email_address):
+    return normalize_spoken_email(email_address)
+
+
+def suggest_email_address(email_address):
+    # the address with the domain the caller probably meant, or None
+    if email_address.count('@') != 1:
+        return None
+    local_part, domain = email_address.split('@')
+    suggested_domain = suggest_domain(domain)
+    if suggested_domain is None:
+        return None
+    logger.info('<<suggest_email_address>> domain {} may be {}'.format(domain, suggested_domain))
+    return local_part + '@' + suggested_domain
 
 
 letter_pronounciations = {
@@ -123,24 +210,72 @@ letter_pronounciations = {
     'z': 'z like zulu'
 }
 
-def transform_email_for_speech(email_address):
-    match = re.search("^([^@]+)(@)([^@]+)$", email_address)
+# letters that are easily misheard are read back with a word, per bot locale;
+# keys must be single characters
+PHONETIC_ALPHABETS = {
+    'en_US': letter_pronounciations,
+    'en_GB': dict(letter_pronounciations, z='zed like zulu'),
+    'en_AU': dict(letter_pronounciations, z='zed like zulu'),
+}
+DEFAULT_LOCALE = 'en_US'
+
+EMAIL_PARTS = re.compile("^([^@]+)(@)([^@]+)$")
+
+
+class SpokenCharacters(dict):
+    # str.translate table rendering each character of the local part as "<c>, ";
+    # "." becomes "dot; " and misheard letters get their phonetic word
+    def __missing__(self, code):
+        self[code] = chr(code) + ', '
+        return self[code]
+
+
+_spoken_characters = {}
+_letter_patterns = {}
+
+
+def _phonetic_alphabet(locale):
+    return PHONETIC_ALPHABETS.get(locale, PHONETIC_ALPHABETS[DEFAULT_LOCALE])
+
+
+def _spoken_character_table(locale):
+    table = _spoken_characters.get(locale)
+    if table is None:
+        table = SpokenCharacters()
+        table[ord('.')] = 'dot; '
+        for letter, pronounciation in _phonetic_alphabet(locale).items():
+            table[ord(letter)] = pronounciation + ', '
+        _spoken_characters[locale] = table
+    return table
+
+
+def _replace_letters(text, locale):
+    # replaces " <letter>," with " <pronounciation>," for every letter in the alphabet
+    alphabet = _phonetic_alphabet(locale)
+    pattern = _letter_patterns.get(locale)
+    if pattern is None:
+        pattern = re.compile(' ([' + re.escape(''.join(alphabet)) + '])(?=,)')
+        _letter_patterns[locale] = pattern
+    return pattern.sub(lambda match: ' ' + alphabet[match.group(1)], text)
+
+
+@lru_cache(maxsize=512)
+def transform_email_for_speech(email_address, locale=DEFAULT_LOCALE):
+    match = EMAIL_PARTS.search(email_address)
+    if match is not None and ',' not in match.group(3):
+        local_part, _, domain = match.groups()
+        return (' <prosody rate="slow"> ' + local_part.translate(_spoken_character_table(locale)) +
+                '</prosody> at; ' + domain.replace('.', ' dot '))
+
+    # anything else is read back as is, with the same dot and letter substitutions
     if match is not None:
         parsed_address = match.groups()
-        if len(parsed_address) == 3:
-            email_address = '<prosody rate="slow"> '
-            email_address += ', '.join(parsed_address[0]) + ', '
-            email_address += '</prosody> at; ' 
-            email_address += parsed_address[2].replace('.', ' dot ')
-    
-    email_address = ' ' + email_address.replace('.,', 'dot;')
-    for letter in letter_pronounciations:
-        email_address = email_address.replace(
-            ' ' + letter + ',', 
-            ' ' + letter_pronounciations[letter] + ','
-        )
+        email_address = '<prosody rate="slow"> '
+        email_address += ', '.join(parsed_address[0]) + ', '
+        email_address += '</prosody> at; ' 
+        email_address += parsed_address[2].replace('.', ' dot ')
 
-    return email_address
+    return _replace_letters(' ' + email_address.replace('.,', 'dot;'), locale)
 
 
 RETRY_ACTIONS = {
@@ -191,3 +326,5 @@ RETRY_ACTIONS = {
         }
     ]
 }
+
+RETRY_POLICY = retry_engine.compile_policy(RETRY_ACTIONS)
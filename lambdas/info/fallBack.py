@@ -1,9 +1,7 @@
 import helpers
+import lex_event
 
-def lambda_handler(event, context):
-    sessionState = event.get('sessionState', {})
-    intent = sessionState.get("intent", {})
-    activeContexts = sessionState.get("activeContexts", [])
-    sessionAttributes = sessionState.get("sessionAttributes", {})
-    requestAttributes = event.get("requestAttributes", {})
-    return helpers.elicit_intent_with_retries(intent, activeContexts, sessionAttributes, requestAttributes)
\ No newline at end of file
+def lambda_handler(event, context, turn=None):
+    if turn is None:
+        turn = lex_event.LexTurn(event)
+    return helpers.elicit_intent_with_retries(turn.intent, turn.active_contexts, turn.session_attributes, turn.request_attributes)
@@ -0,0 +1,262 @@
+
+import logging
+import mmap
+import os
+import struct
+import sys
+import csv
+from functools import lru_cache
+import helpers
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Optional local index of street names per ZIP code, used to correct misrecognized
+# street names before they are sent to Amazon Location Service. When the file is
+# not deployed the matcher is a no-op.
+#
+# File layout (little endian):
+#   header:  MAGIC, version (u16), zip count (u32)
+#   index:   zip count records of (zip code (5s), street block offset (u32), street count (u16))
+#            sorted by zip code
+#   streets: newline separated lowercase street names, grouped by zip code
+GAZETTEER_FILE = os.environ.get('GAZETTEER_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.bin'))
+MAX_DISTANCE_RATIO = float(os.environ.get('GAZETTEER_MAX_DISTANCE_RATIO', '0.34'))
+PHONETIC_DISTANCE_RATIO = float(os.environ.get('GAZETTEER_PHONETIC_DISTANCE_RATIO', '0.5'))
+
+MAGIC = b'GZTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+INDEX_RECORD = struct.Struct('<5sIH')
+
+MAX_WINDOW = 3
+
+STREET_TYPES = {
+    'alley', 'avenue', 'ave', 'boulevard', 'blvd', 'circle', 'cir', 'court', 'ct', 'drive', 'dr',
+    'highway', 'hwy', 'lane', 'ln', 'loop', 'parkway', 'pkwy', 'place', 'pl', 'road', 'rd',
+    'square', 'sq', 'street', 'st', 'terrace', 'ter', 'trail', 'trl', 'way'
+}
+
+DIRECTIONALS = {
+    'north', 'south', 'east', 'west', 'northeast', 'northwest', 'southeast', 'southwest',
+    'n', 's', 'e', 'w', 'ne', 'nw', 'se', 'sw'
+}
+
+soundex_codes = {
+    'b': '1', 'f': '1', 'p': '1', 'v': '1',
+    'c': '2', 'g': '2', 'j': '2', 'k': '2', 'q': '2', 's': '2', 'x': '2', 'z': '2',
+    'd': '3', 't': '3',
+    'l': '4',
+    'm': '5', 'n': '5',
+    'r': '6'
+}
+
+_index = None   # (mmap, zip count) once loaded; False if no gazetteer is deployed
+
+
+def _load():
+    global _index
+    if _index is None:
+        try:
+            with open(GAZETTEER_FILE, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                logger.warning('<<gazetteer>> unsupported gazetteer file {}'.format(GAZETTEER_FILE))
+                _index = False
+            else:
+                _index = (data, count)
+                logger.info('<<gazetteer>> loaded {} zip codes from {}'.format(count, GAZETTEER_FILE))
+        except (OSError, ValueError, struct.error) as error:
+            logger.info('<<gazetteer>> no gazetteer available: {}'.format(error))
+            _index = False
+    return _index
+
+
+def is_available():
+    return bool(_load())
+
+
+@lru_cache(maxsize=256)
+def streets_for_zip(zip_code):
+    index = _load()
+    if not index:
+        return ()
+
+    data, count = index
+    key = zip_code.encode('ascii', 'ignore')[:5]
+    index_end = HEADER.size + count * INDEX_RECORD.size
+
+    # binary search over the fixed-width, sorted zip code records
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        record_zip = data[HEADER.size + middle * INDEX_RECORD.size:HEADER.size + middle * INDEX_RECORD.size + 5]
+        if record_zip < key:
+            low = middle + 1
+        else:
+            high = middle
+    if low == count:
+        return ()
+
+    record_zip, offset, street_count = INDEX_RECORD.unpack_from(data, HEADER.size + low * INDEX_RECORD.size)
+    if record_zip != key:
+        return ()
+
+    streets = []
+    position = index_end + offset
+    for _ in range(street_count):
+        end = data.find(b'\n', position)
+        street = data[position:end].decode('utf-8')
+        position = end + 1
+        core = _core_tokens(street.split())
+        if core:
+            streets.append((street, ' '.join(core), soundex_tokens(core)))
+    return tuple(streets)
+
+
+def _core_tokens(tokens):
+    return [token for token in tokens if token not in STREET_TYPES and token not in DIRECTIONALS]
+
+
+def soundex(word):
+    word = ''.join(letter for letter in word.lower() if letter.isalnum())
+    if not word:
+        return ''
+    if not word[0].isalpha():
+        return word  # numbered streets (32nd, 5th) must match exactly
+
+    code = word[0].upper()
+    previous = soundex_codes.get(word[0], '')
+    for letter in word[1:]:
+        digit = soundex_codes.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def soundex_tokens(tokens):
+    return ' '.join(soundex(token) for token in tokens)
+
+
+def _name_window(tokens):
+    # the street name follows the house number (and an optional directional), and
+    # ends before the street type or, if none was said, within MAX_WINDOW words
+    start = 0
+    for position, token in enumerate(tokens):
+        if token.isdigit():
+            start = position + 1
+            break
+    while start < len(tokens) and (tokens[start] == '1/2' or tokens[start] in DIRECTIONALS):
+        start += 1
+
+    end = start
+    while end < len(tokens) and end - start < MAX_WINDOW and tokens[end] not in STREET_TYPES:
+        end += 1
+
+    has_type = end < len(tokens) and tokens[end] in STREET_TYPES
+    return start, end, has_type
+
+
+def best_match(words, zip_code):
+    streets = streets_for_zip(zip_code)
+    if not streets or not words:
+        return None
+
+    said = ' '.join(words)
+    said_phonetic = soundex_tokens(words)
+    best = None
+    best_score = None
+    for street, core, phonetic in streets:
+        if core == said:
+            return (street, core, 0.0)
+
+        longest = max(len(core), len(said))
+        max_distance = int(longest * PHONETIC_DISTANCE_RATIO)
+        distance = helpers.edit_distance(said, core, max_distance)
+        if distance > max_distance:
+            continue
+        ratio = distance / longest
+
+        if phonetic != said_phonetic and ratio > MAX_DISTANCE_RATIO:
+            continue
+
+        # prefer phonetic matches, then the smallest edit distance
+        score = ratio - (1.0 if phonetic == said_phonetic else 0.0)
+        if best_score is None or score < best_score:
+            best = (street, core, ratio)
+            best_score = score
+    return best
+
+
+def correct_street_name(street_address, zip_code):
+    if not street_address or not zip_code or not is_available():
+        return street_address
+
+    tokens = street_address.lower().split()
+    start, end, has_type = _name_window(tokens)
+    if start >= end:
+        return street_address
+
+    # without a street type the name length is unknown, so try each window size
+    window_sizes = [end - start] if has_type else range(end - start, 0, -1)
+    best = None
+    best_size = None
+    for size in window_sizes:
+        match = best_match(tokens[start:start + size], zip_code)
+        if match is not None and (best is None or match[2] < best[2]):
+            best = match
+            best_size = size
+            if match[2] == 0.0:
+                break
+
+    if best is None:
+        logger.debug('<<gazetteer>> no street match for "{}" in {}'.format(street_address, zip_code))
+        return street_address
+
+    street, core, ratio = best
+    corrected = ' '.join(tokens[:start] + core.split() + tokens[start + best_size:])
+    if corrected != street_address:
+        logger.info('<<gazetteer>> corrected "{}" to "{}" ({}, ratio={:.2f})'.format(street_address, corrected, street, ratio))
+    return corrected
+
+
+def build(source_file, destination_file):
+    # source is a CSV file with zip,street columns (header row optional)
+    streets_by_zip = {}
+    with open(source_file, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip().isdigit():
+                continue
+            zip_code = row[0].strip().zfill(5)
+            street = ' '.join(row[1].lower().replace('.', '').split())
+            if street:
+                streets_by_zip.setdefault(zip_code, set()).add(street)
+
+    index = []
+    blocks = []
+    offset = 0
+    for zip_code in sorted(streets_by_zip):
+        streets = sorted(streets_by_zip[zip_code])
+        block = ''.join(street + '\n' for street in streets).encode('utf-8')
+        index.append(INDEX_RECORD.pack(zip_code.encode('ascii'), offset, len(streets)))
+        blocks.append(block)
+        offset += len(block)
+
+    with open(destination_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(streets_by_zip)))
+        f.write(b''.join(index))
+        f.write(b''.join(blocks))
+
+    return len(streets_by_zip)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python gazetteer.py <zip_streets.csv> <gazetteer.bin>')
+        sys.exit(1)
+    print('wrote {} zip codes to {}'.format(build(sys.argv[1], sys.argv[2]), sys.argv[2]))
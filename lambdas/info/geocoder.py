@@ -0,0 +1,259 @@
+
+import logging
+import json
+import os
+import time
+import deadline
+import metrics
+import rate_limit
+import resilience
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import zip_codes
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# the client used with a full budget is created during the init phase
+deadline.prewarm_client('location')
+
+# Location queries are narrowed to the caller's zip code: biased towards (or, with
+# LOCATION_BBOX_DEGREES, filtered to a box around) the zip code centroid from the
+# zip code reference table, limited to FilterCountries and to a few results.
+MAX_RESULTS = int(os.environ.get('LOCATION_MAX_RESULTS', '5'))
+FILTER_COUNTRIES = [country for country in os.environ.get('LOCATION_FILTER_COUNTRIES', 'USA').split(',') if country]
+BBOX_DEGREES = float(os.environ.get('LOCATION_BBOX_DEGREES', '0'))
+
+# several query variants of the same address are searched concurrently in one turn;
+# MAX_CONCURRENT_SEARCHES caps the Location calls issued per turn
+MAX_CONCURRENT_SEARCHES = int(os.environ.get('LOCATION_MAX_CONCURRENT_SEARCHES', '3'))
+
+# a variant that has not answered after the recent p95 Location latency (or
+# HEDGE_DEFAULT_DELAY_MS until enough calls were seen) is sent a second time, and the
+# first answer wins. Sustained errors and timeouts open the circuit breaker; while it is
+# open no Location call is made and search_best raises resilience.CircuitOpen.
+HEDGING = os.environ.get('LOCATION_HEDGING', '1') != '0'
+HEDGE_PERCENTILE = float(os.environ.get('LOCATION_HEDGE_PERCENTILE', '0.95'))
+HEDGE_DEFAULT_DELAY = float(os.environ.get('LOCATION_HEDGE_DEFAULT_DELAY_MS', '300')) / 1000.0
+HEDGE_MIN_DELAY = float(os.environ.get('LOCATION_HEDGE_MIN_DELAY_MS', '50')) / 1000.0
+
+latencies = resilience.LatencyTracker()
+breaker = resilience.CircuitBreaker(
+    'location',
+    window_size=int(os.environ.get('LOCATION_BREAKER_WINDOW', '20')),
+    min_calls=int(os.environ.get('LOCATION_BREAKER_MIN_CALLS', '10')),
+    failure_rate=float(os.environ.get('LOCATION_BREAKER_FAILURE_RATE', '0.5')),
+    cooldown=float(os.environ.get('LOCATION_BREAKER_COOLDOWN_SECONDS', '30'))
+)
+
+# Location search calls per second (LOCATION_RATE_LIMIT, LOCATION_SHARED_RATE_LIMIT):
+# the preferred variant may wait briefly for a token, the other variants and the
+# hedges are only sent with spare tokens
+limiter = rate_limit.limiter('location')
+
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SEARCHES * 2)
+
+
+def search_parameters(text, zip_code):
+    parameters = {
+        'IndexName': os.environ["INDEX_NAME"],
+        'Text': text,
+        'MaxResults': MAX_RESULTS
+    }
+    if FILTER_COUNTRIES:
+        parameters['FilterCountries'] = FILTER_COUNTRIES
+
+    zip_info = zip_codes.lookup(zip_code) if zip_code is not None else None
+    if zip_info is not None:
+        latitude, longitude = zip_info[2], zip_info[3]
+        # BiasPosition and FilterBBox are mutually exclusive; positions are [longitude, latitude]
+        if BBOX_DEGREES > 0:
+            parameters['FilterBBox'] = [
+                longitude - BBOX_DEGREES, latitude - BBOX_DEGREES,
+                longitude + BBOX_DEGREES, latitude + BBOX_DEGREES
+            ]
+        else:
+            parameters['BiasPosition'] = [longitude, latitude]
+
+    return parameters
+
+
+def search(text, zip_code, location):
+    # location is the client chosen for the deadline budget of the turn
+    parameters = search_parameters(text, zip_code)
+    try:
+        location_response = location.search_place_index_for_text(**parameters)
+    except location.exceptions.ResourceNotFoundException as e:
+        logger.warning('<<geocoder>> Location service index not found: ... creating')
+
+        create_response = location.create_place_index(
+            IndexName=os.environ["INDEX_NAME"], Description='Place index for Lex update address example',
+            DataSource='Esri', DataSourceConfiguration={'IntendedUse': 'SingleUse'}
+        )
+        logger.warning('<<geocoder>> Location service create index response = {}'.format(json.dumps(create_response, default=str)))
+
+        location_response = location.search_place_index_for_text(**parameters)
+
+    logger.info('<<geocoder>> Location Service response = {}'.format(json.dumps(location_response, default=str)))
+    return location_response
+
+
+def select_candidate(location_response, zip_code, prior_suggestions):
+    # the first entry with a valid street that was not already tried is the next best guess
+    for result in location_response.get('Results', None) or []:
+        place = result.get('Place', None)
+        if place is None:
+            continue
+
+        addressLabel = place.get('Label', None)
+        logger.debug('<<geocoder>> checking address = {}'.format(addressLabel))
+
+        if place.get('Street', None) is None:
+            logger.debug('<<geocoder>> skipping address, no Street')
+            continue
+
+        if place.get('AddressNumber', None) is None:
+            logger.debug('<<geocoder>> skipping address, no AddressNumber')
+            continue
+
+        postalCode = place.get('PostalCode', None)
+        if postalCode is not None:
+            postalCode = postalCode.replace(' ', '-')
+
+        if zip_code is not None:
+            if postalCode is None or postalCode[:len(zip_code)] != zip_code:
+                logger.debug('<<geocoder>> skipping address, wrong PostalCode')
+                continue
+
+        if addressLabel in prior_suggestions:
+            logger.debug('<<geocoder>> skipping address, already tried: {}'.format(addressLabel))
+            continue
+
+        return {
+            'resolvedAddress': addressLabel,
+            'addressNumber': place.get('AddressNumber', None),
+            'street': place.get('Street', None),
+            'city': place.get('Municipality', None),
+            'stateProvince': place.get('Region', None),
+            'subRegion': place.get('SubRegion', None),
+            'postalCode': postalCode,
+            'relevance': result.get('Relevance', 0)
+        }
+
+    return None
+
+
+def timed_search(text, zip_code, location):
+    # search, feeding the latency tracker and the circuit breaker
+    started = time.monotonic()
+    try:
+        location_response = search(text, zip_code, location)
+    except Exception as error:
+        if resilience.is_failure(error):
+            breaker.record(False)
+        else:
+            breaker.release()
+        raise
+    latencies.add(time.monotonic() - started)
+    breaker.record(True)
+    return location_response
+
+
+def first_result(futures):
+    # (result, future) of the first of futures to succeed; the first error if all fail,
+    # or deadline.DeadlineExceeded if none succeeded in time
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline.remaining()), return_when=FIRST_COMPLETED)
+        if not done:
+            raise deadline.DeadlineExceeded('Location search still running at the deadline')
+        for future in futures:
+            if future in done:
+                if future.exception() is None:
+                    return future.result(), future
+                error = error or future.exception()
+    raise error
+
+
+def spare_tokens(count):
+    # how many of count optional calls get a token without waiting
+    for taken in range(count):
+        if not limiter.try_acquire():
+            return taken
+    return count
+
+
+def search_best(queries, zip_code, prior_suggestions):
+    # search every query variant, and return the most relevant candidate; on a tie the
+    # earlier (preferred) variant wins. A failing variant, or one still running at the
+    # deadline, is skipped unless all fail (deadline.DeadlineExceeded if none finished).
+    location = deadline.client('location')
+    # an open breaker refuses the search before it takes or waits for a token
+    if not breaker.allow():
+        metrics.emit({'Service': 'Location'}, {'SearchesRefused': 1, 'CircuitOpen': 1})
+        raise resilience.CircuitOpen('location')
+    try:
+        limiter.acquire()
+    except rate_limit.RateLimited:
+        # a probe allowed by a half open breaker was not made
+        breaker.release()
+        raise
+
+    # a half open breaker lets a single probe call through
+    probing = breaker.is_open
+    queries = queries[:1 if probing else MAX_CONCURRENT_SEARCHES]
+    wanted = len(queries)
+    queries = queries[:1 + spare_tokens(len(queries) - 1)]
+    variants_skipped = wanted - len(queries)
+
+    started = time.monotonic()
+    primaries = [executor.submit(timed_search, query, zip_code, location) for query in queries]
+    hedges = [None] * len(queries)
+    hedges_skipped = 0
+    if HEDGING and not probing:
+        delay = max(HEDGE_MIN_DELAY, latencies.percentile(HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY))
+        if delay < deadline.remaining():
+            wait(primaries, timeout=delay)
+            for index, future in enumerate(primaries):
+                if future.done():
+                    continue
+                if not spare_tokens(1):
+                    hedges_skipped += 1
+                    continue
+                logger.info('<<geocoder>> hedging query "{}" after {:.0f} ms'.format(queries[index], delay * 1000))
+                hedges[index] = executor.submit(timed_search, queries[index], zip_code, location)
+
+    responses = []
+    errors = []
+    hedge_wins = 0
+    for query, primary, hedge in zip(queries, primaries, hedges):
+        try:
+            location_response, winner = first_result([primary] if hedge is None else [primary, hedge])
+            hedge_wins += winner is hedge
+            responses.append(location_response)
+        except Exception as error:
+            logger.warning('<<geocoder>> query "{}" failed: {}'.format(query, error))
+            responses.append({})
+            errors.append(error)
+
+    metrics.emit({'Service': 'Location'}, {
+        'SearchLatency': (time.monotonic() - started) * 1000,
+        'HedgedRequests': sum(1 for hedge in hedges if hedge is not None),
+        'HedgeWins': hedge_wins,
+        'HedgesSkipped': hedges_skipped,
+        'VariantsSkipped': variants_skipped,
+        'SearchErrors': len(errors),
+        'CircuitOpen': int(breaker.is_open)
+    }, {'SearchLatency': 'Milliseconds'})
+
+    if len(errors) == len(queries):
+        raise errors[0]
+
+    best = None
+    for query, location_response in zip(queries, responses):
+        candidate = select_candidate(location_response, zip_code, prior_suggestions)
+        logger.debug('<<geocoder>> query "{}" candidate = {}'.format(query, candidate))
+        if candidate is not None and (best is None or candidate['relevance'] > best['relevance']):
+            best = candidate
+
+    return best
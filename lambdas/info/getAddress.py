@@ -4,45 +4,81 @@ import json
 import helpers
 import os
 import address_helpers
-import boto3
+import deadline
 import re
 import parse_address
+import gazetteer
+import zip_codes
+import geocoder
+import rate_limit
+import resilience
+import lex_event
+import caller_profiles
+import idempotency
+import deferred_verification
+import speech_timeouts
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-location = boto3.client('location')
-db = boto3.resource("dynamodb")
+deadline.prewarm_resource("dynamodb")
 
-def lambda_handler(event, context):
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+# With FULFILLMENT_UPDATES the slow steps of RequestBrochure (the Location search and
+# saving the confirmed address) run in the fulfillment code hook: the dialog code hook
+# delegates with the intent ReadyForFulfillment, and Lex plays the start and update
+# messages of the intent's fulfillmentUpdatesSpecification while the search or the write
+# runs (see tools/fulfillment_updates.json). The bot must have them configured first.
+FULFILLMENT_UPDATES = os.environ.get('FULFILLMENT_UPDATES', '0') == '1'
 
-    intent = sessionState.get("intent", {})
+def lambda_handler(event, context, turn=None):
+    if turn is None:
+        turn = lex_event.LexTurn(event)
+    sessionAttributes = turn.session_attributes
+
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
-    slot_values = intent['slots']
-    confirmationStatus = intent.get('confirmationState', 'None')
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
+    confirmationStatus = turn.confirmation_state
    
-    requestAttributes = event.get("requestAttributes", {})
+    requestAttributes = turn.request_attributes
 
     logger.info('[{}] - Lex event info {} '.format(intent_name, json.dumps(event)))
 
+    # the fulfillment invocation of a confirmed (or accepted profile) address only saves it
+    if turn.invocation_source == 'FulfillmentCodeHook' and confirmationStatus == 'Confirmed':
+        return save_confirmed_address(turn)
+
+    # a returning caller is first offered the address they confirmed last time
+    if caller_profiles.answered_offer(turn, 'resolvedAddress'):
+        if confirmationStatus == 'Confirmed':
+            return save_confirmed_address(turn)
+        # declined: ask for the address as usual
+        confirmationStatus = intent['confirmationState'] = 'None'
+    elif confirmationStatus == 'None' and turn.slot_value('ZipCode') is None:
+        profile = caller_profiles.offer(turn, 'resolvedAddress')
+        if profile is not None:
+            return offer_profile_address(turn, profile)
+
     # check for ZipCode slot; elicit it if not available
-    zip_code = None
     zip_code_elicited = False
-    zipCode = slot_values.get('ZipCode', None)
-    if zipCode is not None:
-        zip_code = zipCode['value'].get('interpretedValue', None)
-        if zip_code is not None:
-            if len(zip_code) != 5:
-                zip_code = None
+    zip_code = turn.slot_value('ZipCode')
+    if zip_code is not None:
+        if not zip_codes.is_valid(zip_code):
+            logger.info('<<{}>> invalid ZipCode slot = {}'.format(intent_name, zip_code))
+            zip_code = None
+            turn.clear_slot('ZipCode')
 
     if zip_code is not None:
         zip_code_elicited = True
         logger.debug('<<{}>> ZipCode slot = {}'.format(intent_name, zip_code))
+
+        # pre-fill city and state from the zip code reference table, if deployed
+        zip_info = zip_codes.lookup(zip_code)
+        if zip_info is not None:
+            sessionAttributes['city_municipality'] = zip_info[0]
+            sessionAttributes['state_province'] = zip_info[1]
     else:
         response = helpers.elicit_slot_with_retries(intent, activeContexts, sessionAttributes, "ZipCode", requestAttributes)
         logger.info('<<{}>> elicitSlot response = {}'.format(intent_name, json.dumps(response)))
@@ -51,31 +87,33 @@ def lambda_handler(event, context):
     logger.debug('<<{}>> zip_code = "{}"'.format(intent_name, zip_code))
 
     # if no StreetAddress slot, elicit for it
-    street_address = None
-    streetAddress = slot_values.get('StreetAddress', None)
-    if streetAddress is not None:
-        street_address = streetAddress['value'].get('interpretedValue', None)
+    street_address = turn.slot_value('StreetAddress')
+    if street_address is not None:
         logger.debug('<<{}>> StreetAddress = {}'.format(intent_name, street_address))
     else:
         # give them a little extra time for this response
-        sessionAttributes['x-amz-lex:audio:end-timeout-ms:' + intent_name + ':StreetAddress'] = 2000
+        speech_timeouts.apply(turn, 'StreetAddress', speech_timeouts.INITIAL_STAGE)
         response = helpers.elicit_slot_with_retries(intent, activeContexts, sessionAttributes, "StreetAddress", requestAttributes)
         logger.info('<<{}>> elicitSlot response = {}'.format(intent_name, json.dumps(response)))
         return response
         
     # convert text to digits in the street address user utterance
     logger.info('<<{}>> raw StreetAddress transcription = {}'.format(intent_name, street_address))
+    raw_street_address = street_address
     street_address = parse_address.parse(street_address)
     logger.info('<<{}>> post-processed StreetAddress transcription = {}'.format(intent_name, street_address))
 
+    # correct misrecognized street names against the local gazetteer, if deployed
+    street_address = gazetteer.correct_street_name(street_address, zip_code)
+    parsed_street_address = street_address
+
     sessionAttributes['inputAddress'] = street_address
 
     # get (latest) spelled street name
-    spelled_street_name = None
-    spelledStreetName = slot_values.get('SpelledStreetName', None)
-    if spelledStreetName is not None:
-        spelled_street_name = spelledStreetName['value'].get('interpretedValue', None)
+    spelled_street_name = turn.slot_value('SpelledStreetName')
+    if spelled_street_name is not None:
         spelled_street_name = address_helpers.fix_spelled_street_name(spelled_street_name)
+        spelled_street_name = gazetteer.correct_street_name(spelled_street_name, zip_code)
         logger.debug('<<{}>> SpelledStreetName slot = {}'.format(intent_name, spelled_street_name))
         
         attribute = helpers.store_value('spelled_street_name', spelled_street_name, sessionAttributes)
@@ -83,16 +121,15 @@ def lambda_handler(event, context):
         logger.debug('<<{}>> stored {} = {}'.format(intent_name, attribute, value))
         
         # remove the slot value as we have stored it in a session attribute
-        slot_values['SpelledStreetName'] = None
+        turn.clear_slot('SpelledStreetName')
     
     else:
         spelled_street_name = helpers.get_latest_value('spelled_street_name', sessionAttributes)
 
     # get (latest) said street name, if available
-    street_name = None
-    streetName = slot_values.get('StreetName', None)
-    if streetName is not None:
-        street_name = streetName['value'].get('interpretedValue', None)
+    street_name = turn.slot_value('StreetName')
+    if street_name is not None:
+        street_name = gazetteer.correct_street_name(street_name, zip_code)
         logger.debug('<<{}>> StreetName slot = {}'.format(intent_name, street_name))
         
         attribute = helpers.store_value('street_name', street_name, sessionAttributes)
@@ -100,16 +137,14 @@ def lambda_handler(event, context):
         logger.debug('<<{}>> stored {} = {}'.format(intent_name, attribute, value))
 
         # remove the slot value as we have stored it in a session attribute
-        slot_values['StreetName'] = None
+        turn.clear_slot('StreetName')
     
     else:
         street_name = helpers.get_latest_value('street_name', sessionAttributes)
 
     # get (latest) street address number, if available
-    street_address_number = None
-    streetAddressNumber = slot_values.get('StreetAddressNumber', None)
-    if streetAddressNumber is not None:
-        street_address_number = streetAddressNumber['value'].get('interpretedValue', None)
+    street_address_number = turn.slot_value('StreetAddressNumber')
+    if street_address_number is not None:
         logger.debug('<<{}>> StreetAddressNumber slot = {}'.format(intent_name, street_address_number))
         
         attribute = helpers.store_value('street_address_number', street_address_number, sessionAttributes)
@@ -117,7 +152,7 @@ def lambda_handler(event, context):
         logger.debug('<<{}>> stored {} = {}'.format(intent_name, attribute, value))
 
         # remove the slot value as we have stored it in a session attribute
-        slot_values['StreetAddressNumber'] = None
+        turn.clear_slot('StreetAddressNumber')
     
     else:
         street_address_number = helpers.get_latest_value('street_address_number', sessionAttributes)
@@ -142,87 +177,61 @@ def lambda_handler(event, context):
         else:
             street_address = street_address_number + ' ' + street_address
 
-    # append zip code to the street address
-    street_address = street_address + ' ' + zip_code
+    # the combined address is the preferred query; the parsed and raw transcripts (and the
+    # said street name when a spelled one is also available) are searched alongside it
+    queries = address_helpers.query_variants(street_address, parsed_street_address, raw_street_address, spelled_street_name, street_name)
+
+    # append zip code to each query, biased by the known city and state
+    query_suffix = ' ' + zip_code
+    if zip_info is not None:
+        query_suffix = ' ' + zip_info[0] + ' ' + zip_info[1] + query_suffix
 
     # remove any . characters 
-    street_address = street_address.replace('.', '')
+    spoken_street_address = queries[0].replace('.', '')
+    queries = [(query + query_suffix).replace('.', '') for query in queries]
+    street_address = queries[0]
 
     # search for and address, and confirm with the user
     if confirmationStatus == 'None':
-        logger.info('<<{}>> sending query to AWS Location Service: "{}"'.format(intent_name, street_address))
+        if not in_fulfillment(turn):
+            return fulfill_later(turn)
+        logger.info('<<{}>> sending queries to AWS Location Service: {}'.format(intent_name, queries))
 
         # validate the address using the AWS Location Service
+        prior_suggestions = helpers.get_all_values('suggested_address', sessionAttributes)
         try:
-            location_response = location.search_place_index_for_text(IndexName=os.environ["INDEX_NAME"],Text=street_address)
-            logger.info('<<{}>> Location Service response = {}'.format(intent_name, json.dumps(location_response)))
-        except location.exceptions.ResourceNotFoundException as e:
-            logger.warning('<<{}>> Location service index not found: ... creating'.format(intent_name))
-
-            location_response = location.create_place_index(
-                IndexName=os.environ["INDEX_NAME"], Description='Place index for Lex update address example',
-                DataSource='Esri', DataSourceConfiguration={'IntendedUse': 'SingleUse'}
-            )
-            logger.warning('<<{}>> Location service create index response = {}'.format(intent_name, json.dumps(location_response, default=str)))
-            
-            location_response = location.search_place_index_for_text(IndexName=os.environ["INDEX_NAME"],Text=street_address)
-            logger.info('<<{}>> Location Service response = {}'.format(intent_name, json.dumps(location_response)))
+            candidate = geocoder.search_best(queries, zip_code, prior_suggestions)
+        except resilience.CircuitOpen:
+            # Location is failing: queue the address for verification and end the call, or
+            # confirm the spoken address with the city and state of the zip code
+            logger.warning('<<{}>> Location circuit open, accepting the address unverified'.format(intent_name))
+            if deferred_verification.enqueue(turn, zip_code, 'circuit_open'):
+                return address_helpers.close_deferred(turn, helpers.constant_message(address_helpers.DEFERRED_PROMPT))
+            return confirm_unverified_address(turn, spoken_street_address, zip_code, zip_info)
+        except Exception as error:
+            if not deadline.is_timeout(error) and not rate_limit.is_throttled(error):
+                raise
+            logger.warning('<<{}>> address search ran out of time or was throttled: {}'.format(intent_name, error))
+            turn.clear_slot('StreetAddress')
+            response_message = helpers.constant_message('Sorry, I could not look up that address in time. Please say your street address again.')
+            speech_timeouts.apply(turn, 'StreetAddress', 'search_failed')
+            response = helpers.elicit_slot(intent, activeContexts, sessionAttributes, 'StreetAddress', requestAttributes, None, response_message)
+            logger.info('<<{}>> elicitSlot response = {}'.format(intent_name, json.dumps(response)))
+            return response
 
         resolvedAddress = None
-        addressNumber = None
-        street = None
-        city = None
-        stateProvince = None
-        subRegion = None
-        postalCode = None
-
-        if location_response.get('Results', None) is not None:
-            for address in location_response['Results']:
-                if address.get('Place', None) is not None:
-                    addressLabel = address['Place'].get('Label', None)
-                    logger.debug('<<{}>> checking address = {}'.format(intent_name, addressLabel))
-    
-                    street = address['Place'].get('Street', None)
-                    addressNumber = address['Place'].get('AddressNumber', None)
-                    postalCode = address['Place'].get('PostalCode', None)
-                    if postalCode is not None:
-                        postalCode = postalCode.replace(' ', '-')
-
-                    if street is None:
-                        logger.debug('<<{}>> skipping address, no Street'.format(intent_name))
-                        continue
-                    
-                    if addressNumber is None:
-                        logger.debug('<<{}>> skipping address, no AddressNumber'.format(intent_name))
-                        continue
-                    
-                    if zip_code is not None:
-                        if postalCode[:len(zip_code)] != zip_code:
-                            logger.debug('<<{}>> skipping address, wrong PostalCode'.format(intent_name))
-                            continue
-                        
-                    already_tried = False
-                    prior_suggestions = helpers.get_all_values('suggested_address', sessionAttributes)
-                    for prior_suggestion in prior_suggestions:
-                        if addressLabel == prior_suggestion:
-                            already_tried = True
-                            break
-                    
-                    if already_tried:
-                        logger.debug('<<{}>> skipping address, already tried: {}'.format(intent_name, addressLabel))
-                        continue
-
-                    # the first entry with a valid street that was not already tried is the next best guess
-                    resolvedAddress = addressLabel
-                    addressNumber = address['Place'].get('AddressNumber', None)
-                    city = address['Place'].get('Municipality', None)
-                    stateProvince = address['Place'].get('Region', None)
-                    subRegion = address['Place'].get('SubRegion', None)
-                    break
+        if candidate is not None:
+            resolvedAddress = candidate['resolvedAddress']
+            addressNumber = candidate['addressNumber']
+            street = candidate['street']
+            city = candidate['city']
+            stateProvince = candidate['stateProvince']
+            subRegion = candidate['subRegion']
+            postalCode = candidate['postalCode']
 
         if resolvedAddress is not None:
             logger.debug('<<{}>> FOUND A POSSIBLE MATCH'.format(intent_name))
-            if (event.get('inputMode') == 'Speech'):
+            if (turn.input_mode == 'Speech'):
                 response_string = '<speak>OK, your new address is <say-as interpret-as="address">' + resolvedAddress + '</say-as>.'
                 response_string += ' Is that right?</speak>'
                 response_message = helpers.format_message_array(response_string, 'SSML')
@@ -238,6 +247,7 @@ def lambda_handler(event, context):
             sessionAttributes['state_province'] = stateProvince
             sessionAttributes['subRegion'] = subRegion
             sessionAttributes['postal_code'] = postalCode
+            sessionAttributes['addressVerified'] = '1'
    
             # store this suggested address
             attribute = helpers.store_value('suggested_address', resolvedAddress, sessionAttributes)
@@ -249,46 +259,168 @@ def lambda_handler(event, context):
             return response
             
         else:
-            return address_helpers.next_retry(event, 'no-match')
+            return address_helpers.next_retry(turn, 'no-match')
             
     elif confirmationStatus == 'Confirmed': 
-        #Put in dynamo table  
-        try:
-            table = db.Table(os.environ["ADDRESS_TABLE"])
-            table.put_item(Item={'address':sessionAttributes.get('resolvedAddress'),
-                'city': sessionAttributes.get('city_municipality'),
-                'state': sessionAttributes.get('state_province')
-                })
-        except Exception as error:
-            print(error)
-            response_string = 'Table Insert Confirmation error'
-            response_message = helpers.format_message_array(response_string, 'PlainText')
-            intent['state'] = 'Fulfilled'
-            response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-            logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
-            return response
+        return save_confirmed_address(turn)
 
-        response_string = 'OK, we will mail a brochure to ' + sessionAttributes.get('resolvedAddress')
-        response_message = helpers.format_message_array(response_string, 'PlainText')
-        intent['state'] = 'Fulfilled'
-        sessionAttributes['addressConfirmed'] = 1
+    elif confirmationStatus == 'Denied':
 
-        if sessionAttributes.get('StreetAddress_retries'):
-            del sessionAttributes['StreetAddress_retries']
+        return address_helpers.next_retry(turn, 'incorrect')
 
+    else:
+        response_message = helpers.constant_message('Confirmation error')
+        intent['state'] = 'Fulfilled'
         response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
         logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
         return response
 
-    elif confirmationStatus == 'Denied':
 
-        return address_helpers.next_retry(event, 'incorrect')
+def confirm_unverified_address(turn, street_address, zip_code, zip_info):
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    resolvedAddress = street_address
+    if zip_info is not None:
+        resolvedAddress += ', ' + zip_info[0] + ', ' + zip_info[1]
+    resolvedAddress += ' ' + zip_code
 
+    if (turn.input_mode == 'Speech'):
+        response_string = '<speak>OK, I have <say-as interpret-as="address">' + resolvedAddress + '</say-as>.'
+        response_string += ' Is that right?</speak>'
+        response_message = helpers.format_message_array(response_string, 'SSML')
     else:
-        response_string = 'Confirmation error'
+        response_string = 'OK, I have ' + resolvedAddress + '. Is that right?'
         response_message = helpers.format_message_array(response_string, 'PlainText')
+    intent['state'] = 'Fulfilled'
+
+    sessionAttributes['resolvedAddress'] = resolvedAddress
+    sessionAttributes['postal_code'] = zip_code
+    sessionAttributes['addressVerified'] = '0'
+
+    response = helpers.confirm(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> confirm unverified address response = {}'.format(intent_name, json.dumps(response)))
+    return response
+
+
+def in_fulfillment(turn):
+    # whether the slow steps run in this invocation
+    return not FULFILLMENT_UPDATES or turn.invocation_source == 'FulfillmentCodeHook'
+
+
+def fulfill_later(turn):
+    # hands the turn to the fulfillment code hook, so Lex speaks while it runs
+    intent = turn.intent
+    intent['state'] = 'ReadyForFulfillment'
+    response = helpers.delegate(intent, turn.active_contexts, turn.session_attributes, None, turn.request_attributes)
+    logger.info('<<{}>> delegate to fulfillment response = {}'.format(turn.intent_name, json.dumps(response)))
+    return response
+
+
+def save_confirmed_address(turn):
+    if not in_fulfillment(turn):
+        return fulfill_later(turn)
+    # a repeated invocation of the confirmed turn is answered from its own turn, without a second write
+    try:
+        return idempotency.once(
+            turn, 'saveConfirmedAddress', [turn.session_attributes.get('resolvedAddress')],
+            write_confirmed_address, address_saved, reconfirm_address
+        )
+    except Exception as error:
+        print(error)
+        if deadline.is_timeout(error):
+            return reconfirm_address(turn)
+        intent = turn.intent
+        response_message = helpers.constant_message('Table Insert Confirmation error')
         intent['state'] = 'Fulfilled'
-        response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-        logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
+        response = helpers.close(intent, turn.active_contexts, turn.session_attributes, response_message, turn.request_attributes)
+        logger.info('<<{}>> close response = {}'.format(turn.intent_name, json.dumps(response)))
         return response
 
+
+def write_confirmed_address(turn):
+    sessionAttributes = turn.session_attributes
+
+    # an address accepted while Location was failing is written as unverified, and queued
+    # so the verification worker replaces it with the Location match later
+    verification = 'verified'
+    if sessionAttributes.get('addressVerified') == '0':
+        queued = deferred_verification.enqueue(turn, sessionAttributes.get('postal_code'), 'circuit_open', sessionAttributes.get('resolvedAddress'))
+        verification = 'pending' if queued else 'unverified'
+
+    #Put in dynamo table  
+    table = deadline.resource("dynamodb").Table(os.environ["ADDRESS_TABLE"])
+    table.put_item(Item={'address':sessionAttributes.get('resolvedAddress'),
+        'city': sessionAttributes.get('city_municipality'),
+        'state': sessionAttributes.get('state_province'),
+        'verification': verification
+        })
+
+    # only verified addresses are offered to the caller again
+    if verification == 'verified':
+        caller_profiles.save(turn, {
+            'resolvedAddress': sessionAttributes.get('resolvedAddress'),
+            'city': sessionAttributes.get('city_municipality'),
+            'state': sessionAttributes.get('state_province'),
+            'postalCode': sessionAttributes.get('postal_code')
+        })
+
+
+def address_saved(turn):
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    response_string = 'OK, we will mail a brochure to ' + sessionAttributes.get('resolvedAddress')
+    response_message = helpers.format_message_array(response_string, 'PlainText')
+    intent['state'] = 'Fulfilled'
+    sessionAttributes['addressConfirmed'] = 1
+
+    if sessionAttributes.get('StreetAddress_retries'):
+        del sessionAttributes['StreetAddress_retries']
+
+    response = helpers.close(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
+    return response
+
+
+def reconfirm_address(turn):
+    # ask again, so the next turn retries the write with a fresh budget
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    caller_profiles.reoffer(turn, 'resolvedAddress')
+    response_string = 'Sorry, that took longer than expected. Should we mail the brochure to ' + sessionAttributes.get('resolvedAddress') + '?'
+    response_message = helpers.format_message_array(response_string, 'PlainText')
+    intent['state'] = 'Fulfilled'
+    response = helpers.confirm(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> confirm response = {}'.format(intent_name, json.dumps(response)))
+    return response
+
+
+def offer_profile_address(turn, profile):
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+    resolvedAddress = profile['resolvedAddress']
+
+    if (turn.input_mode == 'Speech'):
+        response_string = '<speak>Welcome back. Should we mail the brochure to <say-as interpret-as="address">' + resolvedAddress + '</say-as>'
+        response_string += ' again?</speak>'
+        response_message = helpers.format_message_array(response_string, 'SSML')
+    else:
+        response_string = 'Welcome back. Should we mail the brochure to ' + resolvedAddress + ' again?'
+        response_message = helpers.format_message_array(response_string, 'PlainText')
+    intent['state'] = 'Fulfilled'
+
+    sessionAttributes['resolvedAddress'] = resolvedAddress
+    sessionAttributes['city_municipality'] = profile.get('city', None)
+    sessionAttributes['state_province'] = profile.get('state', None)
+    sessionAttributes['postal_code'] = profile.get('postalCode', None)
+    sessionAttributes['addressVerified'] = '1'
+
+    response = helpers.confirm(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> confirm profile address response = {}'.format(intent_name, json.dumps(response)))
+    return response
@@ -3,106 +3,215 @@ import logging
 import json
 import helpers
 import email_helpers
-import boto3
+import deadline
 import re
 import os
+import lex_event
+import caller_profiles
+import idempotency
+import rate_limit
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sns = boto3.client('sns')
+deadline.prewarm_client('sns')
 
-def lambda_handler(event, context):
-    sessionState = event.get('sessionState', {})
-    sessionAttributes = sessionState.get("sessionAttributes", {})
+# SNS subscribe calls per second (SNS_RATE_LIMIT, SNS_SHARED_RATE_LIMIT)
+limiter = rate_limit.limiter('sns')
 
-    intent = sessionState.get("intent", {})
+# the address as heard, while the caller is asked about a suggested domain
+HEARD_ATTRIBUTE = 'heardEmailAddress'
+
+def lambda_handler(event, context, turn=None):
+    if turn is None:
+        turn = lex_event.LexTurn(event)
+    sessionAttributes = turn.session_attributes
+
+    intent = turn.intent
     intent.pop('state', None)
 
-    activeContexts = sessionState.get("activeContexts", [])
-    intent_name = intent['name']
-    slot_values = intent['slots']
-    confirmationStatus = intent.get('confirmationState', 'None')
+    activeContexts = turn.active_contexts
+    intent_name = turn.intent_name
+    confirmationStatus = turn.confirmation_state
    
-    requestAttributes = event.get("requestAttributes", {})
+    requestAttributes = turn.request_attributes
 
     logger.info('[{}] - Lex event info {} '.format(intent_name, json.dumps(event)))
 
+    # a returning caller is first offered the email address they confirmed last time
+    if caller_profiles.answered_offer(turn, 'emailAddress'):
+        if confirmationStatus == 'Confirmed':
+            return subscribe(turn, sessionAttributes['resolvedEmailAddress'])
+        # declined: ask for the email address as usual
+        confirmationStatus = intent['confirmationState'] = 'None'
+    elif confirmationStatus == 'None' and turn.slots.get('EmailAddress', None) is None:
+        profile = caller_profiles.offer(turn, 'emailAddress')
+        if profile is not None:
+            return offer_profile_email_address(turn, profile['emailAddress'])
+
     # if no EmailAddress slot, elicit for it
-    email_address = None
-    emailAddress = slot_values.get('EmailAddress', None)
-    if emailAddress is not None:
-        email_address = emailAddress['value'].get('interpretedValue', None)
+    if turn.slots.get('EmailAddress', None) is not None:
+        email_address = turn.slot_value('EmailAddress')
+        if email_address is None:
+            email_address = turn.slot_value('EmailAddress', 'originalValue')
         
         if email_address is not None:
+            # turn spoken forms ("at", "dot", "g mail") into an address, then validate it
+            email_address = email_helpers.normalize_email_address(email_address)
             if not email_helpers.validate_email_address(email_address):
                 email_address = None
         
         if email_address is None:
-            original_value = emailAddress['value'].get('originalValue', '<none>')
-            logger.info('<<{}>> no match on EmailAddress slot, originalValue = {}'.format(intent_name, email_address))
-            return email_helpers.next_retry(event, 'no-match')
+            original_value = turn.slot_value('EmailAddress', 'originalValue')
+            logger.info('<<{}>> no match on EmailAddress slot, originalValue = {}'.format(intent_name, original_value))
+            return email_helpers.next_retry(turn, 'no-match')
 
         logger.info('<<{}>> EmailAddress = {}'.format(intent_name, email_address))
     else:
-        # give them a little extra time to say their email address
-        sessionAttributes['x-amz-lex:audio:end-timeout-ms:' + intent_name + ':EmailAddress'] = 2000
-        return email_helpers.next_retry(event, 'no-match')
+        # the retry action sets the end-of-speech timeout for the EmailAddress slot
+        return email_helpers.next_retry(turn, 'no-match')
 
     # post-process the email address recognized by Lex
     logger.info('<<{}>> EmailAddress transcription = {}'.format(intent_name, email_address))
     sessionAttributes['inputEmailAddress'] = email_address
     
     if not email_helpers.validate_email_address(email_address):
-          return address_helpers.next_retry(event, 'no-match')
+          return email_helpers.next_retry(turn, 'no-match')
             
     if confirmationStatus == 'None':
-        if (event.get('inputMode') == 'Speech'):
-            spoken_email_address = email_helpers.transform_email_for_speech(email_address)
+        # a near miss of a popular domain is asked about, not corrected
+        suggested_email_address = email_helpers.suggest_email_address(email_address)
+        if suggested_email_address is not None:
+            sessionAttributes[HEARD_ATTRIBUTE] = email_address
+            return confirm_email_address(turn, suggested_email_address, suggested=True)
+        sessionAttributes.pop(HEARD_ATTRIBUTE, None)
+        return confirm_email_address(turn, email_address)
+
+    elif confirmationStatus == 'Confirmed':
+        sessionAttributes.pop(HEARD_ATTRIBUTE, None)
+        return subscribe(turn, sessionAttributes.get('resolvedEmailAddress', None) or email_address)
+
+    elif confirmationStatus == 'Denied':
+        # declined the suggested domain: confirm the address as heard
+        heard_email_address = sessionAttributes.pop(HEARD_ATTRIBUTE, None)
+        if heard_email_address is not None:
+            intent['confirmationState'] = 'None'
+            return confirm_email_address(turn, heard_email_address)
+        return email_helpers.next_retry(turn, 'incorrect')
+
+    else:
+        response_message = helpers.constant_message('Confirmation error')
+        intent['state'] = 'Fulfilled'
+        response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
+        logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
+        return response
+
 
+def confirm_email_address(turn, email_address, suggested=False):
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    if (turn.input_mode == 'Speech'):
+        spoken_email_address = email_helpers.transform_email_for_speech(email_address, turn.locale)
+
+        if suggested:
+            response_string = '<speak>Did you mean, ' + spoken_email_address + '?</speak>'
+        else:
             response_string = '<speak>OK, your new email address is, ' + spoken_email_address + '.'
             response_string += ' Is that right?</speak>'
-            response_message = helpers.format_message_array(response_string, 'SSML')
+        response_message = helpers.format_message_array(response_string, 'SSML')
+    else:
+        if suggested:
+            response_string = 'Did you mean ' + email_address + '?'
         else:
             response_string = 'OK, your new email address is ' + email_address + '. Is that right?'
-            response_message = helpers.format_message_array(response_string, 'PlainText')
-        intent['state'] = 'Fulfilled'
+        response_message = helpers.format_message_array(response_string, 'PlainText')
+    intent['state'] = 'Fulfilled'
 
-        sessionAttributes['resolvedEmailAddress'] = email_address
+    sessionAttributes['resolvedEmailAddress'] = email_address
 
-        # store this suggested address
-        attribute = helpers.store_value('suggested_email_address', email_address, sessionAttributes)
-        value = helpers.get_latest_value('suggested_email_address', sessionAttributes)
-        logger.info('<<{}>> stored {} = {}'.format(intent_name, attribute, value))
-        
-        response = helpers.confirm(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-        logger.info('<<{}>> confirm response = {}'.format(intent_name, json.dumps(response)))
-        return response
+    # store this suggested address
+    attribute = helpers.store_value('suggested_email_address', email_address, sessionAttributes)
+    value = helpers.get_latest_value('suggested_email_address', sessionAttributes)
+    logger.info('<<{}>> stored {} = {}'.format(intent_name, attribute, value))
 
-    elif confirmationStatus == 'Confirmed':
-        
-        response = sns.subscribe(
-            TopicArn=os.environ["TOPIC_ARN"],
-            Protocol='email',
-            Endpoint=email_address,
-            ReturnSubscriptionArn=False
+    response = helpers.confirm(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> confirm response = {}'.format(intent_name, json.dumps(response)))
+    return response
+
+
+def subscribe(turn, email_address):
+    # a repeated invocation of the confirmed turn is answered from its own turn, without a second subscription
+    try:
+        return idempotency.once(
+            turn, 'subscribe', [email_address],
+            lambda turn: subscribe_email_address(turn, email_address),
+            subscribed,
+            lambda turn: reconfirm_subscription(turn, email_address)
         )
-        response_string = 'Thank you for subscribing to our email messages.'
-        response_message = helpers.format_message_array(response_string, 'PlainText')
-        intent['state'] = 'Fulfilled'
-        sessionAttributes['emailAddressConfirmed'] = 1
+    except Exception as error:
+        if not deadline.is_timeout(error) and not rate_limit.is_throttled(error):
+            raise
+        logger.warning('<<{}>> subscribe ran out of time or was throttled: {}'.format(turn.intent_name, error))
+        return reconfirm_subscription(turn, email_address)
 
-        response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-        logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
-        return response
 
-    elif confirmationStatus == 'Denied':
-        return email_helpers.next_retry(event, 'incorrect')
+def subscribe_email_address(turn, email_address):
+    limiter.acquire()
+    deadline.client('sns').subscribe(
+        TopicArn=os.environ["TOPIC_ARN"],
+        Protocol='email',
+        Endpoint=email_address,
+        ReturnSubscriptionArn=False
+    )
+    caller_profiles.save(turn, {'emailAddress': email_address})
+
+
+def subscribed(turn):
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    response_message = helpers.constant_message('Thank you for subscribing to our email messages.')
+    intent['state'] = 'Fulfilled'
+    sessionAttributes['emailAddressConfirmed'] = 1
 
+    response = helpers.close(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
+    return response
+
+
+def reconfirm_subscription(turn, email_address):
+    # ask again, so the next turn retries the subscription with a fresh budget
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    caller_profiles.reoffer(turn, 'emailAddress')
+    response_message = helpers.format_message_array('Sorry, that took longer than expected. Should we subscribe ' + email_address + '?', 'PlainText')
+    intent['state'] = 'Fulfilled'
+    response = helpers.confirm(intent, turn.active_contexts, turn.session_attributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> confirm response = {}'.format(intent_name, json.dumps(response)))
+    return response
+
+
+def offer_profile_email_address(turn, email_address):
+    sessionAttributes = turn.session_attributes
+    intent = turn.intent
+    intent_name = turn.intent_name
+
+    if (turn.input_mode == 'Speech'):
+        spoken_email_address = email_helpers.transform_email_for_speech(email_address, turn.locale)
+
+        response_string = '<speak>Welcome back. Should we send our email messages to, ' + spoken_email_address + ', again?</speak>'
+        response_message = helpers.format_message_array(response_string, 'SSML')
     else:
-        response_string = 'Confirmation error'
+        response_string = 'Welcome back. Should we send our email messages to ' + email_address + ' again?'
         response_message = helpers.format_message_array(response_string, 'PlainText')
-        intent['state'] = 'Fulfilled'
-        response = helpers.close(intent, activeContexts, sessionAttributes, response_message, requestAttributes)
-        logger.info('<<{}>> close response = {}'.format(intent_name, json.dumps(response)))
-        return response
\ No newline at end of file
+    intent['state'] = 'Fulfilled'
+
+    sessionAttributes['resolvedEmailAddress'] = email_address
+
+    response = helpers.confirm(intent, turn.active_contexts, sessionAttributes, response_message, turn.request_attributes)
+    logger.info('<<{}>> confirm profile email address response = {}'.format(intent_name, json.dumps(response)))
+    return response
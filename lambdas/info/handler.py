@@ -1,6 +1,12 @@
 import getAddress
 import getEmail
 import fallBack
+import lex_event
+import deadline
+import rate_limit
+import session_store
+import speech_timeouts
+import router
 import logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -13,11 +19,30 @@ HANDLERS = {
 }
 
 def handler(event, context):
-    sessionState = event.get('sessionState', {})
-    intent = sessionState.get("intent", {})
-    intent_name = intent['name']
+    deadline.start(context)
+    try:
+        # with a session table, Lex only carries a pointer and the hot attributes
+        return session_store.save(event, dispatch(session_store.load(event), context))
+    finally:
+        rate_limit.emit_metrics()
+
+
+def dispatch(event, context):
+    turn = lex_event.LexTurn(event)
+    intent_name = turn.intent_name
     logger.info('<<handler>> handler function intent_name \"%s\"', intent_name)
+
+    # metrics of the end-of-speech timeout used for the previous elicitation
+    speech_timeouts.observe(turn)
+
+    # keypad presses and obvious keywords that Lex did not classify skip the fallback prompt
+    if intent_name == 'FallbackIntent':
+        routed_intent_name = router.route(turn)
+        if routed_intent_name is not None:
+            logger.info('<<handler>> routed input "%s" to %s', turn.input_transcript, routed_intent_name)
+            intent_name = routed_intent_name
+
     if intent_name in HANDLERS:
-        return HANDLERS[intent_name](event, context)
+        return HANDLERS[intent_name](event, context, turn)
     else:
         logger.info("HANDLER: no intent found")
\ No newline at end of file
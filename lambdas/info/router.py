@@ -0,0 +1,68 @@
+
+import re
+
+# Pre-router for FallbackIntent turns: keypad presses and obvious keywords are resolved
+# to an intent here, so the caller does not need another ElicitIntent round trip.
+# Inputs that match keywords of more than one intent, or that contain a negation ("don't
+# email me", "unsubscribe"), are left to the fallback prompt.
+KEYPAD_INTENTS = {
+    '1': 'RequestBrochure',
+    '2': 'SubscribeEmailAddress'
+}
+
+KEYWORD_INTENTS = {
+    'RequestBrochure': ['brochure', 'brochures', 'booklet', 'catalog', 'catalogue', 'pamphlet', 'mailed', 'postal'],
+    'SubscribeEmailAddress': ['email', 'emails', 'newsletter', 'newsletters', 'subscribe', 'subscription']
+}
+
+INTENT_SLOTS = {
+    'RequestBrochure': ['ZipCode', 'StreetAddress', 'SpelledStreetName', 'StreetName', 'StreetAddressNumber'],
+    'SubscribeEmailAddress': ['EmailAddress']
+}
+
+# "e-mail", "e mail" and "news letter" are spelled as the keywords
+SPELLING_FIXES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'\be[\s-]+mail', 'email'),
+    (r'\bnews\s+letter', 'newsletter'),
+    (r'\u2019', "'")
+]]
+
+NEGATION_PATTERN = re.compile(r"\b(no|not|never|cannot|without|stop|cancel|unsubscrib\w*|opt(?:ing)? out)\b|n't\b|\b(dont|doesnt|didnt|wont|cant)\b")
+
+KEYWORD_PATTERN = re.compile(r'\b(' + '|'.join(sorted(
+    (keyword for keywords in KEYWORD_INTENTS.values() for keyword in keywords), key=len, reverse=True
+)) + r')\b')
+
+KEYWORD_INTENT = {keyword: intent_name for intent_name, keywords in KEYWORD_INTENTS.items() for keyword in keywords}
+
+KEYPAD_INPUT = re.compile(r'^\s*(\d)\s*#?\s*$')
+
+
+def resolve_intent(input_transcript):
+    # returns the intent name the input unambiguously asks for, or None
+    match = KEYPAD_INPUT.match(input_transcript)
+    if match is not None:
+        return KEYPAD_INTENTS.get(match.group(1), None)
+
+    text = input_transcript.lower()
+    for pattern, replacement in SPELLING_FIXES:
+        text = pattern.sub(replacement, text)
+
+    if NEGATION_PATTERN.search(text):
+        return None
+
+    intent_names = {KEYWORD_INTENT[keyword] for keyword in KEYWORD_PATTERN.findall(text)}
+    if len(intent_names) == 1:
+        return intent_names.pop()
+    return None
+
+
+def route(turn):
+    # switches a FallbackIntent turn to the resolved intent; returns its name, or None
+    intent_name = resolve_intent(turn.input_transcript)
+    if intent_name is None:
+        return None
+
+    turn.switch_intent(intent_name, INTENT_SLOTS[intent_name])
+    turn.session_attributes.pop('IntentElicit_retries', None)
+    return intent_name
@@ -0,0 +1,163 @@
+
+import logging
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import aws_clients
+import address_helpers
+import deadline
+import geocoder
+import rate_limit
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Batch worker of the pending verification queue (see deferred_verification): each
+# message is geocoded with the same query variants getAddress would have searched, on
+# a thread pool, and the result is merged into the address table with its verification
+# status; the unverified item written by getAddress for it, if any, is removed. Messages whose Location search fails are reported back to SQS as batch item
+# failures and retried later; they move to the dead letter queue after maxReceiveCount.
+# The batch stops at the Lambda remaining time less VERIFY_RESERVE_MS: no search is
+# started, nor rate limiter wait extended, nor table write made, past what the time left
+# allows, and the messages not finished by then are reported as failures instead of
+# timing out the batch.
+ADDRESS_TABLE = os.environ.get('ADDRESS_TABLE', None)
+WORKER_THREADS = int(os.environ.get('VERIFY_WORKER_THREADS', '8'))
+READ_TIMEOUT = float(os.environ.get('VERIFY_READ_TIMEOUT', '5'))
+WRITE_TIMEOUT = float(os.environ.get('VERIFY_WRITE_TIMEOUT', '1'))
+RESERVE_MS = int(os.environ.get('VERIFY_RESERVE_MS', '1000'))
+
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+
+
+def queries_for(pending):
+    # the query variants of getAddress, from the values it collected before deferring
+    parsed_street_address = pending['streetAddress']
+    spelled_street_name = pending.get('spelledStreetName', None)
+    street_name = pending.get('streetName', None)
+    street_address_number = pending.get('streetAddressNumber', None)
+
+    street_address = parsed_street_address
+    if spelled_street_name is not None:
+        street_address = spelled_street_name + ' ' + street_address
+    elif street_name is not None:
+        street_address = street_name + ' ' + street_address
+
+    if street_address_number is not None:
+        match = re.search("^([^0-9]*)([0-9]+)([^0-9]*)(.*)$", street_address)
+        if match is not None:
+            parsed_address = match.groups()
+            street_address = parsed_address[0] + ' ' + street_address_number + ' ' + parsed_address[2] + ' ' + parsed_address[3]
+        else:
+            street_address = street_address_number + ' ' + street_address
+
+    queries = address_helpers.query_variants(street_address, parsed_street_address, parsed_street_address, spelled_street_name, street_name)
+
+    query_suffix = ' ' + pending['zipCode']
+    if pending.get('city', None) and pending.get('state', None):
+        query_suffix = ' ' + pending['city'] + ' ' + pending['state'] + query_suffix
+    return [(query + query_suffix).replace('.', '') for query in queries]
+
+
+def time_left(stop_at, needed):
+    # seconds left before stop_at, once a call that may take needed seconds is made
+    left = stop_at - time.monotonic() - needed
+    if left < 0:
+        raise deadline.DeadlineExceeded('{:.0f} ms left in the batch'.format((left + needed) * 1000))
+    return left
+
+
+def call_time(read_timeout):
+    # a call may take the connect timeout plus the read timeout
+    return read_timeout + min(aws_clients.CONNECT_TIMEOUT, read_timeout)
+
+
+def verify(pending, stop_at):
+    # the address table item of a pending address: the best Location match, or the
+    # address as said marked not_found; the searches and the table writes must end by stop_at
+    zip_code = pending['zipCode']
+    queries = queries_for(pending)
+    location = aws_clients.client('location', READ_TIMEOUT)
+    needed = call_time(READ_TIMEOUT) + 2 * call_time(WRITE_TIMEOUT)
+
+    best = None
+    for query in queries:
+        # batch priority: waits, and leaves the reserved share of the quota to callers
+        geocoder.limiter.acquire(rate_limit.BATCH, max_wait=min(rate_limit.BATCH_MAX_WAIT, time_left(stop_at, needed)))
+        time_left(stop_at, needed)
+        candidate = geocoder.select_candidate(geocoder.search(query, zip_code, location), zip_code, [])
+        if candidate is not None and (best is None or candidate['relevance'] > best['relevance']):
+            best = candidate
+
+    if best is None:
+        item = {
+            'address': queries[0],
+            'city': pending.get('city', None),
+            'state': pending.get('state', None),
+            'postalCode': zip_code,
+            'verification': 'not_found'
+        }
+    else:
+        item = {
+            'address': best['resolvedAddress'],
+            'city': best['city'],
+            'state': best['stateProvince'],
+            'postalCode': best['postalCode'],
+            'verification': 'verified'
+        }
+    item['inputAddress'] = queries[0]
+    item['reason'] = pending.get('reason', None)
+    return item
+
+
+def process(body, stop_at):
+    # every write is checked against stop_at too: a message reported as failed when the
+    # batch stops never writes after the handler returned (the container may be thawed
+    # later, while SQS delivers the message again)
+    pending = json.loads(body)
+    item = verify(pending, stop_at)
+    unverified_address = pending.get('unverifiedAddress', None)
+    stale = unverified_address is not None and unverified_address != item['address']
+    dynamodb = aws_clients.client('dynamodb', WRITE_TIMEOUT)
+    time_left(stop_at, (1 + stale) * call_time(WRITE_TIMEOUT))
+    dynamodb.put_item(
+        TableName=ADDRESS_TABLE,
+        Item={field: {'S': str(value)} for field, value in item.items() if value is not None}
+    )
+    if stale:
+        time_left(stop_at, call_time(WRITE_TIMEOUT))
+        dynamodb.delete_item(
+            TableName=ADDRESS_TABLE,
+            Key={'address': {'S': unverified_address}},
+            ConditionExpression='verification = :pending',
+            ExpressionAttributeValues={':pending': {'S': 'pending'}}
+        )
+    logger.info('<<verify_addresses>> {} -> {} ({})'.format(item['inputAddress'], item['address'], item['verification']))
+    return item
+
+
+def handler(event, context):
+    records = event.get('Records', [])
+    stop_at = time.monotonic() + (context.get_remaining_time_in_millis() - RESERVE_MS) / 1000.0
+    futures = [(record['messageId'], executor.submit(process, record['body'], stop_at)) for record in records]
+    wait([future for messageId, future in futures], timeout=max(0, stop_at - time.monotonic()))
+
+    failures = []
+    for messageId, future in futures:
+        if not future.done():
+            # not started (cancelled) or still running: SQS delivers it again
+            started = not future.cancel()
+            logger.warning('<<verify_addresses>> message {} {} at the end of the batch'.format(messageId, 'still running' if started else 'not started'))
+            failures.append({'itemIdentifier': messageId})
+            continue
+        try:
+            future.result()
+        except Exception as error:
+            logger.warning('<<verify_addresses>> message {} failed: {}'.format(messageId, error))
+            failures.append({'itemIdentifier': messageId})
+
+    logger.info('<<verify_addresses>> verified {} of {} pending addresses'.format(len(records) - len(failures), len(records)))
+    rate_limit.emit_metrics()
+    return {'batchItemFailures': failures}
@@ -0,0 +1,130 @@
+
+import logging
+import mmap
+import os
+import struct
+import sys
+import csv
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Optional ZIP code reference table used to reject nonexistent zip codes before the
+# StreetAddress turn, pre-fill city/state and bias the Location query. The file is
+# memory-mapped on first use and shared by all warm invocations of the container.
+#
+# File layout (little endian):
+#   header:  MAGIC, version (u16), record count (u32)
+#   slots:   100000 u32 entries indexed by the numeric zip code; 0 = no such zip,
+#            otherwise record number + 1
+#   records: record count entries of (latitude (f32), longitude (f32), state (2s),
+#            city offset (u32), city length (u16))
+#   cities:  utf-8 city names referenced by the records
+ZIP_TABLE_FILE = os.environ.get('ZIP_TABLE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'zip_codes.bin'))
+
+MAGIC = b'ZIPT'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+SLOT = struct.Struct('<I')
+RECORD = struct.Struct('<ff2sIH')
+SLOT_COUNT = 100000
+
+SLOTS_START = HEADER.size
+RECORDS_START = SLOTS_START + SLOT_COUNT * SLOT.size
+
+# bound methods avoid attribute lookups on the per-turn lookup path
+unpack_slot = SLOT.unpack_from
+unpack_record = RECORD.unpack_from
+
+_table = None   # (mmap, cities offset) once loaded; False if no table is deployed
+
+
+def _load():
+    global _table
+    if _table is None:
+        try:
+            with open(ZIP_TABLE_FILE, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                logger.warning('<<zip_codes>> unsupported zip code table {}'.format(ZIP_TABLE_FILE))
+                _table = False
+            else:
+                _table = (data, RECORDS_START + count * RECORD.size)
+                logger.info('<<zip_codes>> loaded {} zip codes from {}'.format(count, ZIP_TABLE_FILE))
+        except (OSError, ValueError, struct.error) as error:
+            logger.info('<<zip_codes>> no zip code table available: {}'.format(error))
+            _table = False
+    return _table
+
+
+def is_available():
+    return bool(_load())
+
+
+def is_valid(zip_code):
+    # without a reference table every well-formed zip code is accepted
+    table = _table if _table is not None else _load()
+    if not table:
+        return len(zip_code) == 5
+    if len(zip_code) != 5 or not zip_code.isdigit():
+        return False
+    return unpack_slot(table[0], SLOTS_START + int(zip_code) * SLOT.size)[0] != 0
+
+
+def lookup(zip_code):
+    # returns (city, state, latitude, longitude), or None for an unknown zip code
+    table = _table if _table is not None else _load()
+    if not table or len(zip_code) != 5 or not zip_code.isdigit():
+        return None
+
+    data, cities_start = table
+    slot = unpack_slot(data, SLOTS_START + int(zip_code) * SLOT.size)[0]
+    if slot == 0:
+        return None
+
+    latitude, longitude, state, city_offset, city_length = unpack_record(data, RECORDS_START + (slot - 1) * RECORD.size)
+    city_offset += cities_start
+    return (data[city_offset:city_offset + city_length].decode('utf-8'), state.decode('ascii'), latitude, longitude)
+
+
+def build(source_file, destination_file):
+    # source is a CSV file with zip,city,state,latitude,longitude columns (header row optional)
+    entries = {}
+    with open(source_file, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 5 or not row[0].strip().isdigit():
+                continue
+            zip_code = row[0].strip().zfill(5)
+            entries[zip_code] = (row[1].strip().title(), row[2].strip().upper()[:2], float(row[3]), float(row[4]))
+
+    slots = [0] * SLOT_COUNT
+    records = []
+    cities = {}
+    city_blob = []
+    city_blob_size = 0
+    for number, zip_code in enumerate(sorted(entries)):
+        city, state, latitude, longitude = entries[zip_code]
+        if city not in cities:
+            encoded = city.encode('utf-8')
+            cities[city] = (city_blob_size, len(encoded))
+            city_blob.append(encoded)
+            city_blob_size += len(encoded)
+        city_offset, city_length = cities[city]
+        slots[int(zip_code)] = number + 1
+        records.append(RECORD.pack(latitude, longitude, state.encode('ascii'), city_offset, city_length))
+
+    with open(destination_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        f.write(struct.pack('<{}I'.format(SLOT_COUNT), *slots))
+        f.write(b''.join(records))
+        f.write(b''.join(city_blob))
+
+    return len(records)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python zip_codes.py <zip_codes.csv> <zip_codes.bin>')
+        sys.exit(1)
+    print('wrote {} zip codes to {}'.format(build(sys.argv[1], sys.argv[2]), sys.argv[2]))
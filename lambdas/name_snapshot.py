@@ -0,0 +1,108 @@
+
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Optional read-only snapshot of the name table, memory-mapped at cold start so small
+# tables are served without a DynamoDB call. Built by tools/load_names.py; names that
+# are not in the snapshot are still looked up in the table.
+#
+# File layout (little endian):
+#   header:     MAGIC, version (u16), name count (u32)
+#   index:      name count records of (name offset (u32), name length (u16),
+#               pseudonyms offset (u32), pseudonyms length (u32)), sorted by utf-8 name
+#   strings:    utf-8 names, and newline separated utf-8 pseudonyms per name
+NAME_SNAPSHOT_FILE = os.environ.get('NAME_SNAPSHOT_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'names.bin'))
+
+MAGIC = b'NAMS'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+INDEX_RECORD = struct.Struct('<IHII')
+
+unpack_record = INDEX_RECORD.unpack_from
+
+_snapshot = None   # (mmap, name count, strings offset) once loaded; False if no snapshot is deployed
+
+
+def _load():
+    global _snapshot
+    if _snapshot is None:
+        try:
+            with open(NAME_SNAPSHOT_FILE, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                logger.warning('<<name_snapshot>> unsupported name snapshot {}'.format(NAME_SNAPSHOT_FILE))
+                _snapshot = False
+            else:
+                _snapshot = (data, count, HEADER.size + count * INDEX_RECORD.size)
+                logger.info('<<name_snapshot>> loaded {} names from {}'.format(count, NAME_SNAPSHOT_FILE))
+        except (OSError, ValueError, struct.error) as error:
+            logger.info('<<name_snapshot>> no name snapshot available: {}'.format(error))
+            _snapshot = False
+    return _snapshot
+
+
+def is_available():
+    return bool(_load())
+
+
+def lookup(name):
+    # returns the pseudonym list of name, or None if the name is not in the snapshot
+    snapshot = _snapshot if _snapshot is not None else _load()
+    if not snapshot:
+        return None
+
+    data, count, strings_start = snapshot
+    key = name.encode('utf-8')
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        name_offset, name_length, pseudonyms_offset, pseudonyms_length = unpack_record(data, HEADER.size + middle * INDEX_RECORD.size)
+        name_offset += strings_start
+        candidate = data[name_offset:name_offset + name_length]
+        if candidate < key:
+            low = middle + 1
+        elif candidate > key:
+            high = middle
+        else:
+            pseudonyms_offset += strings_start
+            return data[pseudonyms_offset:pseudonyms_offset + pseudonyms_length].decode('utf-8').split('\n')
+    return None
+
+
+def write(records, destination_file):
+    # records are (name, pseudonym list) pairs sorted by utf-8 name, without duplicate
+    # names; strings are spooled to a temporary file so only the index is kept in memory
+    index = []
+    strings_size = 0
+    previous = None
+    with tempfile.TemporaryFile() as strings:
+        for name, pseudonyms in records:
+            encoded_name = name.encode('utf-8')
+            if previous is not None and encoded_name <= previous:
+                raise ValueError('names are not sorted and unique at {!r}'.format(name))
+            previous = encoded_name
+            encoded_pseudonyms = '\n'.join(pseudonyms).encode('utf-8')
+
+            index.append(INDEX_RECORD.pack(strings_size, len(encoded_name), strings_size + len(encoded_name), len(encoded_pseudonyms)))
+            strings.write(encoded_name)
+            strings.write(encoded_pseudonyms)
+            strings_size += len(encoded_name) + len(encoded_pseudonyms)
+
+        strings.seek(0)
+        with open(destination_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(index)))
+            f.write(b''.join(index))
+            while True:
+                chunk = strings.read(1 << 20)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+    return len(index)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Tail latency of the getInfo handler against slow stand-ins: every AWS call takes
+# latency_ms, and a tail_rate share of them takes tail_ms. With the deadline budget no
+# invocation may take longer than the simulated Lambda/code hook timeout; the calls
+# that run out of time are answered with a reprompt instead.
+#
+#   python tools/bench_deadline.py --latency-ms 80 --tail-ms 8000 --tail-rate 0.05 --timeout-ms 3000
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import standins
+
+REPROMPTS = ('in time', 'longer than expected')
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='getInfo tail latency against slow stand-ins')
+    parser.add_argument('events', nargs='*', help='event files (default: tools/events/*.json)')
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--tail-ms', type=float, default=8000)
+    parser.add_argument('--tail-rate', type=float, default=0.05)
+    parser.add_argument('--timeout-ms', type=int, default=3000, help='simulated Lambda timeout')
+    parser.add_argument('--rounds', type=int, default=20)
+    arguments = parser.parse_args()
+
+    standins.install(arguments.latency_ms, arguments.tail_ms, arguments.tail_rate)
+    import replay
+
+    events = replay.load_events(arguments.events)
+    durations = []
+    reprompts = 0
+    for _ in range(arguments.rounds):
+        for event, response, seconds in replay.replay(events, arguments.timeout_ms):
+            durations.append(seconds * 1000)
+            messages = ' '.join(message['content'] for message in (response or {}).get('messages', None) or [])
+            if any(reprompt in messages for reprompt in REPROMPTS):
+                reprompts += 1
+
+    over = sum(1 for duration in durations if duration > arguments.timeout_ms)
+    print('{} invocations, {} ms timeout: p50 {:.0f} ms  p99 {:.0f} ms  max {:.0f} ms'.format(
+        len(durations), arguments.timeout_ms, percentile(durations, 0.5), percentile(durations, 0.99), max(durations)))
+    print('reprompted after running out of time: {}  over the timeout: {}'.format(reprompts, over))
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Checks that email_helpers.transform_email_for_speech renders the same SSML as the
+# original replace-based implementation, and compares their speed.
+
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas', 'common'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas', 'info'))
+
+import email_helpers
+
+ITERATIONS = 20000
+
+
+def legacy_transform_email_for_speech(email_address):
+    match = re.search("^([^@]+)(@)([^@]+)$", email_address)
+    if match is not None:
+        parsed_address = match.groups()
+        if len(parsed_address) == 3:
+            email_address = '<prosody rate="slow"> '
+            email_address += ', '.join(parsed_address[0]) + ', '
+            email_address += '</prosody> at; ' 
+            email_address += parsed_address[2].replace('.', ' dot ')
+    
+    email_address = ' ' + email_address.replace('.,', 'dot;')
+    for letter in email_helpers.letter_pronounciations:
+        email_address = email_address.replace(
+            ' ' + letter + ',', 
+            ' ' + email_helpers.letter_pronounciations[letter] + ','
+        )
+
+    return email_address
+
+
+def sample_emails(count):
+    random.seed(11)
+    alphabet = string.ascii_lowercase + string.digits + '._-+' + 'BCD ,'
+    emails = ['bob.smith@gmail.com', 'dan89@example.co.uk', 'no-at-sign.example.com', 'a@b@c.com', 'x@y,z.com', ' b, c,@d.com']
+    for _ in range(count):
+        local_part = ''.join(random.choice(alphabet) for _ in range(random.randint(1, 20)))
+        domain = ''.join(random.choice(string.ascii_lowercase + '.') for _ in range(random.randint(3, 15)))
+        emails.append(local_part + '@' + domain)
+    return emails
+
+
+def main():
+    emails = sample_emails(5000)
+    mismatches = [email for email in emails if email_helpers.transform_email_for_speech(email) != legacy_transform_email_for_speech(email)]
+    print('identical output: {}/{}'.format(len(emails) - len(mismatches), len(emails)))
+    for email in mismatches[:5]:
+        print('  mismatch: {!r}'.format(email))
+
+    uncached = email_helpers.transform_email_for_speech.__wrapped__
+    timings = [
+        ('legacy', lambda: legacy_transform_email_for_speech('bob.smith.dan89@gmail.com')),
+        ('uncached', lambda: uncached('bob.smith.dan89@gmail.com')),
+        ('cached', lambda: email_helpers.transform_email_for_speech('bob.smith.dan89@gmail.com')),
+    ]
+    for name, function in timings:
+        best = min(timeit.Timer(function).repeat(repeat=5, number=ITERATIONS))
+        print('{:10s} {:8.3f} us/call'.format(name, best / ITERATIONS * 1e6))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
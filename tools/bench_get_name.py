@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Compares the getName handler with the previous implementation (a new DynamoDB
+# resource per invocation, full item, random.choice). Both use real boto3 clients
+# whose get_item calls are answered locally by botocore's Stubber, optionally after a
+# simulated service latency, so client creation, parameter validation and response
+# parsing are measured but no request is sent.
+#
+#   python tools/bench_get_name.py --latency-ms 5
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import boto3
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas', 'common'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('NAME_TABLE', 'nameTable')
+
+NAMES = 2000
+PSEUDONYMS = 6
+
+
+def item_for(name, pseudonyms, projected):
+    item = {'pseudonym': {'L': [{'S': pseudonym} for pseudonym in pseudonyms]}}
+    if not projected:
+        item['name'] = {'S': name}
+    return {'Item': item}
+
+
+def simulate_latency(client, latency_ms):
+    if latency_ms:
+        client.meta.events.register('before-parameter-build.dynamodb.GetItem', lambda **kwargs: time.sleep(latency_ms / 1000.0))
+
+
+def legacy_handler(event, context, response, latency_ms):
+    # the previous getName.handler, with the stubbed response queued on the new resource
+    name = event["Details"]["Parameters"]["nameInput"]
+    dynamodb = boto3.resource('dynamodb', region_name="us-east-1")
+    stubber = Stubber(dynamodb.meta.client)
+    stubber.add_response('get_item', response)
+    stubber.activate()
+    simulate_latency(dynamodb.meta.client, latency_ms)
+    table = dynamodb.Table(os.environ["NAME_TABLE"])
+
+    response = table.get_item(
+        Key={
+            'name': name
+        }
+    )
+
+    pseudonymList = response['Item']['pseudonym']
+    if len(pseudonymList) == 1:
+        pseudonym = pseudonymList[0]
+    else:
+        pseudonym = random.choice(pseudonymList)
+
+    return {
+        "name": pseudonym
+    }
+
+
+def event_for(name, contact_number):
+    return {
+        'Name': 'ContactFlowEvent',
+        'Details': {
+            'ContactData': {'ContactId': 'contact-{}'.format(contact_number)},
+            'Parameters': {'nameInput': name}
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='getName latency against a stubbed DynamoDB client')
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated DynamoDB latency')
+    parser.add_argument('--invocations', type=int, default=2000)
+    arguments = parser.parse_args()
+
+    random.seed(7)
+    names = {
+        'name{}'.format(number): ['Pseudonym {}-{}'.format(number, index) for index in range(PSEUDONYMS)]
+        for number in range(NAMES)
+    }
+    events = [event_for(random.choice(list(names)), number) for number in range(arguments.invocations)]
+
+    sample_name = events[0]['Details']['Parameters']['nameInput']
+    legacy_bytes = len(json.dumps(item_for(sample_name, names[sample_name], False)))
+    current_bytes = len(json.dumps(item_for(sample_name, names[sample_name], True)))
+
+    legacy_responses = [item_for(event['Details']['Parameters']['nameInput'], names[event['Details']['Parameters']['nameInput']], False) for event in events]
+    started = time.perf_counter()
+    for event, response in zip(events, legacy_responses):
+        legacy_handler(event, None, response, arguments.latency_ms)
+    legacy = (time.perf_counter() - started) / len(events)
+
+    import getName
+    stubber = Stubber(getName.dynamodb)
+    for event in events + events[-1:]:
+        name = event['Details']['Parameters']['nameInput']
+        stubber.add_response('get_item', item_for(name, names[name], True))
+    stubber.activate()
+    simulate_latency(getName.dynamodb, arguments.latency_ms)
+
+    started = time.perf_counter()
+    for event in events:
+        response = getName.handler(event, None)
+    current = (time.perf_counter() - started) / len(events)
+
+    repeat = getName.handler(events[-1], None)
+    print('legacy   {:8.1f} us/invocation  ({} bytes item)'.format(legacy * 1e6, legacy_bytes))
+    print('current  {:8.1f} us/invocation  ({} bytes item, {} bytes response, same pseudonym on a repeated contact: {})'.format(
+        current * 1e6, current_bytes, len(json.dumps(response)), repeat == response))
+
+
+if __name__ == '__main__':
+    main()
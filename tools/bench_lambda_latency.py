@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Compares cold and warm latency of the Lambdas per configuration.
+#
+# local: every cold sample is a fresh interpreter that imports the handler and replays
+#        the events once (import + first invocation); warm samples replay the same
+#        events again in an already initialized interpreter. Uses the replay harness.
+#
+#   python tools/bench_lambda_latency.py local --latency-ms 60
+#
+# deployed: invokes deployed functions (or aliases, e.g. getInfo:live) with
+#        LogType=Tail and reads Duration / Init Duration from the REPORT log line.
+#        Cold samples are forced by touching an environment variable of the function,
+#        which only affects the unqualified ($LATEST) function.
+#
+#   python tools/bench_lambda_latency.py deployed CallCenterStack-getInfo... CallCenterStack-getInfo...:live
+
+import argparse
+import base64
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COLD_SAMPLE = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {tools_dir!r})
+import standins
+standins.install({latency_ms!r})
+import replay
+replay.replay(replay.load_events({events!r}))
+print(json.dumps(time.perf_counter() - started))
+'''
+
+REPORT_FIELDS = re.compile(r'(Init Duration|Duration|Billed Duration|Max Memory Used): ([0-9.]+)')
+
+
+def summary(samples):
+    if not samples:
+        return 'n/a'
+    samples = sorted(samples)
+    p90 = samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+    return 'median {:8.1f} ms  p90 {:8.1f} ms  (n={})'.format(statistics.median(samples), p90, len(samples))
+
+
+def local(arguments):
+    sys.path.insert(0, TOOLS_DIR)
+    import standins
+    standins.install(arguments.latency_ms)
+    import replay
+
+    events = replay.load_events(arguments.events)
+    cold = []
+    for _ in range(arguments.cold):
+        code = COLD_SAMPLE.format(tools_dir=TOOLS_DIR, latency_ms=arguments.latency_ms, events=arguments.events)
+        output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+        cold.append(json.loads(output.strip().splitlines()[-1]) * 1000)
+
+    replay.replay(events)
+    warm = []
+    for _ in range(arguments.warm):
+        warm.append(sum(seconds for event, response, seconds in replay.replay(events)) * 1000)
+
+    print('local, {} events, {} ms simulated AWS latency'.format(len(events), arguments.latency_ms))
+    print('  cold  ' + summary(cold))
+    print('  warm  ' + summary(warm))
+
+
+def invoke(client, function, payload):
+    name, _, qualifier = function.partition(':')
+    parameters = {'FunctionName': name, 'Payload': payload, 'LogType': 'Tail'}
+    if qualifier:
+        parameters['Qualifier'] = qualifier
+    started = time.perf_counter()
+    response = client.invoke(**parameters)
+    round_trip = (time.perf_counter() - started) * 1000
+    response['Payload'].read()
+    log = base64.b64decode(response.get('LogResult', '')).decode('utf-8', 'replace')
+    report = dict((field, float(value)) for field, value in REPORT_FIELDS.findall(log))
+    return round_trip, report
+
+
+def force_cold_start(client, function):
+    configuration = client.get_function_configuration(FunctionName=function)
+    variables = configuration.get('Environment', {}).get('Variables', {})
+    variables['BENCH_COLD_START'] = str(time.time())
+    client.update_function_configuration(FunctionName=function, Environment={'Variables': variables})
+    client.get_waiter('function_updated').wait(FunctionName=function)
+
+
+def deployed(arguments):
+    import boto3
+    client = boto3.client('lambda')
+
+    with open(arguments.payload) as f:
+        payload = f.read()
+    if isinstance(json.loads(payload), list):
+        payload = json.dumps(json.loads(payload)[0])
+
+    for function in arguments.functions:
+        configuration = client.get_function_configuration(FunctionName=function.partition(':')[0])
+        print('{}  ({}, {} MB)'.format(function, configuration.get('Architectures', ['x86_64'])[0], configuration['MemorySize']))
+
+        init, cold = [], []
+        if ':' not in function:
+            for _ in range(arguments.cold):
+                force_cold_start(client, function)
+                round_trip, report = invoke(client, function, payload)
+                init.append(report.get('Init Duration', 0))
+                cold.append(round_trip)
+        warm = []
+        for _ in range(arguments.warm):
+            warm.append(invoke(client, function, payload)[0])
+
+        print('  init  ' + summary(init))
+        print('  cold  ' + summary(cold))
+        print('  warm  ' + summary(warm))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold/warm latency of the Lambdas per configuration')
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    local_mode = modes.add_parser('local', help='replay events locally against stand-in AWS clients')
+    local_mode.add_argument('events', nargs='*', help='event files (default: tools/events/*.json)')
+    local_mode.add_argument('--latency-ms', type=float, default=0, help='simulated AWS call latency')
+    local_mode.add_argument('--cold', type=int, default=5, help='cold samples')
+    local_mode.add_argument('--warm', type=int, default=50, help='warm samples')
+
+    deployed_mode = modes.add_parser('deployed', help='invoke deployed functions or aliases')
+    deployed_mode.add_argument('functions', nargs='+', help='function name or name:alias')
+    deployed_mode.add_argument('--payload', default=os.path.join(TOOLS_DIR, 'events', 'request_brochure.json'), help='event file (first event of a list is used)')
+    deployed_mode.add_argument('--cold', type=int, default=3, help='cold samples (unqualified functions only)')
+    deployed_mode.add_argument('--warm', type=int, default=20, help='warm samples')
+
+    arguments = parser.parse_args()
+    local(arguments) if arguments.mode == 'local' else deployed(arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Address search latency against a Location stand-in with a slow tail, with and without
+# hedged requests, then a Location outage: how many searches still reach the failing
+# service before the circuit breaker opens, and how it recovers after the cooldown.
+#
+#   python tools/bench_location.py --latency-ms 80 --tail-ms 1500 --tail-rate 0.05
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('METRICS_ENABLED', '0')
+os.environ.setdefault('LOCATION_BREAKER_COOLDOWN_SECONDS', '1')
+
+import standins
+
+QUERIES = ['123 Main Street Anytown WA 98101', '123 Main St Anytown WA 98101', '123 main street Anytown WA 98101']
+
+
+class LocalContext:
+    def get_remaining_time_in_millis(self):
+        return 3000
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(geocoder, deadline, searches):
+    durations = []
+    for _ in range(searches):
+        deadline.start(LocalContext())
+        started = time.perf_counter()
+        try:
+            geocoder.search_best(QUERIES, '98101', [])
+        except Exception:
+            pass
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Location search latency with hedging and the circuit breaker')
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--tail-ms', type=float, default=1500)
+    parser.add_argument('--tail-rate', type=float, default=0.05)
+    parser.add_argument('--searches', type=int, default=200)
+    arguments = parser.parse_args()
+
+    location = standins.install(arguments.latency_ms, arguments.tail_ms, arguments.tail_rate)['location']
+    import deadline
+    import geocoder
+    import resilience
+
+    for hedging in (False, True):
+        geocoder.HEDGING = hedging
+        geocoder.latencies = resilience.LatencyTracker()
+        del location.calls[:]
+        durations = run(geocoder, deadline, arguments.searches)
+        print('hedging {:3}  p50 {:5.0f} ms  p99 {:5.0f} ms  max {:5.0f} ms  {:.2f} calls/search'.format(
+            'on' if hedging else 'off', percentile(durations, 0.5), percentile(durations, 0.99), max(durations),
+            len(location.calls) / float(arguments.searches)))
+
+    # outage: every call fails until the service is restored
+    def failing_call(name, parameters):
+        location.calls.append((name, parameters))
+        raise ConnectionError('Location unavailable')
+
+    del location.calls[:]
+    location._call = failing_call
+    durations = run(geocoder, deadline, arguments.searches)
+    print('outage       {} searches, {} reached Location, breaker {}, p50 {:.1f} ms'.format(
+        arguments.searches, len(location.calls), geocoder.breaker.state, percentile(durations, 0.5)))
+
+    del location._call
+    time.sleep(geocoder.breaker.cooldown)
+    run(geocoder, deadline, 1)
+    print('recovered    breaker {} after a {:.0f} s cooldown'.format(geocoder.breaker.state, geocoder.breaker.cooldown))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Campaign peak against a Location stand-in with an account quota: concurrent callers
+# search addresses while the verification worker geocodes its backlog. Without the
+# rate limiter the calls over the quota fail with ThrottlingException; with it the
+# optional variants and the batch work give way to the preferred in-turn searches.
+#
+#   python tools/bench_rate_limit.py --quota 20 --rate 18 --callers 4 --seconds 5
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import standins
+
+from botocore.exceptions import ClientError
+
+QUERIES = ['123 Main Street Anytown WA 98101', '123 Main St Anytown WA 98101', '123 main street Anytown WA 98101']
+
+
+class QuotaLocation(standins.StandInLocation):
+    # answers at most quota calls per second, and throttles the rest
+    def __init__(self, quota, latency_ms):
+        super().__init__(latency_ms)
+        self.quota = quota
+        self.lock = threading.Lock()
+        self.window = None
+        self.used = 0
+        self.throttled = 0
+
+    def search_place_index_for_text(self, **parameters):
+        with self.lock:
+            second = int(time.time())
+            if second != self.window:
+                self.window, self.used = second, 0
+            self.used += 1
+            if self.used > self.quota:
+                self.throttled += 1
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'SearchPlaceIndexForText')
+        return super().search_place_index_for_text(**parameters)
+
+    def bounded(self, read_timeout):
+        return self
+
+
+class Context:
+    def get_remaining_time_in_millis(self):
+        return 3000
+
+
+def run(arguments, limited):
+    import aws_clients
+    import deadline
+    import geocoder
+    import rate_limit
+    import resilience
+
+    location = QuotaLocation(arguments.quota, arguments.latency_ms)
+    aws_clients.client = lambda service_name, read_timeout=None: location
+    geocoder.limiter = rate_limit.RateLimiter('location', arguments.rate if limited else 0, arguments.rate)
+    geocoder.breaker = resilience.CircuitBreaker('location', min_calls=10 ** 9)
+    geocoder.HEDGING = False
+
+    results = {'searches': 0, 'failed turns': 0, 'batch calls': 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + arguments.seconds
+
+    def caller():
+        while time.monotonic() < stop_at:
+            deadline.start(Context())
+            try:
+                geocoder.search_best(QUERIES, '98101', [])
+                outcome = 'searches'
+            except Exception:
+                outcome = 'failed turns'
+            with lock:
+                results[outcome] += 1
+            time.sleep(arguments.think_ms / 1000.0)
+
+    def worker():
+        while time.monotonic() < stop_at:
+            try:
+                geocoder.limiter.acquire(rate_limit.BATCH, max_wait=max(0, stop_at - time.monotonic()))
+                geocoder.search(QUERIES[0], '98101', location)
+            except Exception:
+                # the message goes back to the queue, and is retried later
+                time.sleep(0.1)
+                continue
+            with lock:
+                results['batch calls'] += 1
+
+    threads = [threading.Thread(target=caller) for _ in range(arguments.callers)] + [threading.Thread(target=worker)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counts = geocoder.limiter.take_counts()
+    print('limiter {:3}  searches {:5d}  failed turns {:4d}  batch calls {:4d}  ThrottlingException {:5d}  queued {:4d}  refused {:4d}'.format(
+        'on' if limited else 'off', results['searches'], results['failed turns'], results['batch calls'],
+        location.throttled, counts['Queued'], counts['Throttled']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Location calls at an account quota, with and without the rate limiter')
+    parser.add_argument('--quota', type=int, default=20, help='Location calls per second before throttling')
+    parser.add_argument('--rate', type=float, default=18, help='token bucket rate of the limiter')
+    parser.add_argument('--callers', type=int, default=4)
+    parser.add_argument('--think-ms', type=float, default=200, help='pause between a caller\'s searches')
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--seconds', type=float, default=5)
+    arguments = parser.parse_args()
+
+    standins.install()
+    for limited in (False, True):
+        run(arguments, limited)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Replays the Lex events with LEX_RESPONSE_MODE full and minimal, checks that both give
+# the same dialog (dialog action, messages, session attributes, intent name, states and
+# interpreted slot values), and compares the response size and serialization time.
+#
+#   python tools/bench_response_mode.py
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import standins
+
+SERIALIZATIONS = 2000
+
+
+def dialog(response):
+    # what Lex acts on
+    response = response or {}
+    sessionState = response.get('sessionState', {})
+    intent = sessionState.get('intent', None) or {}
+    slots = {
+        name: (slot or {}).get('value', {}).get('interpretedValue', None) if slot else None
+        for name, slot in (intent.get('slots', None) or {}).items()
+    }
+    intent_state = (intent.get('name', None), intent.get('state', None), intent.get('confirmationState', None), slots)
+    if sessionState.get('dialogAction', {}).get('type', None) == 'ElicitIntent':
+        intent_state = None
+    return json.dumps([sessionState.get('dialogAction', None), response.get('messages', None), sessionState.get('sessionAttributes', None), intent_state], sort_keys=True)
+
+
+def reset():
+    # a fresh container: new stand-ins and empty caches, so both modes replay the same state
+    standins.install()
+    import caller_profiles
+    import idempotency
+    caller_profiles._cache.clear()
+    idempotency._completed.clear()
+
+
+def run(events, replay, helpers, mode):
+    reset()
+    helpers.RESPONSE_MODE = mode
+    dialogs = []
+    sizes = []
+    durations = []
+    for event, response, seconds in replay.replay(copy.deepcopy(events), 3000):
+        dialogs.append(dialog(response))
+        if response is None:
+            continue
+        sizes.append(len(json.dumps(response)))
+        started = time.perf_counter()
+        for _ in range(SERIALIZATIONS):
+            json.dumps(response)
+        durations.append((time.perf_counter() - started) / SERIALIZATIONS * 1e6)
+    print('{:8} {:4d} responses  mean {:6.0f} B  max {:6d} B  json.dumps {:6.1f} us'.format(
+        mode, len(sizes), statistics.mean(sizes), max(sizes), statistics.mean(durations)))
+    return dialogs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='full versus minimal Lex responses')
+    parser.add_argument('events', nargs='*', help='event files (default: tools/events/*.json)')
+    arguments = parser.parse_args()
+
+    standins.install()
+    import replay
+    import helpers
+
+    events = replay.load_events(arguments.events)
+    full = run(events, replay, helpers, 'full')
+    minimal = run(events, replay, helpers, 'minimal')
+    different = [index for index, (a, b) in enumerate(zip(full, minimal)) if a != b]
+    print('dialogs differ on {} of {} turns'.format(len(different), len(full)))
+    for index in different:
+        print('  turn {}:\n    full    {}\n    minimal {}'.format(index, full[index], minimal[index]))
+    sys.exit(1 if different else 0)
+
+
+if __name__ == '__main__':
+    main()
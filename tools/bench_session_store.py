@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Session attribute payload and per-turn latency of the getInfo handler with the
+# attributes shipped through Lex (current scheme) and with the server side session
+# store, against stand-ins with latency_ms per AWS call. Each conversation is chained:
+# a turn is sent with the session attributes of the previous response, as Lex does.
+# "store, other container" empties the write-through cache before every turn, so
+# every turn reads its session item.
+#
+#   python tools/bench_session_store.py --latency-ms 5
+
+import argparse
+import copy
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import standins
+
+UNMATCHED_ADDRESS = {'originalValue': 'terry avenue north', 'interpretedValue': 'terry avenue north', 'resolvedValues': []}
+
+
+def conversations(replay):
+    # the recorded conversations, and a long one that goes down the address retry ladder
+    recorded = [replay.load_events([path]) for path in sorted(glob.glob(os.path.join(replay.EVENTS_DIR, '*.json')))]
+    brochure = replay.load_events([os.path.join(replay.EVENTS_DIR, 'request_brochure.json')])
+    unmatched = copy.deepcopy(brochure[2])
+    unmatched['sessionState']['intent']['slots']['StreetAddress']['value'] = UNMATCHED_ADDRESS
+    return recorded + [brochure[:2] + [copy.deepcopy(unmatched) for _ in range(4)]]
+
+
+def size(attributes):
+    return len(json.dumps(attributes or {}, separators=(',', ':')))
+
+
+def run(conversation_list, replay, handler, session_store, mode, rounds):
+    session_store.enabled = mode != 'lex'
+    request_bytes = []
+    response_bytes = []
+    durations = []
+    for round_number in range(rounds):
+        for number, conversation in enumerate(conversation_list):
+            attributes = {}
+            session_id = 'bench-{}-{}-{}'.format(mode, round_number, number)
+            for event in conversation:
+                event = copy.deepcopy(event)
+                event['sessionId'] = session_id
+                event['sessionState']['sessionAttributes'] = dict(event['sessionState'].get('sessionAttributes', None) or {}, **attributes)
+                request_bytes.append(size(event['sessionState']['sessionAttributes']))
+                if mode == 'store, other container':
+                    session_store._cache.clear()
+
+                started = time.perf_counter()
+                response = handler.handler(event, replay.LocalContext(3000))
+                durations.append((time.perf_counter() - started) * 1000)
+
+                attributes = ((response or {}).get('sessionState', {}).get('sessionAttributes', None)) or {}
+                response_bytes.append(size(attributes))
+    print('{:24} request {:6.0f} B  response {:6.0f} B  (max {:5d} B)  turn p50 {:6.2f} ms  mean {:6.2f} ms'.format(
+        mode, statistics.mean(request_bytes), statistics.mean(response_bytes), max(response_bytes),
+        statistics.median(durations), statistics.mean(durations)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='session attributes through Lex versus the server side session store')
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--rounds', type=int, default=20)
+    arguments = parser.parse_args()
+
+    os.environ.setdefault('SESSION_TABLE', 'sessionTable')
+    standins.install(arguments.latency_ms)
+    import replay
+    import handler
+    import session_store
+
+    conversation_list = conversations(replay)
+    for mode in ('lex', 'store', 'store, other container'):
+        run(conversation_list, replay, handler, session_store, mode, arguments.rounds)
+
+
+if __name__ == '__main__':
+    main()
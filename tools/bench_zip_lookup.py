@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Benchmarks zip_codes lookups against a synthetic table with the size of the
+# full US zip code list, or against a real table passed as the first argument.
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas', 'info'))
+
+import zip_codes
+
+ZIP_COUNT = 41000
+ITERATIONS = 200000
+
+
+def build_synthetic_table(directory):
+    random.seed(7)
+    source = os.path.join(directory, 'zip_codes.csv')
+    with open(source, 'w') as f:
+        f.write('zip,city,state,latitude,longitude\n')
+        for zip_code in random.sample(range(1000, 99999), ZIP_COUNT):
+            f.write('{:05d},City {},WA,{:.4f},{:.4f}\n'.format(zip_code, zip_code % 3000, random.uniform(25, 49), random.uniform(-124, -67)))
+    destination = os.path.join(directory, 'zip_codes.bin')
+    zip_codes.build(source, destination)
+    return destination
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        zip_codes.ZIP_TABLE_FILE = sys.argv[1] if len(sys.argv) > 1 else build_synthetic_table(directory)
+        zip_codes._table = None
+        print('table: {} ({} bytes)'.format(zip_codes.ZIP_TABLE_FILE, os.path.getsize(zip_codes.ZIP_TABLE_FILE)))
+
+        samples = ['{:05d}'.format(random.randrange(100000)) for _ in range(1024)]
+        hits = sum(1 for sample in samples if zip_codes.lookup(sample) is not None)
+        print('sample hit rate: {:.0%}'.format(hits / len(samples)))
+
+        for name in ['is_valid', 'lookup']:
+            function = getattr(zip_codes, name)
+            timer = timeit.Timer(lambda: [function(sample) for sample in samples])
+            best = min(timer.repeat(repeat=5, number=ITERATIONS // len(samples)))
+            print('{:10s} {:8.3f} us/lookup'.format(name, best / (ITERATIONS // len(samples) * len(samples)) * 1e6))
+
+        zip_codes._table[0].close()
+        zip_codes._table = None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Builds the per-function Lambda bundles and reports their size (files, unzipped and
+# zipped bytes) and handler import time, next to the unbundled source directory that
+# was shipped before.
+#
+#   python tools/bundle_report.py
+
+import io
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+from call_center import bundling
+
+IMPORT_SAMPLES = 5
+IMPORT_TIME = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def directory_size(directory):
+    files = 0
+    size = 0
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                files += 1
+                size += os.path.getsize(path)
+                z.write(path, os.path.relpath(path, directory))
+    return files, size, len(archive.getvalue())
+
+
+def import_time(directories, module):
+    # cumulative import time (ms) of the handler module in a fresh interpreter,
+    # from a read-only copy so no bytecode is written back, as on Lambda
+    samples = []
+    for _ in range(IMPORT_SAMPLES):
+        environment = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+        environment['PYTHONPATH'] = os.pathsep.join(directories + [path for path in [os.environ.get('PYTHONPATH', '')] if path])
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            cwd=directories[0], env=environment, capture_output=True, text=True
+        )
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match is not None and not match.group(2) and match.group(3) == module:
+                samples.append(int(match.group(1)) / 1000.0)
+    return statistics.median(samples) if samples else None
+
+
+def report(label, directory, module, layer_dirs):
+    files, size, zipped = directory_size(directory)
+    milliseconds = import_time([directory] + layer_dirs, module)
+    print('  {:8} {:4d} files {:9d} bytes {:9d} zipped   import {}'.format(
+        label, files, size, zipped, 'failed' if milliseconds is None else '{:.1f} ms'.format(milliseconds)))
+
+
+def main():
+    # compile for the local interpreter so the bytecode is used by the import timing
+    bundling.RUNTIME_VERSION = sys.version_info[:2]
+
+    with tempfile.TemporaryDirectory() as build_dir:
+        layer_sources = []
+        layer_bundles = []
+        for layer_id, (source_dir, modules) in bundling.LAYERS.items():
+            print(layer_id)
+            layer_sources.append(os.path.join(ROOT_DIR, source_dir))
+            layer_bundles.append(os.path.join(bundling.bundle_layer(layer_id, build_dir), 'python'))
+            for label, directory in (('source', layer_sources[-1]), ('bundle', layer_bundles[-1])):
+                files, size, zipped = directory_size(directory)
+                print('  {:8} {:4d} files {:9d} bytes {:9d} zipped'.format(label, files, size, zipped))
+
+        for function_id, (source_dir, entry_modules) in bundling.BUNDLES.items():
+            print(function_id)
+            source_dir = os.path.join(ROOT_DIR, source_dir)
+            unbundled = os.path.join(build_dir, function_id + '-source')
+            shutil.copytree(source_dir, unbundled, ignore=shutil.ignore_patterns('__pycache__'))
+            report('source', unbundled, entry_modules[0], layer_sources)
+            report('bundle', bundling.bundle(function_id, build_dir), entry_modules[0], layer_bundles)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Bulk loads name -> pseudonyms files into the name table, and optionally writes the
+# name snapshot that getName memory-maps (lambdas/data/names.bin).
+#
+# Input files are CSV rows of name,pseudonym[,pseudonym...] (a "name" header row is
+# skipped) or JSON lines of {"name": ..., "pseudonyms": [...]} ("pseudonym" may be a
+# string or a list). Rows of the same name are merged and duplicate pseudonyms dropped.
+# Rows are sorted in bounded chunks spilled to disk and merged, so memory use does not
+# grow with the input; the items are written by parallel BatchWriteItem workers.
+#
+#   python tools/load_names.py names.csv --table <nameTable> --snapshot lambdas/data/names.bin
+
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas'))
+
+import name_snapshot
+
+BATCH_SIZE = 25     # BatchWriteItem limit
+
+
+def read_rows(path):
+    # yields (name, pseudonym) pairs
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                pseudonyms = record.get('pseudonyms', record.get('pseudonym', []))
+                if isinstance(pseudonyms, str):
+                    pseudonyms = [pseudonyms]
+                for pseudonym in pseudonyms:
+                    yield record['name'], pseudonym
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].strip().lower() == 'name':
+                    continue
+                for pseudonym in row[1:]:
+                    yield row[0], pseudonym
+
+
+def clean(value):
+    # pseudonyms are stored newline separated in the snapshot
+    return ' '.join(value.split())
+
+
+def sorted_runs(paths, chunk_size, directory):
+    runs = []
+    rows = (
+        (clean(name).encode('utf-8'), clean(pseudonym))
+        for path in paths for name, pseudonym in read_rows(path)
+    )
+    while True:
+        chunk = sorted(set(row for row in itertools.islice(rows, chunk_size) if row[0] and row[1]))
+        if not chunk:
+            break
+        run = tempfile.TemporaryFile('w+', encoding='utf-8', dir=directory)
+        for name, pseudonym in chunk:
+            run.write(json.dumps([name.decode('utf-8'), pseudonym]) + '\n')
+        run.seek(0)
+        runs.append(run)
+    return runs
+
+
+def merged_records(runs):
+    # yields (name, sorted unique pseudonyms) in utf-8 name order
+    streams = [
+        ((name.encode('utf-8'), pseudonym) for name, pseudonym in map(json.loads, run))
+        for run in runs
+    ]
+    for name, rows in itertools.groupby(heapq.merge(*streams), key=lambda row: row[0]):
+        pseudonyms = []
+        for row in rows:
+            if not pseudonyms or pseudonyms[-1] != row[1]:
+                pseudonyms.append(row[1])
+        yield name.decode('utf-8'), pseudonyms
+
+
+class BatchWriter:
+    def __init__(self, client, table, workers, max_retries):
+        self.client = client
+        self.table = table
+        self.max_retries = max_retries
+        self.batches = queue.Queue(maxsize=workers * 2)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.batch = []
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, name, pseudonyms):
+        self.batch.append({'PutRequest': {'Item': {
+            'name': {'S': name},
+            'pseudonym': {'L': [{'S': pseudonym} for pseudonym in pseudonyms]}
+        }}})
+        if len(self.batch) == BATCH_SIZE:
+            self.batches.put(self.batch)
+            self.batch = []
+
+    def close(self):
+        if self.batch:
+            self.batches.put(self.batch)
+        for thread in self.threads:
+            self.batches.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def work(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            requests = batch
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self.client.batch_write_item(RequestItems={self.table: requests})
+                    unprocessed = response.get('UnprocessedItems', {}).get(self.table, [])
+                except self.client.exceptions.ProvisionedThroughputExceededException:
+                    unprocessed = requests
+                except Exception as error:
+                    print('batch of {} failed: {}'.format(len(requests), error), file=sys.stderr)
+                    break
+                with self.lock:
+                    self.written += len(requests) - len(unprocessed)
+                requests = unprocessed
+                if not requests:
+                    break
+                # exponential backoff with full jitter
+                time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** attempt)))
+            with self.lock:
+                self.failed += len(requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load name -> pseudonyms files')
+    parser.add_argument('files', nargs='+', help='CSV or JSON lines files')
+    parser.add_argument('--table', help='DynamoDB name table to write to')
+    parser.add_argument('--snapshot', help='name snapshot file to write')
+    parser.add_argument('--workers', type=int, default=8, help='parallel BatchWriteItem workers')
+    parser.add_argument('--max-retries', type=int, default=8, help='retries of unprocessed items')
+    parser.add_argument('--chunk-size', type=int, default=200000, help='rows sorted in memory at a time')
+    arguments = parser.parse_args()
+    if not arguments.table and not arguments.snapshot:
+        parser.error('nothing to do: give --table and/or --snapshot')
+
+    writer = None
+    if arguments.table:
+        import boto3
+        writer = BatchWriter(boto3.client('dynamodb'), arguments.table, arguments.workers, arguments.max_retries)
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        runs = sorted_runs(arguments.files, arguments.chunk_size, directory)
+
+        def records():
+            for name, pseudonyms in merged_records(runs):
+                if writer is not None:
+                    writer.put(name, pseudonyms)
+                yield name, pseudonyms
+
+        if arguments.snapshot:
+            count = name_snapshot.write(records(), arguments.snapshot)
+            print('wrote {} names to {}'.format(count, arguments.snapshot))
+        else:
+            count = sum(1 for record in records())
+
+        for run in runs:
+            run.close()
+
+    if writer is not None:
+        writer.close()
+        print('wrote {} of {} names to {} ({} failed)'.format(writer.written, count, arguments.table, writer.failed))
+    print('done in {:.1f} s'.format(time.perf_counter() - started))
+    sys.exit(1 if writer is not None and writer.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Regression cases for parse_address.parse, kept out of the Lambda bundle.
+#
+#   python tools/parse_address_cases.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas', 'info'))
+
+import parse_address
+
+test_cases = [
+    { 'input': 'twenty two thousand four hundred seventeen thirty second avenue south apartment three thirty three b. seattle washington nine eight one seven eight dash two two four nine',
+      'expected': '22417 32nd avenue south apartment 333 b seattle washington 98178-2249'
+    },
+    { 'input': 'two forty two thirty second avenue south apartment three thirty three b. seattle washington nine eight one seven eight dash two two four nine',
+      'expected': '242 32nd avenue south apartment 333 b seattle washington 98178-2249'
+    },
+    { 'input': 'it is twenty twenty two two hundredth avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2022 200th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty twenty two hundredth avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2020 200th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty two hundred two hundredth avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2200 200th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty twenty two fortieth avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2022 40th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty twenty two fifty seventh avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2022 57th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty twenty fifty seventh avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2020 57th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty twenty two one hundred fifty seventh avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2022 157th avenue apartment 301-304 b omaha nebraska 34567 please thank you'
+    },
+    { 'input': 'it is twenty twenty two one hundred and fifty seventh avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2022 157th avenue apartment 301-304 b omaha nebraska 34567 please thank you',
+    },
+    { 'input': 'it is twenty twenty two seventh avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven please and thank you',
+      'expected': 'it is 2022 7th avenue apartment 301-304 b omaha nebraska 34567 please thank you',
+    },
+    { 'input': 'seventy four seventh avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven',
+      'expected': '74 7th avenue apartment 301-304 b omaha nebraska 34567',
+    },
+    { 'input': 'four twenty five and one half hill street santa monica california nine oh four oh five',
+      'expected': '425 1/2 hill street santa monica california 90405'
+    },
+    { 'input': 'four twenty five and a half hill street santa monica california nine oh four oh five',
+      'expected': '425 1/2 hill street santa monica california 90405'
+    },
+    { 'input': 'it is twenty twenty fortieth avenue apartment three oh one dash three oh four b. omaha nebraska three four five six seven dash four oh four seven please and thank you',
+      'expected': 'it is 2020 40th avenue apartment 301-304 b omaha nebraska 34567-4047 please thank you'
+    },
+    { 'input': 'twenty four eighty northwest twenty third street miami florida three three one four two',
+      'expected': '2480 northwest 23rd street miami florida 33142'
+    },
+    { 'input': 'three one two randolph street dakota iowa five one oh three oh',
+      'expected': '312 randolph street dakota iowa 51030'
+    },
+    { 'input': 'three one oh randolph street dakota iowa five one oh three oh',
+      'expected': '310 randolph street dakota iowa 51030'
+    }
+]
+
+
+def parse_tests():
+    failures = 0
+    for index, test in enumerate(test_cases):
+        result = parse_address.parse(test['input'])
+        if result != test['expected']:
+            failures += 1
+            print('TEST #{:03d} - ERROR: {}'.format(index, result))
+        else:
+            print('TEST #{:03d} - SUCCESS: {}'.format(index, result))
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if parse_tests() else 0)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Replays recorded Lex V2 code hook events through handler.handler against local
+# stand-ins for Amazon Location, DynamoDB and SNS, printing each dialog action.
+#
+#   python tools/replay.py tools/events/request_brochure.json --latency-ms 80
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import standins
+
+EVENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'events')
+
+
+class LocalContext:
+    # the parts of the Lambda context object the handlers use
+    function_name = 'getInfo-local'
+    aws_request_id = 'local'
+
+    def __init__(self, timeout_ms=10000):
+        self.deadline = time.monotonic() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+def load_events(paths):
+    # each file holds one event, or a list of events (the turns of one conversation)
+    events = []
+    for path in paths or sorted(glob.glob(os.path.join(EVENTS_DIR, '*.json'))):
+        with open(path) as f:
+            loaded = json.load(f)
+        for event in (loaded if isinstance(loaded, list) else [loaded]):
+            if 'sessionState' in event:
+                events.append(event)
+    return events
+
+
+def replay(events, timeout_ms=10000):
+    import handler
+
+    results = []
+    for event in events:
+        event = json.loads(json.dumps(event))  # handlers modify the event in place
+        started = time.perf_counter()
+        response = handler.handler(event, LocalContext(timeout_ms))
+        results.append((event, response, time.perf_counter() - started))
+    return results
+
+
+def describe(response):
+    if response is None:
+        return '<no response>'
+    dialog_action = response['sessionState']['dialogAction']
+    action = dialog_action['type']
+    if 'slotToElicit' in dialog_action:
+        action += ' ' + dialog_action['slotToElicit']
+    messages = ' | '.join(message['content'] for message in response.get('messages', None) or [])
+    return '{}: {}'.format(action, messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay Lex events through the getInfo handler')
+    parser.add_argument('events', nargs='*', help='event files (default: tools/events/*.json)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated AWS call latency')
+    parser.add_argument('--timeout-ms', type=int, default=10000, help='simulated Lambda timeout')
+    parser.add_argument('--json', action='store_true', help='print full responses')
+    arguments = parser.parse_args()
+
+    clients = standins.install(arguments.latency_ms)
+    for event, response, seconds in replay(load_events(arguments.events), arguments.timeout_ms):
+        print('[{:7.1f} ms] {} / {!r}'.format(seconds * 1000, event['sessionState']['intent']['name'], event.get('inputTranscript', '')))
+        print('    ' + (json.dumps(response) if arguments.json else describe(response)))
+
+    calls = {name: len(client.calls) for name, client in clients.items()}
+    print('AWS calls: {}'.format(calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+# Local stand-ins for the AWS clients used by the Lambdas, so recorded events can be
+# replayed (and timed) without an AWS account. Every call sleeps for latency_ms to
+# simulate the service round trip, or for tail_ms in a tail_rate share of the calls.
+# Stand-ins handed out with a read timeout (deadline.client) raise botocore's
+# ReadTimeoutError after the timeout when the simulated latency is longer.
+
+import copy
+import os
+import random
+import re
+import sys
+import time
+
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+LAMBDAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas')
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, 'common'))
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, 'info'))
+sys.path.insert(0, LAMBDAS_DIR)
+
+
+class StandIn:
+    def __init__(self, latency_ms=0, tail_ms=0, tail_rate=0):
+        self.latency_ms = latency_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.read_timeout = None
+        self.calls = []
+
+    def bounded(self, read_timeout):
+        # the same stand-in (calls and items are shared) with a read timeout
+        if read_timeout is None:
+            return self
+        view = copy.copy(self)
+        view.read_timeout = read_timeout
+        return view
+
+    def _call(self, name, parameters):
+        self.calls.append((name, parameters))
+        latency_ms = self.latency_ms
+        if self.tail_rate and random.random() < self.tail_rate:
+            latency_ms = self.tail_ms
+        if self.read_timeout is not None and latency_ms > self.read_timeout * 1000:
+            time.sleep(self.read_timeout)
+            raise ReadTimeoutError(endpoint_url='stand-in://' + name)
+        if latency_ms:
+            time.sleep(latency_ms / 1000.0)
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class StandInLocation(StandIn):
+    # answers every query with the address it was asked for: "<number> <street> ... <zip>"
+    class exceptions:
+        ResourceNotFoundException = ResourceNotFoundException
+
+    def search_place_index_for_text(self, **parameters):
+        self._call('search_place_index_for_text', parameters)
+        match = re.search(r'^\s*(\d+)\s+(.*?)\s+(\d{5})\s*$', parameters['Text'])
+        if match is None:
+            return {'Results': []}
+        number, street, postal_code = match.groups()
+        street = street.title()
+        return {'Results': [{
+            'Place': {
+                'Label': '{} {}, {}'.format(number, street, postal_code),
+                'AddressNumber': number,
+                'Street': street,
+                'PostalCode': postal_code,
+                'Municipality': 'Anytown',
+                'Region': 'Washington',
+                'Country': 'USA'
+            },
+            'Relevance': 1.0
+        }]}
+
+    def create_place_index(self, **parameters):
+        self._call('create_place_index', parameters)
+        return {}
+
+
+class StandInTable(StandIn):
+    def __init__(self, key_name, latency_ms=0, tail_ms=0, tail_rate=0):
+        super().__init__(latency_ms, tail_ms, tail_rate)
+        self.key_name = key_name
+        self.items = {}
+
+    def put_item(self, Item, **parameters):
+        self._call('put_item', dict(parameters, Item=Item))
+        self.items[Item[self.key_name]] = Item
+        return {}
+
+    def get_item(self, Key, **parameters):
+        self._call('get_item', dict(parameters, Key=Key))
+        item = self.items.get(Key[self.key_name], None)
+        if item is None:
+            return {}
+        projection = parameters.get('ProjectionExpression', None)
+        if projection:
+            names = parameters.get('ExpressionAttributeNames', {})
+            fields = [names.get(field.strip(), field.strip()) for field in projection.split(',')]
+            item = {field: item[field] for field in fields if field in item}
+        return {'Item': item}
+
+
+class StandInDynamoDB(StandIn):
+    # boto3.resource('dynamodb') stand-in; tables are created on first use
+    def __init__(self, latency_ms=0, key_names=None, tail_ms=0, tail_rate=0):
+        super().__init__(latency_ms, tail_ms, tail_rate)
+        self.key_names = key_names or {}
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            table = StandInTable(self.key_names.get(name, 'address'), self.latency_ms, self.tail_ms, self.tail_rate)
+            table.calls = self.calls  # table calls are counted on the resource
+            self.tables[name] = table
+        return self.tables[name].bounded(self.read_timeout)
+
+
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, operation_name):
+        super().__init__({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, operation_name)
+
+
+class StandInDynamoDBClient(StandIn):
+    # boto3.client('dynamodb') stand-in for single-item reads, writes and SET updates;
+    # items are kept in the low-level attribute value format. Tables are keyed by their
+    # first attribute unless listed in KEY_ATTRIBUTES. Of a ConditionExpression only a
+    # leading attribute_not_exists() is checked.
+    KEY_ATTRIBUTES = {'sessionTable': ('sessionId', 'version')}
+
+    def __init__(self, latency_ms=0, tail_ms=0, tail_rate=0):
+        super().__init__(latency_ms, tail_ms, tail_rate)
+        self.tables = {}
+
+    def _key(self, TableName, attributes):
+        names = self.KEY_ATTRIBUTES.get(TableName, None) or (next(iter(attributes)),)
+        return tuple(next(iter(attributes[name].values())) for name in names)
+
+    def _check(self, operation_name, item, parameters):
+        if item is not None and parameters.get('ConditionExpression', '').startswith('attribute_not_exists'):
+            raise ConditionalCheckFailedException(operation_name)
+
+    def get_item(self, TableName, Key, **parameters):
+        self._call('get_item', dict(parameters, TableName=TableName, Key=Key))
+        item = self.tables.get(TableName, {}).get(self._key(TableName, Key), None)
+        if item is None:
+            return {}
+        projection = parameters.get('ProjectionExpression', None)
+        if projection:
+            names = parameters.get('ExpressionAttributeNames', {})
+            fields = [names.get(field.strip(), field.strip()) for field in projection.split(',')]
+            item = {field: item[field] for field in fields if field in item}
+        return {'Item': item}
+
+    def put_item(self, TableName, Item, **parameters):
+        self._call('put_item', dict(parameters, TableName=TableName, Item=Item))
+        items = self.tables.setdefault(TableName, {})
+        key = self._key(TableName, Item)
+        self._check('PutItem', items.get(key, None), parameters)
+        items[key] = dict(Item)
+        return {}
+
+    def delete_item(self, TableName, Key, **parameters):
+        self._call('delete_item', dict(parameters, TableName=TableName, Key=Key))
+        self.tables.get(TableName, {}).pop(self._key(TableName, Key), None)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues, **parameters):
+        self._call('update_item', dict(parameters, TableName=TableName, Key=Key, UpdateExpression=UpdateExpression))
+        item = self.tables.setdefault(TableName, {}).setdefault(self._key(TableName, Key), dict(Key))
+        for assignment in UpdateExpression[len('SET '):].split(','):
+            name, value = [part.strip() for part in assignment.split('=')]
+            item[ExpressionAttributeNames.get(name, name)] = ExpressionAttributeValues[value]
+        return {}
+
+
+class StandInSNS(StandIn):
+    def subscribe(self, **parameters):
+        self._call('subscribe', parameters)
+        return {'SubscriptionArn': 'pending confirmation'}
+
+
+class StandInSecretsManager(StandIn):
+    def __init__(self, secrets, latency_ms=0, tail_ms=0, tail_rate=0):
+        super().__init__(latency_ms, tail_ms, tail_rate)
+        self.secrets = secrets
+
+    def get_secret_value(self, SecretId, **parameters):
+        self._call('get_secret_value', dict(parameters, SecretId=SecretId))
+        return {'SecretString': self.secrets[SecretId]}
+
+
+class StandInSQS(StandIn):
+    def __init__(self, latency_ms=0, tail_ms=0, tail_rate=0):
+        super().__init__(latency_ms, tail_ms, tail_rate)
+        self.messages = []
+
+    def send_message(self, **parameters):
+        self._call('send_message', parameters)
+        self.messages.append(parameters)
+        return {'MessageId': 'message-{}'.format(len(self.messages))}
+
+
+def install(latency_ms=0, tail_ms=0, tail_rate=0):
+    # points the getInfo modules at stand-in clients; returns them for inspection
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('INDEX_NAME', 'AddressPlaceIndex')
+    os.environ.setdefault('ADDRESS_TABLE', 'addressTable')
+    os.environ.setdefault('TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:emailSubscriptionTopic')
+    os.environ.setdefault('PROFILE_TABLE', 'callerProfileTable')
+    os.environ.setdefault('IDEMPOTENCY_TABLE', 'idempotencyTable')
+    os.environ.setdefault('VERIFICATION_QUEUE_URL', 'https://sqs.us-east-1.amazonaws.com/123456789012/addressVerificationQueue')
+    os.environ.setdefault('CALLER_HASH_KEY_SECRET', 'callerHashKey')
+
+    import aws_clients
+
+    standins = {
+        'location': StandInLocation(latency_ms, tail_ms, tail_rate),
+        'dynamodb': StandInDynamoDB(latency_ms, tail_ms=tail_ms, tail_rate=tail_rate),
+        'sns': StandInSNS(latency_ms, tail_ms, tail_rate),
+        'profiles': StandInDynamoDBClient(latency_ms, tail_ms, tail_rate),
+        'sqs': StandInSQS(latency_ms, tail_ms, tail_rate),
+        'secretsmanager': StandInSecretsManager({os.environ['CALLER_HASH_KEY_SECRET']: 'local-caller-hash-key'})
+    }
+    clients = {name: standins[name] for name in ('location', 'sns', 'sqs', 'secretsmanager')}
+    clients['dynamodb'] = standins['profiles']
+    aws_clients.client = lambda service_name, read_timeout=None: clients[service_name].bounded(read_timeout)
+    aws_clients.resource = lambda service_name, read_timeout=None: standins[service_name].bounded(read_timeout)
+    return standins
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Builds the end-of-speech timeout policy table of speech_timeouts from its per-turn
+# metrics (the SpeechTurns / SpeechNoMatch / SpeechTruncated EMF lines of getInfo).
+# For each intent, slot and retry stage it keeps the timeout with the lowest expected
+# time per answer, timeout + failure rate * --retry-cost-ms, among the timeouts tried on
+# at least --min-turns turns whose failure rate (no match or cut off transcript) is not
+# above the one of the current timeout plus --tolerance. Timeouts other than the
+# current one are only tried with an exploreRate in the table.
+#
+#   python tools/tune_speech_timeouts.py getInfo.log ...            (exported log lines)
+#   python tools/tune_speech_timeouts.py --log-group /aws/lambda/<getInfo> --hours 24 \
+#       --parameter <speechTimeoutPolicyName> [--put]
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambdas', 'common'))
+
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import speech_timeouts
+
+
+def metric_record(line):
+    # the EMF record of a log line, which may be prefixed by the Lambda timestamp and ids
+    start = line.find('{')
+    if start < 0:
+        return None
+    try:
+        record = json.loads(line[start:])
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) and 'SpeechTurns' in record else None
+
+
+def file_lines(paths):
+    for path in paths:
+        with open(path) as log_file:
+            for line in log_file:
+                yield line
+
+
+def log_group_lines(log_group, hours):
+    import boto3
+    logs = boto3.client('logs')
+    parameters = {
+        'logGroupName': log_group,
+        'startTime': int((time.time() - hours * 3600) * 1000),
+        'filterPattern': '{ $.SpeechTurns = 1 }'
+    }
+    while True:
+        response = logs.filter_log_events(**parameters)
+        for event in response['events']:
+            yield event['message']
+        if not response.get('nextToken', None):
+            return
+        parameters['nextToken'] = response['nextToken']
+
+
+def outcomes(lines):
+    # (intent, slot, stage) -> timeout -> [turns, failed turns]
+    counts = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for line in lines:
+        record = metric_record(line)
+        if record is None:
+            continue
+        entry = counts[(record['Intent'], record['Slot'], record['Stage'])][int(record['TimeoutMs'])]
+        entry[0] += 1
+        entry[1] += int(bool(record.get('SpeechNoMatch', 0) or record.get('SpeechTruncated', 0)))
+    return counts
+
+
+def current_policy(parameter):
+    if parameter is None:
+        return speech_timeouts.DEFAULT_POLICY
+    import boto3
+    return speech_timeouts.parse_policy(boto3.client('ssm').get_parameter(Name=parameter)['Parameter']['Value'])
+
+
+def current_timeout(policy, intent_name, slot, stage, tried):
+    value = speech_timeouts.configured_ms(policy, intent_name, slot, stage)
+    # without an entry, the timeout tried most often
+    return value if value is not None else max(tried, key=lambda timeout: tried[timeout][0])
+
+
+def tune(policy, counts, arguments):
+    timeouts = {name: dict(stages) for name, stages in policy['timeouts'].items()}
+    for (intent_name, slot, stage), tried in sorted(counts.items()):
+        current = current_timeout(policy, intent_name, slot, stage, tried)
+        turns, failed = tried.get(current, (0, 0))
+        if turns < arguments.min_turns:
+            print('{}:{} {:32} {:5d} ms  {:5d} turns, too few to tune'.format(intent_name, slot, stage, current, turns))
+            continue
+        baseline = failed / turns
+
+        best, best_cost = current, current + baseline * arguments.retry_cost_ms
+        for timeout, (turns, failed) in sorted(tried.items()):
+            rate = failed / turns
+            cost = timeout + rate * arguments.retry_cost_ms
+            eligible = turns >= arguments.min_turns and rate <= baseline + arguments.tolerance
+            print('{}:{} {:32} {:5d} ms  {:5d} turns  failed {:5.1%}  expected {:6.0f} ms{}'.format(
+                intent_name, slot, stage, timeout, turns, rate, cost, '' if eligible else '  (not eligible)'))
+            if eligible and cost < best_cost:
+                best, best_cost = timeout, cost
+
+        if best != current:
+            print('  -> {} ms (was {} ms)'.format(best, current))
+        timeouts.setdefault('{}:{}'.format(intent_name, slot), {})[stage] = best
+
+    tuned = dict(policy, timeouts=timeouts)
+    if arguments.explore_rate is not None:
+        tuned['exploreRate'] = arguments.explore_rate
+    return tuned
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tune the end-of-speech timeout policy from getInfo metrics')
+    parser.add_argument('logs', nargs='*', help='files of getInfo log lines')
+    parser.add_argument('--log-group', help='read the metrics from this log group instead')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--parameter', help='SSM parameter of the policy (the speechTimeoutPolicyName stack output)')
+    parser.add_argument('--min-turns', type=int, default=200, help='turns needed to judge a timeout')
+    parser.add_argument('--tolerance', type=float, default=0.005, help='failure rate increase allowed over the current timeout')
+    parser.add_argument('--retry-cost-ms', type=float, default=8000, help='call time added by a failed answer (reprompt and new answer)')
+    parser.add_argument('--explore-rate', type=float, help='share of elicitations trying a neighbouring timeout')
+    parser.add_argument('--put', action='store_true', help='write the tuned table to --parameter')
+    arguments = parser.parse_args()
+
+    lines = log_group_lines(arguments.log_group, arguments.hours) if arguments.log_group else file_lines(arguments.logs)
+    tuned = tune(current_policy(arguments.parameter), outcomes(lines), arguments)
+    document = json.dumps(tuned, indent=2, sort_keys=True)
+    print(document)
+
+    if arguments.put:
+        if arguments.parameter is None:
+            raise SystemExit('--put needs --parameter')
+        import boto3
+        boto3.client('ssm').put_parameter(Name=arguments.parameter, Value=document, Type='String', Overwrite=True)
+        print('updated {}'.format(arguments.parameter))
+
+
+if __name__ == '__main__':
+    main()
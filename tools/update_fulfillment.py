@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Applies the fulfillment code hook settings of tools/fulfillment_updates.json (the
+# start and update messages Lex plays while the fulfillment Lambda runs) to the intents
+# of the draft GetInfo bot, and builds the locale. The exported bot definition in the
+# repository is encrypted, so the settings are kept here in the shape of the exported
+# Intent.json "fulfillmentCodeHook". Deploy with the "fulfillmentUpdates" context set
+# to true, so getAddress moves its slow steps into the fulfillment code hook.
+#
+#   python tools/update_fulfillment.py --bot-id <botId> [--locale en_US] [--dry-run]
+
+import argparse
+import json
+import os
+
+import boto3
+
+SETTINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fulfillment_updates.json')
+
+# fields of describe_intent that update_intent does not take
+READ_ONLY = ('creationDateTime', 'lastUpdatedDateTime', 'ResponseMetadata')
+
+
+def intent_ids(lex, bot_id, locale):
+    ids = {}
+    parameters = {'botId': bot_id, 'botVersion': 'DRAFT', 'localeId': locale}
+    while True:
+        response = lex.list_intents(**parameters)
+        for summary in response['intentSummaries']:
+            ids[summary['intentName']] = summary['intentId']
+        if not response.get('nextToken', None):
+            return ids
+        parameters['nextToken'] = response['nextToken']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='configure Lex fulfillment updates for the GetInfo bot')
+    parser.add_argument('--bot-id', required=True)
+    parser.add_argument('--locale', default='en_US')
+    parser.add_argument('--settings', default=SETTINGS)
+    parser.add_argument('--dry-run', action='store_true', help='print the intents, do not update the bot')
+    arguments = parser.parse_args()
+
+    with open(arguments.settings) as settings_file:
+        settings = json.load(settings_file)
+
+    lex = boto3.client('lexv2-models')
+    ids = intent_ids(lex, arguments.bot_id, arguments.locale)
+    for intent_name, hook in settings.items():
+        if intent_name not in ids:
+            raise SystemExit('intent {} not found in bot {} {}'.format(intent_name, arguments.bot_id, arguments.locale))
+        intent = lex.describe_intent(intentId=ids[intent_name], botId=arguments.bot_id, botVersion='DRAFT', localeId=arguments.locale)
+        for field in READ_ONLY:
+            intent.pop(field, None)
+        intent['fulfillmentCodeHook'] = hook
+        if arguments.dry_run:
+            print(json.dumps(intent, indent=2, default=str))
+            continue
+        lex.update_intent(**intent)
+        print('updated {}'.format(intent_name))
+
+    if not arguments.dry_run:
+        lex.build_bot_locale(botId=arguments.bot_id, botVersion='DRAFT', localeId=arguments.locale)
+        print('building {} {}'.format(arguments.bot_id, arguments.locale))
+
+
+if __name__ == '__main__':
+    main()